@@ -2,17 +2,27 @@
 
 # Copyright 2025 Canonical Ltd.
 # See LICENSE file for licensing details.
-"""Check for stale servers with prefix."""
+"""Check for stale servers with prefix.
+
+The API work is done by the collector (--collect), run by the cloudsupport-stale-collector
+systemd timer, which atomically writes the test servers to a status file. The nrpe check
+only evaluates that file, so a slow Nova API can not make the check time out; instead the
+check reports when the collected data itself is stale.
+"""
 
 import argparse
 import datetime
+import json
+import logging
 import os
 import re
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
 
-import openstack
-import yaml
+STATUS_FILE = "/var/lib/cloudsupport/stale_servers.json"
+CLOUDS_YAML = "/etc/openstack/clouds.yaml"
 
 
 class NrpeStatus(IntEnum):
@@ -27,39 +37,106 @@ class NrpeStatus(IntEnum):
 def nrpe_check():
     """Perform the nrpe check."""
     args = parse_args()
+    try:
+        with open(args.status_file) as fp:
+            status = json.load(fp)
+    except FileNotFoundError:
+        print("UNKNOWN: no stale server data collected yet in {}".format(args.status_file))
+        sys.exit(NrpeStatus.UNKNOWN)
+    except (OSError, ValueError) as error:
+        print("UNKNOWN: cannot read {}: {}".format(args.status_file, error))
+        sys.exit(NrpeStatus.UNKNOWN)
+
+    collected = status.get("clouds", {})
+    try:
+        # the file may still hold clouds removed from clouds.yaml since the last collection
+        clouds = list_clouds() if args.cloud_name == "all" else args.cloud_name.split(",")
+    except (OSError, ValueError) as error:
+        print("UNKNOWN: cannot read {}: {}".format(CLOUDS_YAML, error))
+        sys.exit(NrpeStatus.UNKNOWN)
+    exit_code = NrpeStatus.OK
+    messages, perfdata = [], []
+    for cloud in clouds:
+        code, cloud_messages, cloud_perfdata = check_cloud(cloud, collected.get(cloud), args)
+        exit_code = max(exit_code, code)
+        messages.extend(cloud_messages)
+        perfdata.extend(cloud_perfdata)
+    if exit_code == 0:
+        messages.insert(0, "OK: No stale instances found.")
+    # nagios reads the perfdata after the first line
+    print("{} | {}".format(messages[0], " ".join(perfdata)))
+    for message in messages[1:]:
+        print(message)
+    sys.exit(exit_code)
+
+
+def check_cloud(cloud, status, args):
+    """Evaluate the collected servers of one cloud.
+
+    :param cloud: name of the cloud
+    :param status: collected status of the cloud, None if never collected
+    :param args: parsed command line arguments
+    :return: (exit code, messages, perfdata)
+    """
+    if status is None:
+        return NrpeStatus.UNKNOWN, ["UNKNOWN: {}: no data collected yet".format(cloud)], []
     crit_servers, warn_servers = get_stale_servers(
-        args.name_prefix, args.crit_days, args.warn_days, args.ignored_servers_uuids
+        status["servers"], args.crit_days, args.warn_days, args.ignored_servers_uuids
     )
+    data_age = time.time() - status["collected-at"]
     exit_code = NrpeStatus.OK
+    messages = []
     if crit_servers:
-        print(
-            "CRITICAL: {} test servers older than {} days. "
+        messages.append(
+            "CRITICAL: {}: {} test servers older than {} days. "
             "Check and delete the following instances: {}".format(
+                cloud,
                 len(crit_servers),
                 args.crit_days,
-                ",".join([server.id for server in crit_servers]),
+                ",".join([server["id"] for server in crit_servers]),
             )
         )
         exit_code = max(exit_code, NrpeStatus.CRITICAL)
     if warn_servers:
-        print(
-            "WARNING: {} test servers older than {} days. "
+        messages.append(
+            "WARNING: {}: {} test servers older than {} days. "
             "Check and delete the following instances: {}".format(
+                cloud,
                 len(warn_servers),
                 args.warn_days,
-                ",".join([server.id for server in warn_servers]),
+                ",".join([server["id"] for server in warn_servers]),
             )
         )
         exit_code = max(exit_code, NrpeStatus.WARNING)
-    if exit_code == 0:
-        print("OK: No stale instances found.")
-    sys.exit(exit_code)
+    if data_age > args.max_age * 60:
+        reason = ""
+        if status.get("last-error"):
+            reason = ", last collection failed: {}".format(status["last-error"])
+        messages.append(
+            "WARNING: {}: stale server data is {} minutes old{}".format(
+                cloud, int(data_age // 60), reason
+            )
+        )
+        exit_code = max(exit_code, NrpeStatus.WARNING)
+    perfdata = [
+        "{}_servers={}".format(cloud, len(status["servers"])),
+        "{}_stale_warn={}".format(cloud, len(warn_servers)),
+        "{}_stale_crit={}".format(cloud, len(crit_servers)),
+        "{}_data_age={}s;{}".format(cloud, int(data_age), args.max_age * 60),
+    ]
+    return exit_code, messages, perfdata
 
 
 def parse_args():
     """Parse the command line arguments."""
     ap = argparse.ArgumentParser()
-    ap.add_argument("--cloud-name", dest="cloud_name", type=str, required=True)
+    ap.add_argument(
+        "--cloud-name",
+        dest="cloud_name",
+        type=str,
+        required=True,
+        help="Comma separated list of clouds in clouds.yaml, or all.",
+    )
     ap.add_argument("--name-prefix", dest="name_prefix", type=str, required=True)
     ap.add_argument("--warn-days", dest="warn_days", type=int, default=7)
     ap.add_argument("--crit-days", dest="crit_days", type=int, default=14)
@@ -71,58 +148,129 @@ def parse_args():
         default=None,
         help="Comma separated list of servers uuids to ignore.",
     )
+    ap.add_argument("--status-file", dest="status_file", type=str, default=STATUS_FILE)
+    ap.add_argument(
+        "--max-age",
+        dest="max_age",
+        type=int,
+        default=30,
+        help="Minutes after which the collected data is reported as stale.",
+    )
+    ap.add_argument(
+        "--collect",
+        action="store_true",
+        help="Collect the test servers into the status file instead of checking it.",
+    )
     return ap.parse_args()
 
 
-def get_stale_servers(name_prefix, crit_days, warn_days, ignored_servers=None):
-    """Get the stale servers."""
+def get_stale_servers(servers, crit_days, warn_days, ignored_servers=None):
+    """Get the stale servers.
+
+    :param servers: collected test servers, dictionaries with id and updated_at
+    :return: (critical, warning) lists of servers
+    """
     crit_servers = []
     warn_servers = []
-    server_search_pattern = "^{}".format(re.escape(name_prefix))
-    con = openstack.connect(
-        cloud="envvars", cacert=os.environ.get("OS_CACERT", "/etc/openstack/ssl_ca.crt")
-    )
-    servers = con.compute.servers(name=server_search_pattern)
     ignored_servers_uuids = []
     if ignored_servers:
         ignored_servers_uuids = ignored_servers.split(",")
     for s in servers:
         # skip ignored servers
-        if s.id in ignored_servers_uuids:
+        if s["id"] in ignored_servers_uuids:
             continue
-        if s.name.startswith(name_prefix):
-            updated_at = datetime.datetime.strptime(s.updated_at, "%Y-%m-%dT%H:%M:%SZ")
-            uptime = datetime.datetime.utcnow() - updated_at
-            if uptime.days > crit_days:
-                crit_servers.append(s)
-            elif uptime.days > warn_days:
-                warn_servers.append(s)
+        updated_at = datetime.datetime.strptime(s["updated_at"], "%Y-%m-%dT%H:%M:%SZ")
+        uptime = datetime.datetime.utcnow() - updated_at
+        if uptime.days > crit_days:
+            crit_servers.append(s)
+        elif uptime.days > warn_days:
+            warn_servers.append(s)
     return crit_servers, warn_servers
 
 
-if __name__ == "__main__":
-    # source environment vars
-    if not os.path.exists("/etc/openstack/clouds.yaml"):
-        print("UNKNOWN: /etc/openstack/clouds.yaml not found")
-        sys.exit(NrpeStatus.UNKNOWN)
+def collect_servers(name_prefix, cloud_name):
+    """Query the test servers with prefix.
 
-    with open("/etc/openstack/clouds.yaml", "r") as cloud_config:
-        config = yaml.safe_load(cloud_config)
+    :return: list of dictionaries with the id, name and updated_at of the servers
+    """
+    # only the collector needs the sdk, keep the check itself fast
+    import token_cache
 
-    if "clouds" not in config:
-        print("UNKNOWN: clouds.yaml unknown format")
-        sys.exit(NrpeStatus.UNKNOWN)
+    server_search_pattern = "^{}".format(re.escape(name_prefix))
+    # the token of cloud_name is cached by the charm, see token_cache
+    con = token_cache.connect(
+        cloud_name, cacert=os.environ.get("OS_CACERT", "/etc/openstack/ssl_ca.crt")
+    )
+    return [
+        {"id": s.id, "name": s.name, "updated_at": s.updated_at}
+        for s in con.compute.servers(name=server_search_pattern)
+        if s.name.startswith(name_prefix)
+    ]
 
-    args = parse_args()
-    cloud_name = args.cloud_name
 
-    auth_info = config["clouds"].get(cloud_name)
+def write_status(path, status):
+    """Atomically write the status file, readable by the nagios user."""
+    tmp = "{}.tmp".format(path)
+    with open(tmp, "w") as fp:
+        json.dump(status, fp)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def collect(args):
+    """Collect the test servers of the clouds into the status file.
+
+    The clouds are queried concurrently. A failed collection keeps the last collected
+    servers of the cloud and records the error, so that the check reports its data as
+    stale with the reason. Clouds that are no longer collected are dropped.
+    """
+    try:
+        with open(args.status_file) as fp:
+            status = json.load(fp)
+    except (OSError, ValueError):
+        status = {}
+    collected = status.setdefault("clouds", {})
+    clouds = list_clouds() if args.cloud_name == "all" else args.cloud_name.split(",")
+    for cloud in set(collected) - set(clouds):
+        del collected[cloud]
+    attempt = time.time()
+    failed = False
+    # clouds.yaml may define no cloud, the executor needs at least one worker
+    with ThreadPoolExecutor(max_workers=max(1, len(clouds))) as executor:
+        futures = {
+            cloud: executor.submit(collect_servers, args.name_prefix, cloud) for cloud in clouds
+        }
+        for cloud, future in futures.items():
+            cloud_status = collected.setdefault(cloud, {"servers": [], "collected-at": 0})
+            cloud_status["last-attempt"] = attempt
+            try:
+                cloud_status["servers"] = future.result()
+            except Exception as error:
+                logging.exception("failed to collect the test servers of %s", cloud)
+                cloud_status["last-error"] = str(error)
+                failed = True
+                continue
+            cloud_status["collected-at"] = attempt
+            cloud_status.pop("last-error", None)
+    write_status(args.status_file, status)
+    if failed:
+        sys.exit(1)
 
-    if not auth_info or "auth" not in auth_info:
-        print("UNKNOWN: {} is missing auth info in clouds.yaml").format(cloud_name)
-        sys.exit(NrpeStatus.UNKNOWN)
 
-    auth = auth_info["auth"]
-    for key in auth:
-        os.environ["OS_" + key.upper()] = auth[key]
-    nrpe_check()
+def list_clouds():
+    """Return the names of all clouds in clouds.yaml."""
+    import yaml
+
+    with open(CLOUDS_YAML, "r") as cloud_config:
+        config = yaml.safe_load(cloud_config)
+    if not isinstance(config, dict) or "clouds" not in config:
+        raise ValueError("clouds.yaml unknown format")
+    return sorted(config["clouds"])
+
+
+if __name__ == "__main__":
+    if "--collect" in sys.argv:
+        logging.basicConfig(level=logging.INFO)
+        collect(parse_args())
+    else:
+        nrpe_check()
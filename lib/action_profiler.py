@@ -0,0 +1,201 @@
+"""This module contains the profiling switch of the charm actions.
+
+An action run with profile=true runs under cProfile, which traces every call of the main
+thread, while a sampler thread records the stacks of all threads. The executor threads
+doing the SSH and API calls are only visible in the samples. Both are written to
+PROFILE_DIR: the pstats file for pstats/snakeviz, and the collapsed stacks for
+flamegraph.pl or speedscope.
+"""
+
+import cProfile
+import collections
+import functools
+import json
+import logging
+import os
+import pathlib
+import pstats
+import sys
+import threading
+import time
+
+PROFILE_DIR = pathlib.Path("/var/lib/cloudsupport/profiles")
+# seconds between two stack samples
+SAMPLE_INTERVAL = 0.005
+# number of hot functions reported in the action results
+TOP_N = 15
+
+
+def _frame_label(frame):
+    """Return the "file:function" label of a stack frame."""
+    return "{}:{}".format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+
+
+def collapsed_stack(frame):
+    """Return the stack of a frame in collapsed format, outermost frame first."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def _idle_worker(frame):
+    """Check whether a frame is an executor worker waiting for work."""
+    return frame.f_code.co_name == "_worker" and frame.f_code.co_filename.endswith(
+        os.path.join("concurrent", "futures", "thread.py")
+    )
+
+
+class StackSampler(threading.Thread):
+    """Thread counting the collapsed stacks of all other threads."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        """Construct the sampler.
+
+        :param interval: seconds between two samples
+        """
+        super().__init__(name="stack-sampler", daemon=True)
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        """Sample until stopped."""
+        while not self._stop_event.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident or _idle_worker(frame):
+                    continue
+                self.stacks[collapsed_stack(frame)] += 1
+
+    def stop(self):
+        """Stop sampling and wait for the thread to end."""
+        self._stop_event.set()
+        self.join()
+
+
+def top_functions(stacks, top=TOP_N):
+    """Return the functions seen in most samples, across all threads.
+
+    :param stacks: Counter of collapsed stacks
+    :param top: number of functions
+    :return: list of "total% self% file:function" strings, by decreasing total
+    """
+    total = sum(stacks.values())
+    if not total:
+        return []
+    inclusive = collections.Counter()
+    own = collections.Counter()
+    for stack, count in stacks.items():
+        labels = stack.split(";")
+        own[labels[-1]] += count
+        for label in set(labels):
+            inclusive[label] += count
+    return [
+        "{:5.1f}% {:5.1f}% {}".format(count * 100 / total, own[label] * 100 / total, label)
+        for label, count in sorted(inclusive.items(), key=lambda item: (-item[1], item[0]))[:top]
+    ]
+
+
+def top_calls(stats, top=TOP_N):
+    """Return the functions of the main thread with the most own time.
+
+    :param stats: pstats.Stats
+    :param top: number of functions
+    :return: list of "tottime cumtime ncalls file:line(function)" strings
+    """
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return [
+        "{:.3f}s {:.3f}s {} {}".format(tt, ct, nc, pstats.func_std_string(func))
+        for func, (_, nc, tt, ct, _) in rows
+    ]
+
+
+class ActionProfiler:
+    """Context manager profiling a block and saving the profiles to a directory."""
+
+    def __init__(self, name, directory=PROFILE_DIR, interval=SAMPLE_INTERVAL, top=TOP_N):
+        """Construct the profiler.
+
+        :param name: prefix of the profile files, e.g. the action name
+        :param directory: directory of the profile files
+        :param interval: seconds between two stack samples
+        :param top: number of hot functions in the summary
+        """
+        self.name = name
+        self.directory = pathlib.Path(directory)
+        self.interval = interval
+        self.top = top
+        self.summary = {}
+
+    def __enter__(self):
+        """Start profiling."""
+        self.started = time.monotonic()
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(self.interval)
+        self.sampler.start()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop profiling and save the profiles, whether the block failed or not."""
+        self.profile.disable()
+        self.sampler.stop()
+        self.summary = self.save()
+        return False
+
+    def save(self):
+        """Write the pstats and collapsed stacks files.
+
+        :return: dictionary with the file paths and the hot functions
+        """
+        stem = "{}-{}".format(self.name, time.strftime("%Y%m%dT%H%M%S"))
+        pstats_path = self.directory / "{}.pstats".format(stem)
+        collapsed_path = self.directory / "{}.collapsed".format(stem)
+        stats = pstats.Stats(self.profile)
+        summary = {
+            "seconds": round(time.monotonic() - self.started, 3),
+            "samples": self.sampler.samples,
+            "top-functions": top_functions(self.sampler.stacks, self.top),
+            "top-main-thread": top_calls(stats, self.top),
+        }
+        try:
+            self.directory.mkdir(mode=0o750, parents=True, exist_ok=True)
+            stats.dump_stats(str(pstats_path))
+            collapsed_path.write_text(
+                "".join(
+                    "{} {}\n".format(stack, count)
+                    for stack, count in sorted(self.sampler.stacks.items())
+                )
+            )
+        except OSError as error:
+            logging.warning("Cannot save the profiles: %s", error)
+            summary["error"] = str(error)
+        else:
+            summary["pstats"] = str(pstats_path)
+            summary["collapsed"] = str(collapsed_path)
+        return summary
+
+
+def profiled(handler):
+    """Decorate an action handler to run it under ActionProfiler if profile is set.
+
+    The profile summary is added to the action results as JSON under "profile".
+    """
+
+    @functools.wraps(handler)
+    def wrapper(self, event):
+        if not (event.params or {}).get("profile"):
+            return handler(self, event)
+        name = event.handle.kind[: -len("_action")].replace("_", "-")
+        profiler = ActionProfiler(name, PROFILE_DIR)
+        try:
+            with profiler:
+                return handler(self, event)
+        finally:
+            event.log("profile saved to {}".format(profiler.summary.get("pstats")))
+            event.set_results({"profile": json.dumps(profiler.summary, indent=2)})
+
+    return wrapper
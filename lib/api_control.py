@@ -0,0 +1,282 @@
+"""This module contains the adaptive concurrency and backoff control of cloud API calls.
+
+Bulk operations run many API calls in parallel, which can overload nova-api or
+neutron-server. The in-flight window of the async calls follows AIMD: it grows by about one
+request per window of successful calls and is halved when the API signals overload with
+a 429, 503 or 504. Rejected requests are retried with jittered exponential backoff; a
+Retry-After header holds back all new requests for the given time. Only a 429, or a 503
+with a Retry-After, is known to be rejected before being processed: a bare 503 may come
+from a proxy timing out a request the API did process, and retrying a create would
+duplicate it.
+"""
+
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import openstack.exceptions
+
+# responses of requests rejected before being processed, which are safe to retry, see
+# is_retryable
+RETRY_STATUS = (429, 503)
+# responses signalling an overloaded control plane
+OVERLOAD_STATUS = RETRY_STATUS + (504,)
+
+MAX_RETRIES = 6
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+# minimum seconds between two decreases of the window, so that a burst of throttled
+# responses to requests sent with the same window only halves it once
+DECREASE_INTERVAL = 1.0
+# number of throttling events kept for the report
+MAX_EVENTS = 20
+
+
+def throttle_status(exc):
+    """Return the HTTP status of an overload response, or None for any other error."""
+    if isinstance(exc, openstack.exceptions.HttpException):
+        if exc.status_code in OVERLOAD_STATUS:
+            return exc.status_code
+    return None
+
+
+def is_retryable(exc):
+    """Return whether a failed request was rejected before being processed.
+
+    A 503 is only retried when it carries a Retry-After, as sent by a throttling API,
+    since a bare 503 of a proxy does not tell whether a non-idempotent POST went through.
+
+    :param exc: openstack HttpException
+    """
+    status = throttle_status(exc)
+    if status == 503:
+        return retry_after(exc) is not None
+    return status in RETRY_STATUS
+
+
+def retry_after(exc):
+    """Return the seconds to wait given by the Retry-After header of a response, or None.
+
+    :param exc: openstack HttpException
+    :return: seconds, capped to BACKOFF_CAP
+    """
+    response = getattr(exc, "response", None)
+    value = getattr(response, "headers", None) and response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        seconds = (date - datetime.now(timezone.utc)).total_seconds()
+    return max(0.0, min(BACKOFF_CAP, seconds))
+
+
+def backoff_delay(attempt, hint=None):
+    """Return the seconds to wait before a retry.
+
+    :param attempt: number of the retry, starting at 0
+    :param hint: Retry-After of the response in seconds, if any
+    :return: the Retry-After plus a small jitter, or a full-jitter exponential backoff
+    """
+    if hint is not None:
+        return hint + random.uniform(0, BACKOFF_BASE)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+
+class ApiStats:
+    """Throughput and throttling events of the API calls, shared by all threads and loops.
+
+    Also holds the Retry-After hold, so that it applies to sync and async calls alike.
+    """
+
+    def __init__(self):
+        """Construct empty stats."""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start a new report."""
+        with self._lock:
+            self.started = time.monotonic()
+            self.calls = 0
+            self.retries = 0
+            self.backoff = 0.0
+            self.throttled = {}
+            self.events = []
+            self.min_concurrency = None
+            self.hold_until = 0.0
+
+    def record_call(self):
+        """Record a completed call."""
+        with self._lock:
+            self.calls += 1
+
+    def record_throttle(self, status, delay, concurrency):
+        """Record an overload response.
+
+        :param status: HTTP status of the response
+        :param delay: seconds before the retry, None if the call is not retried
+        :param concurrency: in-flight window after the response, None for sync calls
+        """
+        with self._lock:
+            self.throttled[str(status)] = self.throttled.get(str(status), 0) + 1
+            if delay is not None:
+                self.retries += 1
+                self.backoff += delay
+            if concurrency is not None:
+                self.min_concurrency = min(self.min_concurrency or concurrency, concurrency)
+            self.events.append(
+                "{} HTTP {}, {}, concurrency {}".format(
+                    time.strftime("%H:%M:%S"),
+                    status,
+                    "retry in {:.1f}s".format(delay) if delay is not None else "failed",
+                    concurrency if concurrency is not None else "-",
+                )
+            )
+            del self.events[:-MAX_EVENTS]
+        logging.warning("API throttled with HTTP %s, retry in %s", status, delay)
+
+    def hold(self, seconds):
+        """Hold back all new calls for seconds."""
+        with self._lock:
+            self.hold_until = max(self.hold_until, time.monotonic() + seconds)
+
+    def hold_remaining(self):
+        """Return the seconds left of the Retry-After hold."""
+        return self.hold_until - time.monotonic()
+
+    def snapshot(self):
+        """Return the report of the calls since the last reset."""
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                "calls": self.calls,
+                "throughput": round(self.calls / elapsed, 2) if elapsed > 0 else 0.0,
+                "throttled": dict(self.throttled),
+                "retries": self.retries,
+                "backoff-seconds": round(self.backoff, 1),
+                "min-concurrency": self.min_concurrency,
+                "events": list(self.events),
+            }
+
+
+STATS = ApiStats()
+
+
+class AdaptiveLimiter:
+    """AIMD-controlled window of in-flight calls of an event loop."""
+
+    def __init__(self, maximum, minimum=1, stats=STATS):
+        """Construct the limiter, starting with the maximum window.
+
+        :param maximum: upper bound of the window, e.g. the size of the worker pool
+        :param minimum: lower bound of the window
+        :param stats: ApiStats recording the calls
+        """
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.stats = stats
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def _acquire(self):
+        while True:
+            delay = self.stats.hold_remaining()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._in_flight < int(self.limit))
+                # a Retry-After hold may have started while waiting for the window
+                if self.stats.hold_remaining() <= 0:
+                    self._in_flight += 1
+                    return
+
+    async def _release(self, outcome):
+        async with self._cond:
+            self._in_flight -= 1
+            if outcome == "ok":
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif outcome == "overload":
+                if time.monotonic() - self._last_decrease >= DECREASE_INTERVAL:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = time.monotonic()
+            self._cond.notify_all()
+
+    async def run(self, executor, func):
+        """Run a blocking call in the executor within the window, retrying rejections.
+
+        :param executor: executor running the call
+        :param func: callable without arguments
+        :return: the result of func()
+        """
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            await self._acquire()
+            try:
+                result = await loop.run_in_executor(executor, func)
+            except openstack.exceptions.HttpException as exc:
+                status = throttle_status(exc)
+                await self._release("overload" if status else "error")
+                if not is_retryable(exc) or attempt >= MAX_RETRIES:
+                    if status is not None:
+                        self.stats.record_throttle(status, None, int(self.limit))
+                    raise
+                hint = retry_after(exc)
+                if hint:
+                    self.stats.hold(hint)
+                delay = backoff_delay(attempt, hint)
+                self.stats.record_throttle(status, delay, int(self.limit))
+            except BaseException:
+                await self._release("error")
+                raise
+            else:
+                await self._release("ok")
+                self.stats.record_call()
+                return result
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def call(func, *args, **kwargs):
+    """Run a blocking API call, retrying rejections with backoff.
+
+    Sync counterpart of AdaptiveLimiter.run for the serial calls of the charm.
+
+    :param func: callable to run
+    :return: the result of func(*args, **kwargs)
+    """
+    attempt = 0
+    while True:
+        delay = STATS.hold_remaining()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            result = func(*args, **kwargs)
+        except openstack.exceptions.HttpException as exc:
+            status = throttle_status(exc)
+            if not is_retryable(exc) or attempt >= MAX_RETRIES:
+                if status is not None:
+                    STATS.record_throttle(status, None, None)
+                raise
+            hint = retry_after(exc)
+            if hint:
+                STATS.hold(hint)
+            delay = backoff_delay(attempt, hint)
+            STATS.record_throttle(status, delay, None)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        STATS.record_call()
+        return result
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Periodic connectivity sweep across all hypervisors hosting test instances.
+
+Run by the cloudsupport-sweep systemd timer, see CloudSupportHelper.render_sweep_timer.
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+
+import results_db
+from os_testing import async_probe_servers, con, parse_ping, run_blocking
+
+SWEEP_SERVICE = "cloudsupport-sweep"
+
+
+async def async_sweep(sample=1, name_prefix="cloudsupport-test", cloud_name="cloud1"):
+    """Probe a random sample of test instances on every hypervisor.
+
+    A probe that fails, e.g. because the node hosting the netns is unreachable over ssh,
+    counts as 100% packet loss of its instance; it does not abort the sweep.
+
+    :param sample: number of test instances probed per hypervisor
+    :param name_prefix: name prefix of the test instances
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary of (loss in percent, average rtt in ms) keyed on hypervisor
+    """
+    servers = await run_blocking(lambda: list(con(cloud_name).compute.servers()))
+    prefix = "{}-".format(name_prefix)
+    per_host = {}
+    for srv in servers:
+        if srv.name.startswith(prefix) and srv.status == "ACTIVE":
+            per_host.setdefault(srv.compute_host, []).append(srv)
+    sampled = [
+        srv
+        for host_servers in per_host.values()
+        for srv in random.sample(host_servers, min(sample, len(host_servers)))
+    ]
+    results = await async_probe_servers(sampled, cloud_name=cloud_name, return_exceptions=True)
+    probes = {}
+    for srv, result in zip(sampled, results):
+        if isinstance(result, Exception):
+            logging.warning("Failed to probe %s on %s: %s", srv.id, srv.compute_host, result)
+            probe = (100.0, None)
+        else:
+            probe = parse_ping(result["ping"])
+        probes.setdefault(srv.compute_host, []).append(probe)
+    samples = {}
+    for host, host_probes in probes.items():
+        rtts = [rtt for _, rtt in host_probes if rtt is not None]
+        samples[host] = (
+            statistics.mean([loss for loss, _ in host_probes]),
+            statistics.mean(rtts) if rtts else None,
+        )
+    return samples
+
+
+def sweep(
+    db_path, sample=1, retention_days=90, name_prefix="cloudsupport-test", cloud_name="cloud1"
+):
+    """Run one sweep and store its results.
+
+    :param db_path: path of the results database
+    :param sample: number of test instances probed per hypervisor
+    :param retention_days: days downsampled results are kept
+    :param name_prefix: name prefix of the test instances
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: the stored samples
+    """
+    samples = asyncio.run(
+        async_sweep(sample=sample, name_prefix=name_prefix, cloud_name=cloud_name)
+    )
+    store = results_db.ConnectivityStore(results_db.connect(db_path))
+    store.add_samples(samples)
+    store.downsample(retention_days)
+    logging.info("Stored sweep of %d hosts", len(samples))
+    return samples
+
+
+def parse_args():
+    """Parse the command line arguments."""
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--cloud-name", dest="cloud_name", type=str, default="cloud1")
+    ap.add_argument("--db", dest="db", type=str, default=str(results_db.DB_PATH))
+    ap.add_argument("--sample", dest="sample", type=int, default=1)
+    ap.add_argument("--retention-days", dest="retention_days", type=int, default=90)
+    ap.add_argument("--name-prefix", dest="name_prefix", type=str, default="cloudsupport-test")
+    return ap.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    sweep(args.db, args.sample, args.retention_days, args.name_prefix, args.cloud_name)
@@ -5,22 +5,127 @@
 
 """Cloud support library."""
 
+import itertools
 import logging
 import os
 import pathlib
 import shutil
+import sqlite3
+import subprocess
+import sys
+import time
 
 from charmhelpers import fetch
+from charmhelpers.core import host
 from charmhelpers.contrib.charmsupport.nrpe import NRPE
 
-from openstack.exceptions import SDKException
-
 from ops.model import ActiveStatus
 
+import api_control
 import os_testing
-from os_testing import CloudSupportError, con
+import prom_textfile
+import results_db
+import token_cache
+from connectivity_sweep import SWEEP_SERVICE
+from os_testing import CloudSupportError, con, parse_ping
+from warm_pool import WARM_POOL_SERVICE
 
 NAGIOS_PLUGINS_DIR = "/usr/local/lib/nagios/plugins/"
+# VM states that live migration supports
+LIVE_MIGRATABLE_STATUS = ("ACTIVE", "PAUSED")
+
+SWEEP_SERVICE_TEMPLATE = """[Unit]
+Description=Cloudsupport connectivity sweep
+After=network-online.target
+
+[Service]
+Type=oneshot
+WorkingDirectory={charm_dir}
+Environment=PYTHONPATH={charm_dir}/lib:{charm_dir}/venv
+ExecStart={python} {charm_dir}/lib/connectivity_sweep.py --cloud-name {cloud_name} \\
+    --db {db} --sample {sample} --retention-days {retention_days} --name-prefix {name_prefix}
+"""
+
+WARM_POOL_SERVICE_TEMPLATE = """[Unit]
+Description=Cloudsupport warm pool of test instances
+After=network-online.target
+
+[Service]
+Type=oneshot
+TimeoutStartSec={timeout}
+WorkingDirectory={charm_dir}
+Environment=PYTHONPATH={charm_dir}/lib:{charm_dir}/venv
+ExecStart={python} {charm_dir}/lib/warm_pool.py --cloud-name {cloud_name} \\
+    --aggregate {aggregate} --image {image} --disk {disk} --cidr {cidr} \\
+    --name-prefix {name_prefix} --max-age-hours {max_age}{key_name}
+"""
+
+STALE_COLLECTOR = "cloudsupport-stale-collector"
+STALE_STATUS_FILE = "/var/lib/cloudsupport/stale_servers.json"
+STALE_COLLECTOR_SERVICE_TEMPLATE = """[Unit]
+Description=Cloudsupport stale server collector
+After=network-online.target
+
+[Service]
+Type=oneshot
+TimeoutStartSec={timeout}
+ExecStart={check_script} --collect --cloud-name {cloud_name} --name-prefix {name_prefix} \\
+    --status-file {status_file}
+"""
+
+TIMER_TEMPLATE = """[Unit]
+Description=Run the {service} service every {interval} minutes
+
+[Timer]
+OnActiveSec={interval}min
+OnUnitActiveSec={interval}min
+AccuracySec=30s
+
+[Install]
+WantedBy=timers.target
+"""
+
+
+def boot_time_points(create_results):
+    """Return (host, instance, "boot-time", seconds) samples of create_instance results."""
+    return [
+        (result[3], result[1], "boot-time", result[4])
+        for result in create_results
+        if result[0] == "success" and len(result) > 4
+    ]
+
+
+def connectivity_points(test_results):
+    """Return (host, instance, "loss"|"rtt", value) samples of test_connectivity results."""
+    points = []
+    for instance, result in test_results.items():
+        if not isinstance(result, dict) or not result.get("host"):
+            continue
+        loss, rtt = parse_ping(result["ping"])
+        points.append((result["host"], instance, "loss", loss))
+        if rtt is not None:
+            points.append((result["host"], instance, "rtt", rtt))
+    return points
+
+
+def canary_points(report):
+    """Return (node, instance, "boot-time"|"loss"|"rtt", value) samples of a canary report."""
+    points = []
+    for node, result in report.items():
+        for metric, key in (("boot-time", "boot-seconds"), ("loss", "loss"), ("rtt", "rtt")):
+            if result.get(key) is not None:
+                points.append((node, result["instance"], metric, result[key]))
+    return points
+
+
+def boot_time_samples(create_results):
+    """Return (host, "boot-time", seconds) samples of create_instance results."""
+    return [(host, metric, value) for host, _, metric, value in boot_time_points(create_results)]
+
+
+def connectivity_samples(test_results):
+    """Return (host, "loss"|"rtt", value) samples of test_connectivity results."""
+    return [(host, metric, value) for host, _, metric, value in connectivity_points(test_results)]
 
 
 class Paths:
@@ -29,6 +134,7 @@ class Paths:
     CLOUDS_YAML = pathlib.Path("/etc/openstack/clouds.yaml")
     CA_FILE = pathlib.Path("/etc/openstack/ssl_ca.crt")
     SSH_KEY = pathlib.Path(os_testing.TEST_SSH_KEY)
+    SYSTEMD_DIR = pathlib.Path("/etc/systemd/system")
 
 
 class CloudSupportHelper:
@@ -55,6 +161,11 @@ class CloudSupportHelper:
         """Get the cloud-name config option value."""
         return self.charm_config.get("cloud-name")
 
+    @property
+    def stale_check_clouds(self):
+        """Get the clouds of the stale server check, defaults to cloud-name."""
+        return self.charm_config.get("stale-check-clouds") or self.cloud_name
+
     def install_dependencies(self):
         """Install charm dependencies."""
         fetch.apt_install(["python3-openstackclient"], fatal=True)
@@ -75,6 +186,9 @@ class CloudSupportHelper:
         # allow read to anyone for nagios check
         Paths.CA_FILE.chmod(0o604)
 
+        if Paths.CLOUDS_YAML.read_text() != self.charm_config["clouds-yaml"]:
+            # drop the tokens of the old credentials
+            token_cache.invalidate()
         with Paths.CLOUDS_YAML.open("w") as fp:
             fp.write(self.charm_config["clouds-yaml"])
         with Paths.CA_FILE.open("w") as fp:
@@ -96,6 +210,10 @@ class CloudSupportHelper:
         if self.check_stale_server:
             self.render_nrpe_checks()
 
+        self.render_stale_collector()
+        self.render_sweep_timer()
+        self.render_warm_pool_timer()
+
     def update_plugins(self):
         """Copy nagios plugin into the unit."""
         charm_plugin_dir = os.path.join(self.charm_dir, "files", "plugins/")
@@ -103,6 +221,11 @@ class CloudSupportHelper:
             os.path.join(charm_plugin_dir, "stale_server_check.py"),
             os.path.join(self.plugins_dir, "stale_server_check.py"),
         )
+        # shared token cache imported by the plugin
+        shutil.copy2(
+            os.path.join(self.charm_dir, "lib", "token_cache.py"),
+            os.path.join(self.plugins_dir, "token_cache.py"),
+        )
 
     def render_nrpe_checks(self):
         """Render nrpe checks."""
@@ -123,8 +246,17 @@ class CloudSupportHelper:
             "{} --cloud-name {}  "
             "--name-prefix {}  "
             "--warn-days {} "
-            "--crit-days {} ".format(
-                check_script, self.cloud_name, stale_name_prefix, warn_days, crit_days
+            "--crit-days {} "
+            "--status-file {} "
+            "--max-age {} ".format(
+                check_script,
+                self.stale_check_clouds,
+                stale_name_prefix,
+                warn_days,
+                crit_days,
+                STALE_STATUS_FILE,
+                # tolerate two failed collections before reporting stale data
+                3 * self.charm_config.get("stale-collect-interval"),
             )
         )
 
@@ -139,10 +271,215 @@ class CloudSupportHelper:
         )
         nrpe.write()
 
+    @staticmethod
+    def _install_timer(name, service_text, interval):
+        """Install and (re)start a systemd timer running a oneshot service.
+
+        :param name: name of the service and timer units
+        :type name: str
+        :param service_text: content of the service unit
+        :type service_text: str
+        :param interval: minutes between two runs
+        :type interval: int
+        """
+        (Paths.SYSTEMD_DIR / "{}.service".format(name)).write_text(service_text)
+        (Paths.SYSTEMD_DIR / "{}.timer".format(name)).write_text(
+            TIMER_TEMPLATE.format(service=name, interval=interval)
+        )
+        subprocess.check_call(["systemctl", "daemon-reload"])
+        host.service("enable", "{}.timer".format(name))
+        host.service_restart("{}.timer".format(name))
+
+    @staticmethod
+    def _remove_timer(name):
+        """Stop and remove a systemd timer installed by _install_timer, if any."""
+        service = Paths.SYSTEMD_DIR / "{}.service".format(name)
+        timer = Paths.SYSTEMD_DIR / "{}.timer".format(name)
+        if timer.exists():
+            host.service_stop("{}.timer".format(name))
+            host.service("disable", "{}.timer".format(name))
+            timer.unlink()
+            service.unlink()
+            subprocess.check_call(["systemctl", "daemon-reload"])
+
+    def render_sweep_timer(self):
+        """Install or remove the systemd timer running the connectivity sweep."""
+        interval = self.charm_config.get("connectivity-sweep-interval")
+        if not interval:
+            self._remove_timer(SWEEP_SERVICE)
+            return
+
+        self._install_timer(
+            SWEEP_SERVICE,
+            SWEEP_SERVICE_TEMPLATE.format(
+                charm_dir=self.charm_dir,
+                python=sys.executable,
+                cloud_name=self.cloud_name,
+                db=results_db.DB_PATH,
+                sample=self.charm_config.get("connectivity-sweep-sample"),
+                retention_days=self.charm_config.get("connectivity-sweep-retention-days"),
+                name_prefix=self.charm_config.get("name-prefix"),
+            ),
+            interval,
+        )
+
+    def render_warm_pool_timer(self):
+        """Install or remove the systemd timer replenishing the warm pool."""
+        aggregate = self.charm_config.get("warm-pool-aggregate")
+        interval = self.charm_config.get("warm-pool-interval")
+        if not aggregate or not interval:
+            self._remove_timer(WARM_POOL_SERVICE)
+            return
+
+        key_name = self.charm_config.get("key-name")
+        self._install_timer(
+            WARM_POOL_SERVICE,
+            WARM_POOL_SERVICE_TEMPLATE.format(
+                # a replenishment never overlaps the next one
+                timeout=interval * 60,
+                charm_dir=self.charm_dir,
+                python=sys.executable,
+                cloud_name=self.cloud_name,
+                aggregate=aggregate,
+                image=self.charm_config.get("image"),
+                disk=self.charm_config.get("disk"),
+                cidr=self.charm_config.get("cidr"),
+                name_prefix=self.charm_config.get("name-prefix"),
+                max_age=self.charm_config.get("warm-pool-max-age"),
+                key_name=" --key-name {}".format(key_name) if key_name else "",
+            ),
+            interval,
+        )
+
+    def render_stale_collector(self):
+        """Install or remove the systemd timer collecting the data of the stale server check.
+
+        The timer runs the nagios plugin installed by render_nrpe_checks.
+        """
+        if not self.check_stale_server:
+            self._remove_timer(STALE_COLLECTOR)
+            return
+
+        check_script = os.path.join(self.plugins_dir, "stale_server_check.py")
+        interval = self.charm_config.get("stale-collect-interval")
+        pathlib.Path(STALE_STATUS_FILE).parent.mkdir(parents=True, exist_ok=True)
+        self._install_timer(
+            STALE_COLLECTOR,
+            STALE_COLLECTOR_SERVICE_TEMPLATE.format(
+                # a collection never overlaps the next one
+                timeout=interval * 60,
+                check_script=check_script,
+                cloud_name=self.stale_check_clouds,
+                name_prefix=self.charm_config.get("name-prefix"),
+                status_file=STALE_STATUS_FILE,
+            ),
+            interval,
+        )
+
+    def connectivity_history(self, hours, compute_node=None):
+        """Summarize the connectivity sweep results of the last hours.
+
+        :param hours: size of the window in hours
+        :type hours: float
+        :param compute_node: only report this compute node if given
+        :type compute_node: Optional[str]
+        """
+        if not results_db.DB_PATH.exists():
+            raise CloudSupportError("No connectivity sweep results, is the sweep enabled?")
+        store = results_db.ConnectivityStore(results_db.connect())
+        return store.query(hours, host=compute_node)
+
+    @property
+    def prometheus_textfile_dir(self):
+        """Get the prometheus-textfile-dir config option value."""
+        return self.charm_config.get("prometheus-textfile-dir")
+
+    def record_run(self, action, started, outcome, params=None, samples=(), points=None):
+        """Store an action run in the run history, and export it to Prometheus if enabled.
+
+        Failing to store or export the run is logged, it never fails the action.
+
+        :param action: name of the action
+        :type action: str
+        :param started: unix timestamp of the start of the run
+        :type started: float
+        :param outcome: outcome of the run
+        :type outcome: str
+        :param params: action parameters
+        :type params: Optional[dict]
+        :param samples: (host, metric, value) samples of the run
+        :type samples: Iterable[Tuple[str, str, float]]
+        :param points: (host, instance, metric, value) samples of the run, replacing samples
+        :type points: Optional[Iterable[Tuple[str, str, str, float]]]
+        """
+        duration = time.time() - started
+        if points is None:
+            points = [(host, None, metric, value) for host, metric, value in samples]
+        else:
+            samples = [(host, metric, value) for host, _, metric, value in points]
+        try:
+            history = results_db.RunHistory(results_db.connect())
+            history.record(action, started, duration, outcome, params, samples)
+        except (sqlite3.Error, OSError) as error:
+            logging.warning("failed to record %s run: %s", action, error)
+        if self.prometheus_textfile_dir:
+            try:
+                prom_textfile.export_run(
+                    self.prometheus_textfile_dir,
+                    action,
+                    started,
+                    duration,
+                    outcome,
+                    points,
+                    host=(params or {}).get("compute-node"),
+                )
+            except OSError as error:
+                logging.warning("failed to export %s run: %s", action, error)
+
+    def compare_runs(self, metric, run_id=None, baseline=None, window=5, threshold=20.0):
+        """Compare a run against a baseline run or the rolling median of previous runs.
+
+        :param metric: boot-time, rtt or loss
+        :type metric: str
+        :param run_id: run to check, defaults to the latest run having the metric
+        :type run_id: Optional[int]
+        :param baseline: baseline run, defaults to the rolling median
+        :type baseline: Optional[int]
+        :param window: number of previous runs of the rolling median
+        :type window: int
+        :param threshold: regression threshold in percent
+        :type threshold: float
+        """
+        if not results_db.DB_PATH.exists():
+            raise CloudSupportError("No run history recorded yet")
+        history = results_db.RunHistory(results_db.connect())
+        return history.compare(metric, run_id, baseline, window, threshold)
+
+    def run_history(self, limit=20, action=None, metric=None, compute_node=None):
+        """Return the latest runs, or the trend of a metric on a compute node.
+
+        :param limit: number of runs to return
+        :type limit: int
+        :param action: only return runs of this action
+        :type action: Optional[str]
+        :param metric: return the trend of this metric, requires compute_node
+        :type metric: Optional[str]
+        :param compute_node: compute node of the trend
+        :type compute_node: Optional[str]
+        """
+        if not results_db.DB_PATH.exists():
+            raise CloudSupportError("No run history recorded yet")
+        history = results_db.RunHistory(results_db.connect())
+        if metric:
+            if not compute_node:
+                raise CloudSupportError("A metric trend requires a compute-node")
+            return history.trend(metric, compute_node, limit)
+        return history.runs(limit, action)
+
     @staticmethod
     def _check_compute_node(cloud_name, compute_node, status):
         """Check if compute-node service exists."""
-        for service in con(cloud_name).compute.hypervisors():
+        for service in api_control.call(lambda: list(con(cloud_name).compute.hypervisors())):
             if service.name == compute_node and service.status == status:
                 return True
 
@@ -156,24 +493,85 @@ class CloudSupportHelper:
         :param cloud_name: name of the cloud defined in `clouds-yaml` configuration
         :type cloud_name: Optional[str]
         """
-        stopped_vms = []
-        failed_to_stop = []
         cloud_name = cloud_name or self.cloud_name
+        return os_testing.stop_servers(
+            self._vms_to_stop(compute_node, cloud_name), cloud_name=cloud_name
+        )
+
+    def iter_stop_vms(self, compute_node, cloud_name=None):
+        """Stop all VMs on compute node, yielding (VM ID, stopped) tuples as they complete.
+
+        The compute node is checked before the first VM is stopped, see stop_vms.
+        """
+        cloud_name = cloud_name or self.cloud_name
+        vms = self._vms_to_stop(compute_node, cloud_name)
+        return os_testing.iter_stop_servers(vms, cloud_name=cloud_name)
+
+    def _vms_to_stop(self, compute_node, cloud_name):
+        """Return the active VMs of a disabled compute node."""
         if not self._check_compute_node(cloud_name, compute_node, "disabled"):
             raise CloudSupportError(
                 "Please disable host `{}` before stop vms".format(compute_node)
             )
-        vms = con(cloud_name).compute.servers(host=compute_node, all_tenants=True, status="ACTIVE")
-        for vm in vms:
-            try:
-                logging.debug("stopping VM: %s(%s)", vm.name, vm.id)
-                con(cloud_name).compute.stop_server(vm.id)
-                stopped_vms.append(vm.id)
-            except SDKException as error:
-                logging.warning("failed to stop VM %s with error: %s", vm.id, error)
-                failed_to_stop.append(vm.id)
+        return api_control.call(
+            lambda: list(
+                con(cloud_name).compute.servers(
+                    host=compute_node, all_tenants=True, status="ACTIVE"
+                )
+            )
+        )
+
+    def iter_evacuate_node(
+        self, compute_node, max_concurrent=4, retries=2, wait=900, cloud_name=None
+    ):
+        """Live-migrate all VMs off a disabled compute node.
 
-        return stopped_vms, failed_to_stop
+        The VMs that cannot be live-migrated are yielded first, with the reason they were
+        skipped; the migrations are then yielded as they complete. The compute node is
+        checked before the first VM is migrated.
+
+        :param compute_node: name of the compute node registered in cloud
+        :type compute_node: str
+        :param max_concurrent: number of migrations run at the same time
+        :type max_concurrent: int
+        :param retries: number of retries of a failed migration, on other hosts
+        :type retries: int
+        :param wait: seconds to wait for a migration
+        :type wait: int
+        :param cloud_name: name of the cloud defined in `clouds-yaml` configuration
+        :type cloud_name: Optional[str]
+        :return: iterator of (VM ID, result) tuples
+        """
+        cloud_name = cloud_name or self.cloud_name
+        if not self._check_compute_node(cloud_name, compute_node, "disabled"):
+            raise CloudSupportError(
+                "Please disable host `{}` before evacuating it".format(compute_node)
+            )
+        vms = api_control.call(
+            lambda: list(con(cloud_name).compute.servers(host=compute_node, all_tenants=True))
+        )
+        destinations = sorted(
+            hypervisor.name
+            for hypervisor in api_control.call(lambda: list(con(cloud_name).compute.hypervisors()))
+            if hypervisor.name != compute_node
+            and hypervisor.status == "enabled"
+            and hypervisor.state == "up"
+        )
+        skipped = [
+            (vm.id, {"skipped": "cannot live-migrate a VM in status {}".format(vm.status)})
+            for vm in vms
+            if vm.status not in LIVE_MIGRATABLE_STATUS
+        ]
+        migrations = os_testing.iter_evacuate_servers(
+            [vm for vm in vms if vm.status in LIVE_MIGRATABLE_STATUS],
+            compute_node,
+            destinations,
+            max_concurrent=max_concurrent,
+            retries=retries,
+            wait=wait,
+            cloud_name=cloud_name,
+        )
+        return itertools.chain(skipped, migrations)
 
     def start_vms(self, compute_node, stopped_vms, force_all=False, cloud_name=None):
         """Start all VMs on compute node.
@@ -187,22 +585,30 @@ class CloudSupportHelper:
         :param cloud_name: name of the cloud defined in `clouds-yaml` configuration
         :type cloud_name: Optional[str]
         """
-        started_vms = []
-        failed_to_start = []
         cloud_name = cloud_name or self.cloud_name
-        vms = con(cloud_name).compute.servers(
-            host=compute_node, all_tenants=True, status="SHUTOFF"
+        vms = self._vms_to_start(compute_node, stopped_vms, force_all, cloud_name)
+        return os_testing.start_servers(vms, cloud_name=cloud_name)
+
+    def iter_start_vms(self, compute_node, stopped_vms, force_all=False, cloud_name=None):
+        """Start VMs on compute node, yielding (VM ID, started) tuples as they complete.
+
+        See start_vms for the parameters.
+        """
+        cloud_name = cloud_name or self.cloud_name
+        vms = self._vms_to_start(compute_node, stopped_vms, force_all, cloud_name)
+        return os_testing.iter_start_servers(vms, cloud_name=cloud_name)
+
+    @staticmethod
+    def _vms_to_start(compute_node, stopped_vms, force_all, cloud_name):
+        """Return the stopped VMs of a compute node that should be started."""
+        vms = api_control.call(
+            lambda: list(
+                con(cloud_name).compute.servers(
+                    host=compute_node, all_tenants=True, status="SHUTOFF"
+                )
+            )
         )
-        for vm in vms:
-            if force_all is False and vm.id not in stopped_vms:
-                # skip all VMs that have not been stopped
-                continue
-            try:
-                logging.debug("starting VM: %s(%s)", vm.name, vm.id)
-                con(cloud_name).compute.start_server(vm.id)
-                started_vms.append(vm.id)
-            except SDKException as error:
-                logging.warning("failed to start VM %s with error: %s", vm.id, error)
-                failed_to_start.append(vm.id)
-
-        return started_vms, failed_to_start
+        if force_all is False:
+            # skip all VMs that have not been stopped
+            vms = [vm for vm in vms if vm.id in stopped_vms]
+        return vms
@@ -0,0 +1,1347 @@
+"""This module contains OpenStack performance benchmarks built on os_testing."""
+
+import asyncio
+import io
+import json
+import logging
+import math
+import re
+import statistics
+import time
+from datetime import datetime
+from xml.etree import ElementTree
+
+import openstack.exceptions
+
+from os_testing import (
+    CloudSupportError,
+    OVN_NET_NS,
+    TEST_NETWORK,
+    async_ensure_test_resources,
+    async_get_instances,
+    async_wait_for_delete,
+    async_wait_for_migration,
+    async_wait_for_status,
+    con,
+    guest_connection,
+    is_ovn_used,
+    netns_target,
+    node_connection,
+    parse_ping,
+    run_blocking,
+    run_worker,
+)
+
+NO_VALID_HOST = "No valid host"
+# seconds to wait for the servers of a load step to be deleted
+DELETE_WAIT = 300
+
+
+def percentiles(values, pcts=(50, 95, 99)):
+    """Compute nearest-rank percentiles of a list of values.
+
+    :param values: list of numbers
+    :param pcts: percentiles to compute
+    :return: dictionary keyed on "p<N>", values rounded to ms; empty if no values
+    """
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {}
+    for pct in pcts:
+        rank = min(max(math.ceil(pct / 100.0 * len(ordered)) - 1, 0), len(ordered) - 1)
+        result["p{}".format(pct)] = round(ordered[rank], 3)
+    return result
+
+
+class _Launch:
+    """Timing record of one instance launched by the scheduler load test."""
+
+    def __init__(self):
+        self.server_id = None
+        self.submitted = None
+        self.scheduled = None
+        self.active = None
+        self.error = None
+
+    @property
+    def done(self):
+        """Return True once the launch reached a final state."""
+        return self.active is not None or self.error is not None
+
+
+async def _async_launch(launch, name, img, flavor, net, cloud_name):
+    """Submit one server create request and record its id or error.
+
+    The launch is timestamped when the request is sent, not when it is queued, so that
+    waiting for a free API slot is not counted as scheduler time.
+    """
+
+    def create():
+        launch.submitted = time.monotonic()
+        return con(cloud_name).compute.create_server(
+            name=name, image_id=img.id, flavor_id=flavor.id, networks=[{"uuid": net.id}]
+        )
+
+    try:
+        server = await run_blocking(create)
+    except openstack.exceptions.SDKException as err:
+        logging.warning("Failed to submit %s: %s", name, err)
+        launch.error = str(err)
+        return
+    launch.server_id = server.id
+
+
+async def _async_monitor_launches(launches, submitted, name, interval, timeout, cloud_name):
+    """Poll all servers of a step with a single list call per tick.
+
+    Records the time nova took to pick a host, the time to ACTIVE and NoValidHost failures.
+    The monitor runs while the step is still submitting, launches are appended to the list
+    as they are submitted; timeout counts from the end of the submissions.
+
+    :param launches: list of _Launch of the step
+    :param submitted: asyncio.Event set once all launches of the step were submitted
+    """
+    deadline = None
+    while not submitted.is_set() or any(not launch.done for launch in launches):
+        if deadline is None and submitted.is_set():
+            deadline = time.monotonic() + timeout
+        servers = await run_blocking(
+            lambda: {s.id: s for s in con(cloud_name).compute.servers(name=name)}
+        )
+        now = time.monotonic()
+        for launch in launches:
+            if launch.done or launch.server_id not in servers:
+                continue
+            srv = servers[launch.server_id]
+            if launch.scheduled is None and (srv.compute_host or srv.status != "BUILD"):
+                launch.scheduled = now - launch.submitted
+            if srv.status == "ACTIVE":
+                launch.active = now - launch.submitted
+            elif srv.status == "ERROR":
+                launch.error = (srv.fault or {}).get("message", "ERROR")
+        if deadline is not None and now >= deadline:
+            for launch in launches:
+                if not launch.done:
+                    launch.error = "timeout"
+            break
+        await asyncio.sleep(interval)
+
+
+def _step_report(rate, launches):
+    """Summarize the launches of one load step."""
+    errors = [launch.error for launch in launches if launch.error]
+    return {
+        "rate": rate,
+        "launched": len(launches),
+        "active": len([launch for launch in launches if launch.active is not None]),
+        "no-valid-host": len([e for e in errors if NO_VALID_HOST.lower() in e.lower()]),
+        "errors": len(errors),
+        "schedule-time": percentiles([x.scheduled for x in launches if x.scheduled is not None]),
+        "time-to-active": percentiles([x.active for x in launches if x.active is not None]),
+    }
+
+
+async def _async_delete_launch(launch, interval, cloud_name):
+    """Delete the server of a launch and wait until it is gone, releasing its allocations."""
+    await run_blocking(con(cloud_name).compute.delete_server, launch.server_id)
+    await async_wait_for_delete(
+        con(cloud_name).compute.get_server, launch.server_id, interval, DELETE_WAIT
+    )
+
+
+async def _async_cleanup_launches(launches, interval, cloud_name):
+    """Delete all servers created by a load step, and wait until they are gone.
+
+    The next step must not start while Placement still holds the allocations of this one.
+
+    :return: list of the failed deletes
+    """
+    created = [launch for launch in launches if launch.server_id]
+    results = await asyncio.gather(
+        *[_async_delete_launch(launch, interval, cloud_name) for launch in created],
+        return_exceptions=True,
+    )
+    errors = []
+    for launch, result in zip(created, results):
+        if isinstance(result, Exception):
+            logging.warning("Fault deleting %s: %s", launch.server_id, result)
+            errors.append("{}: {}".format(launch.server_id, result))
+    return errors
+
+
+async def async_scheduler_load_test(
+    nodes,
+    vcpus,
+    ram,
+    disk,
+    image,
+    name_prefix,
+    cidr,
+    start_rate=1.0,
+    rate_step=1.0,
+    max_rate=5.0,
+    step_duration=30,
+    timeout=600,
+    interval=2,
+    vnfspecs=False,
+    cloud_name="cloud1",
+):
+    """Launch instances at a rate ramped in steps and measure scheduler behaviour.
+
+    Each step submits instances at a fixed rate (requests per second) for step_duration
+    seconds, waits for them to become ACTIVE or fail, then deletes them and waits until
+    they are gone before the next step.
+
+    :param nodes: nodes to put into the test aggregate
+    :param vcpus: flavor vcpus
+    :param ram: flavor ram in MB
+    :param disk: flavor disk in GB
+    :param image: name of the image to boot
+    :param name_prefix: instance name prefix
+    :param cidr: test network cidr
+    :param start_rate: requests per second of the first step
+    :param rate_step: requests per second added at each step
+    :param max_rate: requests per second of the last step
+    :param step_duration: seconds during which instances are submitted in each step
+    :param timeout: seconds to wait for the instances of a step
+    :param interval: seconds between status polls
+    :param vnfspecs: flag, use typical VNF specs if given
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: list of per-step reports
+    :raises CloudSupportError: if the rates do not describe a finite ramp
+    """
+    if start_rate <= 0 or rate_step <= 0:
+        raise CloudSupportError("start-rate and rate-step must be positive")
+    flavor, _, img = await async_ensure_test_resources(
+        nodes, vcpus, ram, disk, image, cidr, vnfspecs=vnfspecs, cloud_name=cloud_name
+    )
+    net = await run_blocking(con(cloud_name).network.find_network, TEST_NETWORK)
+    name = "{}-sched-{}".format(name_prefix, datetime.utcnow().strftime("%Y-%m-%dT%H%M%S"))
+    reports = []
+    rate = start_rate
+    step = 0
+    while rate <= max_rate:
+        launches = []
+        tasks = []
+        submitted = asyncio.Event()
+        # polls from the first submission, so nothing waits for the step to finish
+        monitor = asyncio.ensure_future(
+            _async_monitor_launches(launches, submitted, name, interval, timeout, cloud_name)
+        )
+        try:
+            for _ in range(max(int(rate * step_duration), 1)):
+                launch = _Launch()
+                launches.append(launch)
+                tasks.append(
+                    asyncio.ensure_future(
+                        _async_launch(launch, name, img, flavor, net, cloud_name)
+                    )
+                )
+                await asyncio.sleep(1.0 / rate)
+            await asyncio.gather(*tasks)
+            submitted.set()
+            await monitor
+        finally:
+            submitted.set()
+            if not monitor.done():
+                monitor.cancel()
+            await asyncio.gather(monitor, *tasks, return_exceptions=True)
+            delete_errors = await _async_cleanup_launches(launches, interval, cloud_name)
+        report = _step_report(rate, launches)
+        if delete_errors:
+            report["delete-errors"] = delete_errors
+        logging.info("Scheduler load step %s: %s", step, report)
+        reports.append(report)
+        rate += rate_step
+        step += 1
+    return reports
+
+
+def scheduler_load_test(*args, **kwargs):
+    """Run the scheduler load test, see async_scheduler_load_test for the parameters."""
+    return asyncio.run(async_scheduler_load_test(*args, **kwargs))
+
+
+# Storage benchmark
+
+FIO_PROFILES = {
+    "randread-4k": "--rw=randread --bs=4k --iodepth=32",
+    "randwrite-4k": "--rw=randwrite --bs=4k --iodepth=32",
+    "seqread-1m": "--rw=read --bs=1M --iodepth=8",
+    "seqwrite-1m": "--rw=write --bs=1M --iodepth=8",
+}
+FIO_CMD = (
+    "fio --name=cloudsupport --filename={target} --size={size} --runtime={runtime} "
+    "--time_based --direct=1 --ioengine=libaio --group_reporting --output-format=json {profile}"
+)
+EPHEMERAL_TARGET = "/var/tmp/cloudsupport-fio"
+# udev link of a virtio disk, the serial is the volume id truncated to 20 characters
+GUEST_DEVICE_PATH = "/dev/disk/by-id/virtio-{serial}"
+GUEST_DEVICE_ATTEMPTS = 10
+GUEST_DEVICE_INTERVAL = 1
+EPHEMERAL_BACKEND = "ephemeral"
+
+
+def volume_backend(volume):
+    """Return the cinder backend name of a volume.
+
+    The backend is taken from the volume host (host@backend#pool) if visible to the
+    credentials in use, else the volume type is used.
+    """
+    if volume.host and "@" in volume.host:
+        return volume.host.split("@", 1)[1].split("#", 1)[0]
+    return volume.volume_type or "volume"
+
+
+def parse_fio(output):
+    """Extract iops, bandwidth and latency percentiles from fio json output.
+
+    :param output: fio --output-format=json output
+    :return: dictionary with iops, bw-kib (KiB/s), lat-p50-ms and lat-p99-ms
+    """
+    job = json.loads(output)["jobs"][0]
+    result = {"iops": 0.0, "bw-kib": 0.0}
+    latencies = {}
+    for direction in ("read", "write"):
+        stats = job.get(direction, {})
+        if not stats.get("io_bytes"):
+            continue
+        result["iops"] += stats["iops"]
+        result["bw-kib"] += stats["bw"]
+        for pct, value in stats.get("clat_ns", {}).get("percentile", {}).items():
+            latencies[float(pct)] = max(latencies.get(float(pct), 0), value)
+    for pct in (50, 99):
+        if float(pct) in latencies:
+            result["lat-p{}-ms".format(pct)] = round(latencies[float(pct)] / 1e6, 3)
+    result["iops"] = round(result["iops"], 1)
+    result["bw-kib"] = round(result["bw-kib"], 1)
+    return result
+
+
+async def async_create_volume(name, size, volume_type=None, cloud_name="cloud1"):
+    """Create a volume, without waiting for it to become available.
+
+    The volume exists as soon as this returns, so that the caller can clean it up if it
+    never becomes available, see async_wait_for_volume.
+
+    :return: the volume
+    """
+    params = {"name": name, "size": size}
+    if volume_type:
+        params["volume_type"] = volume_type
+    return await run_blocking(con(cloud_name).block_storage.create_volume, **params)
+
+
+async def async_wait_for_volume(volume, status="available", cloud_name="cloud1"):
+    """Wait for a volume to reach a status.
+
+    :return: the volume
+    :raises ResourceFailure: if the volume goes to error
+    """
+    return await async_wait_for_status(
+        con(cloud_name).block_storage.get_volume, volume.id, status=status
+    )
+
+
+async def _async_guest_device(conn, volume, attempts=GUEST_DEVICE_ATTEMPTS):
+    """Return the device of an attached volume in a guest, found by its serial.
+
+    The device name of the attachment is only what nova asked for, libvirt does not
+    honour it; the virtio serial of the disk is the volume id truncated to 20 chars.
+
+    :raises CloudSupportError: if the device does not show up in the guest
+    """
+    path = GUEST_DEVICE_PATH.format(serial=volume.id[:20])
+    for _ in range(attempts):
+        res = await run_worker(conn.run, "readlink -f {}".format(path), warn=True, hide=True)
+        if res.ok and res.stdout.strip():
+            return res.stdout.strip()
+        # udev may not have created the link yet
+        await asyncio.sleep(GUEST_DEVICE_INTERVAL)
+    raise CloudSupportError("volume {} not found in the guest at {}".format(volume.id, path))
+
+
+async def async_attach_volume(server_id, volume, cloud_name="cloud1"):
+    """Attach a volume to a server and wait for it to be in-use.
+
+    :return: the volume attachment
+    """
+    attachment = await run_blocking(
+        con(cloud_name).compute.create_volume_attachment, server_id, volume=volume.id
+    )
+    await async_wait_for_status(
+        con(cloud_name).block_storage.get_volume, volume.id, status="in-use"
+    )
+    return attachment
+
+
+async def async_detach_volume(server_id, volume, cloud_name="cloud1"):
+    """Detach a volume from a server and wait for it to be available again."""
+    await run_blocking(con(cloud_name).compute.delete_volume_attachment, server_id, volume.id)
+    await async_wait_for_status(
+        con(cloud_name).block_storage.get_volume, volume.id, status="available"
+    )
+
+
+async def async_delete_volume(volume, cloud_name="cloud1"):
+    """Delete a volume and wait for it to be gone."""
+    await run_blocking(con(cloud_name).block_storage.delete_volume, volume.id)
+    await async_wait_for_delete(con(cloud_name).block_storage.get_volume, volume.id)
+
+
+async def _async_run_fio(conn, target, profiles, runtime, size):
+    """Run fio profiles one after the other against a target in a guest.
+
+    :return: dictionary of fio results keyed on profile name
+    """
+    results = {}
+    for name in profiles:
+        cmd = FIO_CMD.format(target=target, size=size, runtime=runtime, profile=FIO_PROFILES[name])
+        res = await run_worker(conn.sudo, cmd, warn=True, hide=True)
+        if res.failed:
+            results[name] = {"error": res.stderr.strip() or res.stdout.strip()}
+            continue
+        results[name] = parse_fio(res.stdout)
+    return results
+
+
+async def _async_benchmark_instance(
+    instance, net, profiles, runtime, size, volume_size, volume_type, cloud_name
+):
+    """Run the storage benchmark on one test instance.
+
+    :return: dictionary with the compute host and fio results keyed on backend
+    """
+    srv = await run_blocking(con(cloud_name).compute.get_server, instance)
+    conn = guest_connection(srv, net, cloud_name=cloud_name)
+    report = {"host": srv.compute_host, "backends": {}}
+    try:
+        check = await run_worker(conn.run, "command -v fio", warn=True, hide=True)
+        if check.failed:
+            report["error"] = "fio is not installed in the instance"
+            return report
+        report["backends"][EPHEMERAL_BACKEND] = await _async_run_fio(
+            conn, EPHEMERAL_TARGET, profiles, runtime, size
+        )
+        await run_worker(conn.sudo, "rm -f {}".format(EPHEMERAL_TARGET), warn=True, hide=True)
+        if volume_size:
+            volume = await async_create_volume(
+                "{}-fio".format(srv.name), volume_size, volume_type, cloud_name=cloud_name
+            )
+            attached = False
+            try:
+                volume = await async_wait_for_volume(volume, cloud_name=cloud_name)
+                attached = True
+                await async_attach_volume(srv.id, volume, cloud_name=cloud_name)
+                device = await _async_guest_device(conn, volume)
+                report["backends"][volume_backend(volume)] = await _async_run_fio(
+                    conn, device, profiles, runtime, size
+                )
+                await async_detach_volume(srv.id, volume, cloud_name=cloud_name)
+                await async_delete_volume(volume, cloud_name=cloud_name)
+            except Exception:
+                await _async_force_cleanup_volume(srv.id, volume, cloud_name, attached)
+                raise
+    except Exception as err:
+        logging.warning("Storage benchmark failed on %s: %s", instance, err)
+        report["error"] = str(err)
+    finally:
+        conn.close()
+    return report
+
+
+def _summarize_storage(reports):
+    """Aggregate instance reports to medians per compute host, backend and profile."""
+    grouped = {}
+    for report in reports.values():
+        for backend, profiles in report["backends"].items():
+            for profile, result in profiles.items():
+                if "error" in result:
+                    continue
+                key = (report["host"], backend, profile)
+                grouped.setdefault(key, []).append(result)
+    summary = {}
+    for (host, backend, profile), results in grouped.items():
+        summary.setdefault(host, {}).setdefault(backend, {})[profile] = {
+            metric: round(statistics.median([r[metric] for r in results if metric in r]), 3)
+            for metric in results[0]
+        }
+    return summary
+
+
+async def async_storage_benchmark(
+    instance=None,
+    profiles=None,
+    runtime=30,
+    size="1G",
+    volume_size=None,
+    volume_type=None,
+    cloud_name="cloud1",
+):
+    """Run fio profiles on the ephemeral disk and optionally a cinder volume of test instances.
+
+    Instances are benchmarked concurrently, the profiles of one instance run sequentially.
+
+    :param instance: instance id. If missing, all instances whose names start with
+    "cloudsupport-test-" will be benchmarked
+    :param profiles: names of FIO_PROFILES to run, defaults to all
+    :param runtime: seconds each fio profile runs
+    :param size: size of the fio test file or region
+    :param volume_size: if given, also attach a cinder volume of this size in GB
+    :param volume_type: optional volume type of the cinder volume
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary with per-instance results and a per host/backend summary
+    """
+    profiles = profiles or list(FIO_PROFILES)
+    unknown = set(profiles) - set(FIO_PROFILES)
+    if unknown:
+        raise CloudSupportError("Unknown fio profiles: {}".format(",".join(sorted(unknown))))
+    instances = await async_get_instances(instance=instance, cloud_name=cloud_name)
+    if isinstance(instances, dict):
+        return instances
+    net = await run_blocking(con(cloud_name).network.find_network, TEST_NETWORK)
+    reports = await asyncio.gather(
+        *[
+            _async_benchmark_instance(
+                i, net, profiles, runtime, size, volume_size, volume_type, cloud_name
+            )
+            for i in instances
+        ]
+    )
+    reports = dict(zip(instances, reports))
+    return {"instances": reports, "summary": _summarize_storage(reports)}
+
+
+def storage_benchmark(*args, **kwargs):
+    """Run the storage benchmark, see async_storage_benchmark for the parameters."""
+    return asyncio.run(async_storage_benchmark(*args, **kwargs))
+
+
+# Volume latency probe
+
+VOLUME_PHASES = ("create", "attach", "detach", "delete")
+
+
+async def _async_volume_cycle(name, srv, size, volume_type, cloud_name):
+    """Create, attach, detach and delete one volume, timing each phase.
+
+    :return: dictionary with the phase durations in seconds, and the error if any
+    """
+    timings = {}
+    volume = None
+    attached = False
+    try:
+        start = time.monotonic()
+        volume = await async_create_volume(name, size, volume_type, cloud_name=cloud_name)
+        volume = await async_wait_for_volume(volume, cloud_name=cloud_name)
+        timings["create"] = time.monotonic() - start
+        start = time.monotonic()
+        attached = True
+        await async_attach_volume(srv.id, volume, cloud_name=cloud_name)
+        timings["attach"] = time.monotonic() - start
+        start = time.monotonic()
+        await async_detach_volume(srv.id, volume, cloud_name=cloud_name)
+        timings["detach"] = time.monotonic() - start
+        start = time.monotonic()
+        await async_delete_volume(volume, cloud_name=cloud_name)
+        timings["delete"] = time.monotonic() - start
+        volume = None
+    except Exception as err:
+        logging.warning("Volume probe %s failed on %s: %s", name, srv.id, err)
+        timings["error"] = str(err)
+    finally:
+        if volume is not None:
+            await _async_force_cleanup_volume(srv.id, volume, cloud_name, attached)
+    return timings
+
+
+async def _async_force_cleanup_volume(server_id, volume, cloud_name, attached=True):
+    """Best effort removal of a volume left behind by a failed probe.
+
+    :param attached: whether an attach may have been requested, so detach first
+    """
+    if attached:
+        try:
+            await run_blocking(
+                con(cloud_name).compute.delete_volume_attachment, server_id, volume.id
+            )
+            await async_wait_for_volume(volume, cloud_name=cloud_name)
+        except Exception as err:
+            logging.warning("Failed to detach volume %s: %s", volume.id, err)
+    try:
+        await async_delete_volume(volume, cloud_name=cloud_name)
+    except Exception as err:
+        logging.warning("Failed to clean up volume %s: %s", volume.id, err)
+
+
+async def async_volume_latency_probe(
+    count=10, size=1, volume_type=None, instance=None, cloud_name="cloud1"
+):
+    """Measure cinder volume create/attach/detach/delete latency using the test instances.
+
+    The volumes are spread round-robin over the test instances and cycled concurrently.
+
+    :param count: number of volumes to cycle
+    :param size: volume size in GB
+    :param volume_type: optional volume type
+    :param instance: instance id. If missing, all instances whose names start with
+    "cloudsupport-test-" will be used
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary of per-phase percentiles and error counts, keyed on compute host
+    """
+    instances = await async_get_instances(instance=instance, cloud_name=cloud_name)
+    if isinstance(instances, dict):
+        return instances
+    servers = await asyncio.gather(
+        *[run_blocking(con(cloud_name).compute.get_server, i) for i in instances]
+    )
+    name = "cloudsupport-test-vol-{}".format(datetime.utcnow().strftime("%Y-%m-%dT%H%M%S"))
+    targets = [servers[i % len(servers)] for i in range(count)]
+    cycles = await asyncio.gather(
+        *[
+            _async_volume_cycle("{}-{}".format(name, i), srv, size, volume_type, cloud_name)
+            for i, srv in enumerate(targets)
+        ]
+    )
+    per_host = {}
+    for srv, timings in zip(targets, cycles):
+        per_host.setdefault(srv.compute_host, []).append(timings)
+    report = {}
+    for host, host_timings in per_host.items():
+        report[host] = {
+            "volumes": len(host_timings),
+            "errors": len([t for t in host_timings if "error" in t]),
+        }
+        for phase in VOLUME_PHASES:
+            report[host][phase] = percentiles([t[phase] for t in host_timings if phase in t])
+    return report
+
+
+def volume_latency_probe(*args, **kwargs):
+    """Run the volume latency probe, see async_volume_latency_probe for the parameters."""
+    return asyncio.run(async_volume_latency_probe(*args, **kwargs))
+
+
+# Live-migration benchmark
+
+PING_INTERVAL = 0.01
+# seconds between polls of a migrating instance
+MIGRATION_INTERVAL = 2
+PING_CMD = "ip netns exec {net_ns} ping -q -i {interval} -w {deadline} {addr}"
+PING_STATS = re.compile(r"(\d+) packets transmitted, (\d+) received")
+
+
+def ping_downtime(output, interval=PING_INTERVAL):
+    """Estimate downtime in seconds from the lost packets of a ping summary.
+
+    :param output: ping -q output
+    :param interval: seconds between pings
+    :return: tuple (transmitted, received, downtime) or None if there is no summary
+    """
+    match = PING_STATS.search(output)
+    if not match:
+        return None
+    transmitted, received = int(match.group(1)), int(match.group(2))
+    return transmitted, received, round((transmitted - received) * interval, 3)
+
+
+async def _async_stop_ping(node, addr, deadline, attempts=10):
+    """Interrupt a running ping so that it prints its summary and exits."""
+    # the bracket keeps pkill from matching its own sudo wrapper
+    pattern = "[p]ing -q -i {} -w {} {}".format(PING_INTERVAL, deadline, addr)
+    for _ in range(attempts):
+        res = await run_worker(
+            node.sudo, "pkill -INT -f '{}'".format(pattern), warn=True, hide=True
+        )
+        if res.ok:
+            return
+        # ping may not have started yet
+        await asyncio.sleep(0.5)
+
+
+def probe_target(srv, net, migrating, cloud_name="cloud1"):
+    """Find a netns to ping a migrated instance from that does not move with it.
+
+    With OVS the DHCP agent netns is used, as by test_connectivity. With OVN the metadata
+    netns of the source hypervisor is removed once the instance leaves it, so the netns of
+    a hypervisor running another instance of the test network, not being migrated, is used.
+
+    :param srv: the migrated server
+    :param net: the test network
+    :param migrating: ids of all the servers being migrated
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: tuple (host, netns name), or None if no hypervisor qualifies
+    """
+    if not is_ovn_used(srv.hypervisor_hostname, cloud_name=cloud_name):
+        return netns_target(srv, net, cloud_name=cloud_name)
+    hosts = sorted(
+        {
+            port.binding_host_id
+            for port in con(cloud_name).network.ports(network_id=net.id)
+            if (port.device_owner or "").startswith("compute:")
+            and port.device_id not in migrating
+            and port.binding_host_id
+        }
+    )
+    if not hosts:
+        return None
+    return hosts[0], "{}-{}".format(OVN_NET_NS, net.id)
+
+
+async def _async_migrate_instance(srv, net, destination, wait, target, cloud_name):
+    """Live-migrate one instance while pinging it from a netns that does not move with it.
+
+    :param target: tuple (host, netns name) to ping from, None to migrate without pinging
+    :return: dictionary with the source and destination, duration, downtime or error
+    """
+    source = srv.compute_host
+    result = {"source": source, "destination": destination}
+    node = ping = None
+    addr = srv.addresses[TEST_NETWORK][0]["addr"]
+    if target is None:
+        result["downtime-error"] = "no hypervisor outside the migration to ping from"
+    else:
+        host, net_ns = target
+        node = node_connection(host)
+        ping_cmd = PING_CMD.format(net_ns=net_ns, interval=PING_INTERVAL, deadline=wait, addr=addr)
+        ping = asyncio.ensure_future(run_worker(node.sudo, ping_cmd, warn=True, hide=True))
+    start = time.monotonic()
+    try:
+        await run_blocking(
+            con(cloud_name).compute.live_migrate_server,
+            srv.id,
+            host=destination,
+            block_migration="auto",
+        )
+        await async_wait_for_migration(srv.id, source, MIGRATION_INTERVAL, wait, cloud_name)
+        result["duration"] = round(time.monotonic() - start, 3)
+    except (CloudSupportError, openstack.exceptions.SDKException) as err:
+        logging.warning("Live migration of %s to %s failed: %s", srv.id, destination, err)
+        result["error"] = str(err)
+    finally:
+        if ping is not None:
+            await _async_stop_ping(node, addr, wait)
+            ping_res = await ping
+            node.close()
+    stats = ping_downtime(ping_res.stdout) if ping is not None else None
+    if stats:
+        result["transmitted"], result["received"], result["downtime"] = stats
+    return result
+
+
+async def async_live_migration_benchmark(
+    destinations, instance=None, max_concurrent=1, wait=600, cloud_name="cloud1"
+):
+    """Live-migrate test instances and measure migration time and ping downtime.
+
+    Each instance is migrated to the next destination (round-robin) that is not its current
+    host, while a 10ms interval ping runs from a netns that does not move with it, see
+    probe_target.
+
+    :param destinations: list of hypervisors to migrate to
+    :param instance: instance id. If missing, all instances whose names start with
+    "cloudsupport-test-" will be migrated
+    :param max_concurrent: number of migrations run at the same time
+    :param wait: seconds to wait for a migration
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary with per-instance results and a per source/destination summary
+    """
+    instances = await async_get_instances(instance=instance, cloud_name=cloud_name)
+    if isinstance(instances, dict):
+        return instances
+    net = await run_blocking(con(cloud_name).network.find_network, TEST_NETWORK)
+    servers = await asyncio.gather(
+        *[run_blocking(con(cloud_name).compute.get_server, i) for i in instances]
+    )
+    limiter = asyncio.Semaphore(max_concurrent)
+    # resolved before the first migration, while every instance is on its source
+    targets = await asyncio.gather(
+        *[run_blocking(probe_target, srv, net, instances, cloud_name) for srv in servers]
+    )
+
+    async def migrate(index, srv, target):
+        candidates = [d for d in destinations if d != srv.compute_host]
+        if not candidates:
+            return {"source": srv.compute_host, "error": "no destination other than source"}
+        async with limiter:
+            return await _async_migrate_instance(
+                srv, net, candidates[index % len(candidates)], wait, target, cloud_name
+            )
+
+    results = await asyncio.gather(
+        *[migrate(i, srv, target) for i, (srv, target) in enumerate(zip(servers, targets))]
+    )
+    pairs = {}
+    for result in results:
+        key = "{}->{}".format(result["source"], result.get("destination"))
+        pairs.setdefault(key, []).append(result)
+    summary = {}
+    for key, pair_results in pairs.items():
+        summary[key] = {
+            "migrations": len(pair_results),
+            "failures": len([r for r in pair_results if "error" in r]),
+            "duration": percentiles([r["duration"] for r in pair_results if "duration" in r]),
+            "downtime": percentiles([r["downtime"] for r in pair_results if "downtime" in r]),
+        }
+    return {"instances": dict(zip(instances, results)), "summary": summary}
+
+
+def live_migration_benchmark(*args, **kwargs):
+    """Run the live-migration benchmark, see async_live_migration_benchmark."""
+    return asyncio.run(async_live_migration_benchmark(*args, **kwargs))
+
+
+# VNF validation
+
+# bytes hashed by the cpu benchmark and copied by the memory benchmark, in MiB
+VNF_BENCH_MB = 1024
+CPU_BENCH_CMD = (
+    "s=$(date +%s%N); dd if=/dev/zero bs=1M count={mb} 2>/dev/null | sha256sum >/dev/null; "
+    "echo $(( ($(date +%s%N) - s) / 1000000 ))"
+)
+MEM_BENCH_CMD = "dd if=/dev/zero of=/dev/null bs=1M count={mb} 2>&1 | tail -n 1"
+DD_RATE = re.compile(r"([\d.,]+) ([kKMGT]?)B/s")
+DD_UNITS = {"": 1e-6, "k": 1e-3, "K": 1e-3, "M": 1, "G": 1e3, "T": 1e6}
+HOST_CPU_CMD = (
+    "for c in {cpus}; do echo $c $(cat /sys/devices/system/cpu/cpu$c/topology/thread_siblings_list)"
+    " $(basename /sys/devices/system/cpu/cpu$c/node*); done"
+)
+# hw:mem_page_size of the vnfspecs flavor, in KiB
+VNF_PAGE_SIZE = 1048576
+PAGE_UNITS = {
+    "b": 1 / 1024,
+    "k": 1,
+    "kib": 1,
+    "m": 1024,
+    "mib": 1024,
+    "g": 1048576,
+    "gib": 1048576,
+}
+
+
+def parse_cpuset(cpuset):
+    """Parse a libvirt or sysfs cpu list such as "0-3,8,^2" into a set of ints."""
+    cpus, excluded = set(), set()
+    for part in cpuset.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        target = excluded if part.startswith("^") else cpus
+        part = part.lstrip("^")
+        if "-" in part:
+            first, last = part.split("-")
+            target.update(range(int(first), int(last) + 1))
+        else:
+            target.add(int(part))
+    return cpus - excluded
+
+
+def parse_domain(xml):
+    """Extract the pinning, NUMA and hugepage settings of a libvirt domain.
+
+    :param xml: output of virsh dumpxml
+    :return: dictionary with vcpus, pins (vcpu -> host cpus), memory nodes, memory mode
+    and hugepage size in KiB
+    """
+    root = ElementTree.fromstring(xml)
+    pins = {
+        int(pin.get("vcpu")): parse_cpuset(pin.get("cpuset"))
+        for pin in root.findall("./cputune/vcpupin")
+    }
+    memory = root.find("./numatune/memory")
+    nodes = set()
+    for element in root.findall("./numatune/memory") + root.findall("./numatune/memnode"):
+        if element.get("nodeset"):
+            nodes |= parse_cpuset(element.get("nodeset"))
+    page = root.find("./memoryBacking/hugepages/page")
+    page_size = None
+    if page is not None:
+        page_size = int(page.get("size")) * PAGE_UNITS[page.get("unit", "KiB").lower()]
+    elif root.find("./memoryBacking/hugepages") is not None:
+        page_size = "default"
+    return {
+        "vcpus": int(root.findtext("./vcpu")),
+        "pins": pins,
+        "memory-nodes": nodes,
+        "memory-mode": memory.get("mode") if memory is not None else None,
+        "page-size": page_size,
+    }
+
+
+def parse_host_cpus(output):
+    """Parse the HOST_CPU_CMD output into {cpu: (thread siblings, numa node)}."""
+    cpus = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 3 and fields[2].startswith("node"):
+            cpus[int(fields[0])] = (parse_cpuset(fields[1]), int(fields[2][4:]))
+    return cpus
+
+
+def check_vnf_placement(domain, host_cpus):
+    """Check that a domain honors the vnfspecs flavor.
+
+    The flavor asks for dedicated CPUs (each vCPU pinned to its own host CPU), the
+    "require" thread policy (vCPUs placed on thread siblings, so the pinned set contains
+    whole cores), memory on the NUMA nodes of the pinned CPUs and 1G hugepages.
+
+    :param domain: parse_domain result
+    :param host_cpus: parse_host_cpus result for the pinned CPUs
+    :return: list of issues, empty if the placement is as expected
+    """
+    issues = []
+    pins = domain["pins"]
+    pinned = set().union(*pins.values()) if pins else set()
+    if len(pins) != domain["vcpus"] or any(len(cpus) != 1 for cpus in pins.values()):
+        issues.append("vcpus are not pinned 1:1 to host cpus")
+    elif len(pinned) != domain["vcpus"]:
+        issues.append("vcpus share host cpus")
+    if any(not host_cpus.get(cpu, (set(), None))[0] <= pinned for cpu in pinned):
+        issues.append("vcpus are not placed on whole cores (thread siblings)")
+    cpu_nodes = {host_cpus[cpu][1] for cpu in pinned if cpu in host_cpus}
+    if domain["memory-mode"] != "strict" or not domain["memory-nodes"]:
+        issues.append("memory is not bound to numa nodes")
+    elif not cpu_nodes <= domain["memory-nodes"]:
+        issues.append(
+            "cpus on numa nodes {} but memory on {}".format(
+                sorted(cpu_nodes), sorted(domain["memory-nodes"])
+            )
+        )
+    if domain["page-size"] != VNF_PAGE_SIZE:
+        issues.append("memory is not backed by 1G hugepages ({})".format(domain["page-size"]))
+    return issues
+
+
+def parse_dd_rate(output):
+    """Return the rate reported by dd in MB/s, or None."""
+    match = DD_RATE.search(output)
+    if match is None:
+        return None
+    return round(float(match.group(1).replace(",", ".")) * DD_UNITS[match.group(2)], 1)
+
+
+async def _async_inspect_domain(srv):
+    """Return the parsed libvirt domain of a server and the topology of its pinned CPUs."""
+    node = node_connection(srv.compute_host)
+    try:
+        res = await run_worker(node.sudo, "virsh dumpxml {}".format(srv.instance_name), hide=True)
+        domain = parse_domain(res.stdout)
+        pinned = set().union(*domain["pins"].values()) if domain["pins"] else set()
+        host_cpus = {}
+        if pinned:
+            res = await run_worker(
+                node.run, HOST_CPU_CMD.format(cpus=" ".join(map(str, sorted(pinned)))), hide=True
+            )
+            host_cpus = parse_host_cpus(res.stdout)
+    finally:
+        node.close()
+    return domain, host_cpus
+
+
+async def _async_guest_benchmark(srv, net, mb, cloud_name):
+    """Run the cpu and memory microbenchmarks in a guest.
+
+    :return: dictionary with the sha256 rate and the memory copy rate in MB/s
+    """
+    conn = guest_connection(srv, net, cloud_name=cloud_name)
+    try:
+        res = await run_worker(conn.run, CPU_BENCH_CMD.format(mb=mb), hide=True)
+        millis = int(res.stdout.strip())
+        res = await run_worker(conn.run, MEM_BENCH_CMD.format(mb=mb), hide=True)
+    finally:
+        conn.close()
+    return {
+        "cpu-mbps": round(mb * 1000 / millis, 1) if millis else None,
+        "mem-mbps": parse_dd_rate(res.stdout),
+    }
+
+
+async def _async_validate_instance(instance, net, mb, cloud_name):
+    """Validate the placement and performance of one test instance."""
+    srv = await run_blocking(con(cloud_name).compute.get_server, instance)
+    report = {"host": srv.compute_host}
+    try:
+        domain, host_cpus = await _async_inspect_domain(srv)
+        report["pinned-cpus"] = ",".join(
+            str(cpu) for vcpu in sorted(domain["pins"]) for cpu in sorted(domain["pins"][vcpu])
+        )
+        report["issues"] = check_vnf_placement(domain, host_cpus)
+        report.update(await _async_guest_benchmark(srv, net, mb, cloud_name))
+    except Exception as err:
+        logging.warning("VNF validation failed on %s: %s", instance, err)
+        report["error"] = str(err)
+    return report
+
+
+def flag_deviations(reports, metrics=("cpu-mbps", "mem-mbps"), threshold=20.0):
+    """Add an issue to the reports whose metrics are below the median of all reports.
+
+    :param reports: instance reports keyed on instance id, modified in place
+    :param metrics: higher-is-better metrics to compare
+    :param threshold: tolerated deviation from the median in percent
+    """
+    for metric in metrics:
+        values = [r[metric] for r in reports.values() if r.get(metric)]
+        if len(values) < 2:
+            continue
+        median = statistics.median(values)
+        for report in reports.values():
+            value = report.get(metric)
+            if value and value < median * (1 - threshold / 100):
+                report.setdefault("issues", []).append(
+                    "{} {} is {:.0f}% below the median {}".format(
+                        metric, value, (1 - value / median) * 100, median
+                    )
+                )
+
+
+async def async_vnf_validation(
+    instance=None, mb=VNF_BENCH_MB, threshold=20.0, cloud_name="cloud1"
+):
+    """Validate that vnfspecs test instances are pinned, NUMA-local and hugepage-backed.
+
+    The libvirt domains are inspected on the compute nodes and the microbenchmarks run in
+    the guests, all instances concurrently.
+
+    :param instance: instance id. If missing, all instances whose names start with
+    "cloudsupport-test-" will be validated
+    :param mb: MiB hashed by the cpu and copied by the memory benchmark
+    :param threshold: tolerated deviation from the median performance in percent
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary with per-instance reports and the flagged instances
+    """
+    instances = await async_get_instances(instance=instance, cloud_name=cloud_name)
+    if isinstance(instances, dict):
+        return instances
+    net = await run_blocking(con(cloud_name).network.find_network, TEST_NETWORK)
+    reports = await asyncio.gather(
+        *[_async_validate_instance(i, net, mb, cloud_name) for i in instances]
+    )
+    reports = dict(zip(instances, reports))
+    flag_deviations(reports, threshold=threshold)
+    return {
+        "instances": reports,
+        "flagged": sorted(i for i, r in reports.items() if r.get("issues") or "error" in r),
+    }
+
+
+def vnf_validation(*args, **kwargs):
+    """Run the VNF validation, see async_vnf_validation for the parameters."""
+    return asyncio.run(async_vnf_validation(*args, **kwargs))
+
+
+# SR-IOV benchmark
+
+IPERF_SERVER_CMD = "iperf3 -s -D -B {addr}"
+IPERF_TCP_CMD = "iperf3 -J -c {addr} -B {src} -t {duration} -P {streams}"
+# small packets at unlimited rate, to measure the packet rate of the VF
+IPERF_UDP_CMD = "iperf3 -J -u -b 0 -l {size} -c {addr} -B {src} -t {duration}"
+SMALL_PACKET = 64
+
+
+async def _async_vf_port(srv, cloud_name):
+    """Return the direct (SR-IOV) port of a server, or None."""
+    ports = await run_blocking(lambda: list(con(cloud_name).network.ports(device_id=srv.id)))
+    for port in ports:
+        if port.binding_vnic_type == "direct":
+            return port
+    return None
+
+
+async def _async_configure_vf(conn, port, peers):
+    """Bring up the VF of a port in a guest and route the peer VF addresses through it.
+
+    The VF has an address on the test network like the normal port, so it is configured
+    as a /32 with host routes to the other VFs, keeping the normal port's routes intact.
+
+    :param conn: guest connection
+    :param port: the direct port of the guest
+    :param peers: fixed IPs of the other VFs
+    :return: name of the VF interface
+    """
+    res = await run_worker(conn.run, "ip -o link", hide=True)
+    ifname = None
+    for line in res.stdout.splitlines():
+        if port.mac_address.lower() in line.lower():
+            ifname = line.split(":")[1].strip().split("@")[0]
+    if ifname is None:
+        raise CloudSupportError("no interface with mac {}".format(port.mac_address))
+    addr = port.fixed_ips[0]["ip_address"]
+    cmds = [
+        "ip link set {} up".format(ifname),
+        "ip addr replace {}/32 dev {}".format(addr, ifname),
+    ] + ["ip route replace {}/32 dev {} src {}".format(peer, ifname, addr) for peer in peers]
+    await run_worker(conn.sudo, " && ".join(cmds), hide=True)
+    return ifname
+
+
+def parse_iperf(output):
+    """Extract throughput, or packet rate and loss, from iperf3 json output."""
+    data = json.loads(output)
+    if "error" in data:
+        return {"error": data["error"]}
+    end = data["end"]
+    if "sum_received" in end:
+        return {"gbps": round(end["sum_received"]["bits_per_second"] / 1e9, 3)}
+    udp = end["sum"]
+    received = udp["packets"] - udp["lost_packets"]
+    return {
+        "kpps": round(received / udp["seconds"] / 1000, 1) if udp["seconds"] else 0.0,
+        "loss-pct": round(udp["lost_percent"], 3),
+    }
+
+
+async def _async_iperf(client, server, duration, streams):
+    """Measure TCP throughput and small-packet rate from one VF to another."""
+    src, addr = client["addr"], server["addr"]
+    tcp = await run_worker(
+        client["conn"].run,
+        IPERF_TCP_CMD.format(addr=addr, src=src, duration=duration, streams=streams),
+        warn=True,
+        hide=True,
+    )
+    udp = await run_worker(
+        client["conn"].run,
+        IPERF_UDP_CMD.format(addr=addr, src=src, duration=duration, size=SMALL_PACKET),
+        warn=True,
+        hide=True,
+    )
+    result = {"from": client["host"], "to": server["host"]}
+    for res in (tcp, udp):
+        try:
+            result.update(parse_iperf(res.stdout))
+        except (ValueError, KeyError):
+            result["error"] = res.stderr.strip() or res.stdout.strip()
+    return result
+
+
+def _summarize_sriov(pairs):
+    """Aggregate pair results per physnet, and per sending and receiving host."""
+    summary = {}
+    for physnet, results in pairs.items():
+        ok = [r for r in results if "error" not in r]
+        hosts = {}
+        for result in ok:
+            for host, direction in ((result["from"], "tx"), (result["to"], "rx")):
+                hosts.setdefault(host, {})["{}-gbps".format(direction)] = result.get("gbps")
+                hosts[host]["{}-kpps".format(direction)] = result.get("kpps")
+        gbps = [r["gbps"] for r in ok if "gbps" in r]
+        kpps = [r["kpps"] for r in ok if "kpps" in r]
+        summary[physnet] = {
+            "pairs": len(results),
+            "failed": len(results) - len(ok),
+            "min-gbps": min(gbps, default=None),
+            "median-gbps": round(statistics.median(gbps), 3) if gbps else None,
+            "min-kpps": min(kpps, default=None),
+            "median-kpps": round(statistics.median(kpps), 1) if kpps else None,
+            "hosts": hosts,
+        }
+    return summary
+
+
+async def async_sriov_benchmark(duration=10, streams=4, cloud_name="cloud1"):
+    """Measure VF throughput and packet rate between test instances on different computes.
+
+    Test instances created with a physnet have a direct port. One instance per compute
+    node and physnet is used; within a physnet the nodes form a ring, each sending to the
+    next one. The pairs run one after the other so that they do not share NIC bandwidth.
+    Requires iperf3 in the test image and the instances to accept the charm's ssh-key.
+
+    :param duration: seconds of each iperf3 run
+    :param streams: parallel TCP streams
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary of the pair results and a summary, keyed on physnet
+    """
+    instances = await async_get_instances(cloud_name=cloud_name)
+    if isinstance(instances, dict):
+        return instances
+    net = await run_blocking(con(cloud_name).network.find_network, TEST_NETWORK)
+    servers = await asyncio.gather(
+        *[run_blocking(con(cloud_name).compute.get_server, i) for i in instances]
+    )
+    ports = await asyncio.gather(*[_async_vf_port(srv, cloud_name) for srv in servers])
+    # one instance per compute node and physnet
+    members = {}
+    for srv, port in zip(servers, ports):
+        if port is None:
+            continue
+        physnet = (port.binding_profile or {}).get("physical_network", "unknown")
+        members.setdefault(physnet, {}).setdefault(srv.compute_host, (srv, port))
+    members = {physnet: hosts for physnet, hosts in members.items() if len(hosts) > 1}
+    if not members:
+        return {"warning": "No SR-IOV test instances on two or more compute nodes"}
+
+    vfs = []
+    pairs = {}
+    try:
+        for physnet, hosts in members.items():
+            ring = []
+            peers = [port.fixed_ips[0]["ip_address"] for srv, port in hosts.values()]
+            for host, (srv, port) in sorted(hosts.items()):
+                conn = guest_connection(srv, net, cloud_name=cloud_name)
+                vf = {"host": host, "conn": conn, "addr": port.fixed_ips[0]["ip_address"]}
+                vfs.append(vf)
+                check = await run_worker(conn.run, "command -v iperf3", warn=True, hide=True)
+                if check.failed:
+                    raise CloudSupportError("iperf3 is not installed in {}".format(srv.id))
+                await _async_configure_vf(conn, port, [p for p in peers if p != vf["addr"]])
+                await run_worker(conn.run, IPERF_SERVER_CMD.format(addr=vf["addr"]), hide=True)
+                ring.append(vf)
+            pairs[physnet] = []
+            for i, client in enumerate(ring):
+                server = ring[(i + 1) % len(ring)]
+                pairs[physnet].append(await _async_iperf(client, server, duration, streams))
+    finally:
+        for vf in vfs:
+            await run_worker(vf["conn"].run, "pkill iperf3", warn=True, hide=True)
+            vf["conn"].close()
+    return {"pairs": pairs, "summary": _summarize_sriov(pairs)}
+
+
+def sriov_benchmark(*args, **kwargs):
+    """Run the SR-IOV benchmark, see async_sriov_benchmark for the parameters."""
+    return asyncio.run(async_sriov_benchmark(*args, **kwargs))
+
+
+# East-west matrix
+
+PROBE_AGENT_PATH = "/tmp/cloudsupport-probe.sh"
+# pings all peers given as arguments in parallel and prints "<peer>|<ping summary>" lines
+PROBE_AGENT = """#!/bin/sh
+count=$1
+shift
+for peer in "$@"; do
+    (echo "$peer|$(ping -q -c "$count" -i 0.2 -W 1 "$peer" 2>&1 | tr '\\n' ' ')") &
+done
+wait
+"""
+
+
+def parse_probe_agent(output):
+    """Parse the probe agent output into {peer address: (loss, rtt)}."""
+    results = {}
+    for line in output.splitlines():
+        peer, sep, summary = line.partition("|")
+        if sep:
+            results[peer.strip()] = parse_ping(summary)
+    return results
+
+
+async def _async_run_probe_agent(srv, net, peers, count, cloud_name):
+    """Push the probe agent into an instance and probe all peers from it.
+
+    :return: dictionary of (loss, rtt) keyed on peer address
+    """
+    conn = guest_connection(srv, net, cloud_name=cloud_name)
+    try:
+        await run_worker(conn.put, io.StringIO(PROBE_AGENT), PROBE_AGENT_PATH)
+        res = await run_worker(
+            conn.run,
+            "sh {} {} {}".format(PROBE_AGENT_PATH, count, " ".join(peers)),
+            hide=True,
+        )
+    finally:
+        conn.close()
+    return parse_probe_agent(res.stdout)
+
+
+def format_matrix(servers, results):
+    """Render the loss/RTT results as a compact text matrix.
+
+    Rows are sources and columns destinations, identified by the first 8 characters of the
+    instance id; cells are "loss%/rtt-ms", "-" on the diagonal and "?" if not probed.
+    """
+    ids = [srv.id[:8] for srv in servers]
+    rows = [["src\\dst"] + ids]
+    for srv, short in zip(servers, ids):
+        row = [short]
+        for dst in servers:
+            if dst.id == srv.id:
+                row.append("-")
+                continue
+            loss, rtt = results.get(srv.id, {}).get(dst.id, (None, None))
+            if loss is None:
+                row.append("?")
+            else:
+                row.append(
+                    "{:g}%/{}".format(loss, "{:.2f}".format(rtt) if rtt is not None else "-")
+                )
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows
+    )
+
+
+def summarize_matrix(servers, results):
+    """Aggregate the matrix per pair of compute nodes: worst loss and median RTT."""
+    hosts = {srv.id: srv.compute_host for srv in servers}
+    grouped = {}
+    for src, dsts in results.items():
+        for dst, (loss, rtt) in dsts.items():
+            grouped.setdefault("{} -> {}".format(hosts[src], hosts[dst]), []).append((loss, rtt))
+    summary = {}
+    for pair, samples in grouped.items():
+        rtts = [rtt for _, rtt in samples if rtt is not None]
+        summary[pair] = {
+            "pairs": len(samples),
+            "max-loss": max(loss for loss, _ in samples),
+            "median-rtt": round(statistics.median(rtts), 3) if rtts else None,
+        }
+    return summary
+
+
+async def async_east_west_matrix(count=5, cloud_name="cloud1"):
+    """Probe every test instance from every other one, from inside the guests.
+
+    A small probe agent is pushed into each instance over the ssh proxy path of
+    guest_connection. All agents run at the same time and each pings all its peers in
+    parallel, so the N * (N - 1) pairs take about the time of a single ping run.
+    Requires the instances to accept the charm's ssh-key.
+
+    :param count: pings per pair
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary with the text matrix, a per compute pair summary, the instance
+    hosts and the instances whose agent failed
+    """
+    instances = await async_get_instances(cloud_name=cloud_name)
+    if isinstance(instances, dict):
+        return instances
+    net = await run_blocking(con(cloud_name).network.find_network, TEST_NETWORK)
+    servers = await asyncio.gather(
+        *[run_blocking(con(cloud_name).compute.get_server, i) for i in instances]
+    )
+    servers = sorted(servers, key=lambda srv: (srv.compute_host or "", srv.id))
+    addrs = {srv.addresses[TEST_NETWORK][0]["addr"]: srv.id for srv in servers}
+    outputs = await asyncio.gather(
+        *[
+            _async_run_probe_agent(
+                srv,
+                net,
+                [addr for addr, peer in addrs.items() if peer != srv.id],
+                count,
+                cloud_name,
+            )
+            for srv in servers
+        ],
+        return_exceptions=True,
+    )
+    results, failed = {}, {}
+    for srv, output in zip(servers, outputs):
+        if isinstance(output, Exception):
+            logging.warning("Probe agent failed on %s: %s", srv.id, output)
+            failed[srv.id] = str(output)
+            continue
+        results[srv.id] = {addrs[addr]: probe for addr, probe in output.items() if addr in addrs}
+    return {
+        "matrix": format_matrix(servers, results),
+        "summary": summarize_matrix(servers, results),
+        "instances": {srv.id[:8]: "{} {}".format(srv.id, srv.compute_host) for srv in servers},
+        "failed": failed,
+    }
+
+
+def east_west_matrix(*args, **kwargs):
+    """Run the east-west matrix, see async_east_west_matrix for the parameters."""
+    return asyncio.run(async_east_west_matrix(*args, **kwargs))
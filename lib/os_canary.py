@@ -0,0 +1,266 @@
+"""This module contains the rolling canary of the compute nodes.
+
+create-test-instances boots on an explicit list of nodes, all put into the test aggregate
+at once. The canary selects the nodes by availability zone, aggregate or all enabled
+hypervisors instead, and tests them in waves: every node of a wave gets one instance
+forced onto it, which is probed and deleted before the next wave starts. Forced placement
+needs no aggregate, so the canary leaves the test aggregate of create-test-instances alone.
+"""
+
+import asyncio
+import logging
+import statistics
+import time
+
+import openstack.exceptions
+from os_testing import (
+    TEST_NETWORK,
+    TEST_SECGROUP,
+    CloudSupportError,
+    async_probe_servers,
+    async_wait_for_delete,
+    async_wait_for_status,
+    con,
+    ensure_flavor,
+    ensure_net,
+    ensure_sg_rules,
+    iterate,
+    parse_ping,
+    run_blocking,
+    run_worker,
+)
+
+CANARY_FLAVOR = "cloudsupport-canary-flavor"
+# seconds between probes of a canary whose guest is not reachable yet
+PROBE_INTERVAL = 10
+# output of a successful nc -vz
+SSH_OK = "succeeded"
+STAGES = ("boot", "probe", "delete")
+
+
+def canary_name(name_prefix, node):
+    """Return the name of the canary instance of a node."""
+    return "{}-canary-{}".format(name_prefix, node)
+
+
+def split_waves(nodes, size):
+    """Split nodes into waves of at most size nodes, in order."""
+    waves = []
+    for node in nodes:
+        if not waves or len(waves[-1]) >= size:
+            waves.append([])
+        waves[-1].append(node)
+    return waves
+
+
+async def async_select_nodes(zone=None, aggregate=None, cloud_name="cloud1"):
+    """Return the enabled and up compute nodes, optionally of a zone and/or an aggregate.
+
+    :param zone: availability zone of the nodes, None for all zones
+    :param aggregate: aggregate of the nodes, None for all aggregates
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary of availability zones keyed on node, sorted on node
+    :raises CloudSupportError: if the aggregate does not exist
+    """
+    services = await run_blocking(
+        lambda: list(con(cloud_name).compute.services(binary="nova-compute"))
+    )
+    hosts = None
+    if aggregate:
+        agg = await run_blocking(con(cloud_name).compute.find_aggregate, aggregate)
+        if agg is None:
+            raise CloudSupportError("Aggregate not found: {}".format(aggregate))
+        hosts = set(agg.hosts or [])
+    return {
+        service.host: service.availability_zone
+        for service in sorted(services, key=lambda service: service.host)
+        if service.status == "enabled"
+        and service.state == "up"
+        and (not zone or service.availability_zone == zone)
+        and (hosts is None or service.host in hosts)
+    }
+
+
+async def _async_probe(srv, probe_wait, cloud_name):
+    """Probe a canary until its guest answers ping and tcp:22, or probe_wait expires.
+
+    :return: dictionary with the packet loss, average rtt and whether ssh answered
+    """
+    deadline = time.monotonic() + probe_wait
+    while True:
+        (result,) = await async_probe_servers([srv], cloud_name=cloud_name)
+        loss, rtt = parse_ping(result["ping"])
+        probe = {"loss": loss, "rtt": rtt, "ssh": SSH_OK in result["ssh"]}
+        if (loss < 100 and probe["ssh"]) or time.monotonic() >= deadline:
+            return probe
+        await asyncio.sleep(PROBE_INTERVAL)
+
+
+async def _async_canary(node, zone, name, img, flavor, net, key_name, probe_wait, cloud_name):
+    """Boot an instance forced onto a node, probe it and delete it.
+
+    The instance is deleted, and gone, before the result is returned, whatever the outcome
+    of the boot and the probe.
+
+    :return: dictionary with the result, the failed stage and the seconds of every stage
+    """
+    start = time.monotonic()
+    result = {"result": "fail"}
+    current = "boot"
+
+    def stage(name, since):
+        result["{}-seconds".format(name)] = round(time.monotonic() - since, 3)
+        return time.monotonic()
+
+    optional_params = {}
+    if key_name:
+        optional_params["key_name"] = key_name
+    server = None
+    since = start
+    try:
+        server = await run_blocking(
+            con(cloud_name).compute.create_server,
+            name=name,
+            image_id=img.id,
+            flavor_id=flavor.id,
+            networks=[{"uuid": net.id}],
+            security_groups=[{"name": TEST_SECGROUP}],
+            availability_zone="{}:{}".format(zone, node),
+            **optional_params,
+        )
+        result["instance"] = server.id
+        srv = await async_wait_for_status(con(cloud_name).compute.get_server, server.id)
+        since = stage("boot", since)
+        if srv.compute_host != node:
+            raise CloudSupportError("booted on {} instead".format(srv.compute_host))
+        current = "probe"
+        result.update(await _async_probe(srv, probe_wait, cloud_name))
+        since = stage("probe", since)
+        if result["loss"] < 100 and result["ssh"]:
+            result["result"] = "pass"
+        else:
+            result["stage"] = "probe"
+            result["error"] = "no ping reply" if result["loss"] >= 100 else "tcp:22 not open"
+    except Exception as error:  # the probe also runs commands over ssh on the node
+        logging.warning("Canary of %s failed to %s: %s", node, current, error)
+        result.update({"stage": current, "error": str(error)})
+        since = time.monotonic()
+
+    if server is not None:
+        try:
+            await run_blocking(con(cloud_name).compute.delete_server, server.id)
+            await async_wait_for_delete(con(cloud_name).compute.get_server, server.id, wait=300)
+        except openstack.exceptions.SDKException as error:
+            logging.warning("Fault deleting canary %s: %s", server.id, error)
+            result["delete-error"] = str(error)
+        stage("delete", since)
+    result["seconds"] = round(time.monotonic() - start, 3)
+    return result
+
+
+async def async_iter_rolling_canary(
+    image,
+    disk,
+    cidr,
+    name_prefix,
+    zone=None,
+    aggregate=None,
+    wave_size=20,
+    max_in_flight=20,
+    max_failures=0,
+    probe_wait=120,
+    key_name=None,
+    cloud_name="cloud1",
+):
+    """Test the selected compute nodes in waves, see iter_rolling_canary.
+
+    :return: async iterator of (node, result) tuples, in completion order within a wave
+    """
+    nodes = await async_select_nodes(zone, aggregate, cloud_name)
+    if not nodes:
+        raise CloudSupportError("No enabled compute node found")
+    ok, net = await run_worker(ensure_net, TEST_NETWORK, cidr, cloud_name=cloud_name)
+    if not ok:
+        raise CloudSupportError(net)
+    await run_worker(ensure_sg_rules, TEST_SECGROUP, cloud_name=cloud_name)
+    img = await run_blocking(con(cloud_name).image.find_image, image)
+    if not img:
+        raise CloudSupportError("Image not found: {}".format(image))
+    flavor = await run_worker(
+        ensure_flavor, CANARY_FLAVOR, 1, 512, disk, vnfspecs=False, cloud_name=cloud_name
+    )
+
+    limiter = asyncio.Semaphore(max_in_flight)
+
+    async def canary(wave, node):
+        async with limiter:
+            result = await _async_canary(
+                node,
+                nodes[node],
+                canary_name(name_prefix, node),
+                img,
+                flavor,
+                net,
+                key_name,
+                probe_wait,
+                cloud_name,
+            )
+        return node, dict(result, wave=wave)
+
+    failures = 0
+    waves = split_waves(list(nodes), wave_size)
+    for wave, wave_nodes in enumerate(waves, 1):
+        if max_failures and failures >= max_failures:
+            reason = "halted after {} failed nodes".format(failures)
+            for node in wave_nodes:
+                yield node, {"result": "skipped", "wave": wave, "error": reason}
+            continue
+        logging.info("Canary wave %d/%d: %s", wave, len(waves), wave_nodes)
+        for outcome in asyncio.as_completed([canary(wave, node) for node in wave_nodes]):
+            node, result = await outcome
+            failures += result["result"] == "fail"
+            yield node, result
+
+
+def canary_summary(report):
+    """Summarize a rolling canary report.
+
+    :param report: dictionary of canary results keyed on node
+    :return: dictionary with the passed, failed and skipped nodes, and the median and
+        maximum seconds of every stage
+    """
+    summary = {
+        outcome: sorted(node for node, result in report.items() if result["result"] == outcome)
+        for outcome in ("pass", "fail", "skipped")
+    }
+    summary["waves"] = max((result["wave"] for result in report.values()), default=0)
+    for key in ["{}-seconds".format(name) for name in STAGES] + ["seconds"]:
+        seconds = [result[key] for result in report.values() if key in result]
+        if seconds:
+            summary[key] = {"median": statistics.median(seconds), "max": max(seconds)}
+    return summary
+
+
+def iter_rolling_canary(*args, **kwargs):
+    """Test the selected compute nodes in waves, yielding each node result as it completes.
+
+    Every wave boots one instance forced onto each of its nodes, at most max_in_flight at
+    a time, probes it from its netns and deletes it; the next wave starts once all the
+    instances of the wave are gone. The shared test network, secgroup and canary flavor
+    are set up before the first wave, so setup errors are raised on the first iteration.
+
+    :param image: name of the image to boot
+    :param disk: root disk size in GB of the canaries
+    :param cidr: test network cidr
+    :param name_prefix: name prefix of the test instances
+    :param zone: only test the nodes of this availability zone
+    :param aggregate: only test the nodes of this aggregate
+    :param wave_size: number of nodes per wave
+    :param max_in_flight: number of canaries booted, probed or deleted at the same time
+    :param max_failures: skip the remaining waves once this many nodes failed, 0 to run all
+    :param probe_wait: seconds to wait for the guest to answer once active
+    :param key_name: optional keypair of the canaries
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: iterator of (node, result) tuples
+    """
+    return iterate(async_iter_rolling_canary(*args, **kwargs))
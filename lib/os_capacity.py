@@ -0,0 +1,216 @@
+"""This module contains the Placement based capacity report of the compute nodes."""
+
+import asyncio
+import logging
+import math
+
+import openstack.exceptions
+
+from os_testing import con, run_blocking
+
+# root_provider_uuid in resource provider listings
+PLACEMENT_MICROVERSION = "1.14"
+# nested providers and whole provider trees in the allocation candidate summaries
+CANDIDATES_MICROVERSION = "1.29"
+# resource classes reported as columns, hugepages are any *HUGEPAGE* custom class
+RESOURCE_CLASSES = ("VCPU", "PCPU", "MEMORY_MB", "DISK_GB")
+HUGEPAGES = "HUGEPAGES"
+# a provider tree without these is not a compute node, e.g. a shared storage provider
+COMPUTE_CLASSES = ("VCPU", "PCPU", "MEMORY_MB")
+# hw:mem_page_size of the vnfspecs test flavor, the hugepage classes count such pages
+HUGEPAGE_SIZE_MB = 1024
+TABLE_COLUMNS = (
+    ("node", None),
+    ("vcpu-free", "VCPU"),
+    ("pcpu-free", "PCPU"),
+    ("ram-free-mb", "MEMORY_MB"),
+    ("disk-free-gb", "DISK_GB"),
+    ("hugepages-free", HUGEPAGES),
+    ("fits", "fits"),
+)
+
+
+def _placement_get(url, cloud_name, microversion=PLACEMENT_MICROVERSION):
+    """GET a Placement URL and return the decoded body."""
+    response = con(cloud_name).placement.get(url, microversion=microversion)
+    openstack.exceptions.raise_from_response(response)
+    return response.json()
+
+
+def _column(resource_class):
+    """Return the report column of a resource class, or None if it is not reported."""
+    if resource_class in RESOURCE_CLASSES:
+        return resource_class
+    if "HUGEPAGE" in resource_class:
+        return HUGEPAGES
+    return None
+
+
+def _add_resources(resources, resource_class, capacity, used):
+    """Add the capacity and usage of a resource class to its (capacity, used) column."""
+    column = _column(resource_class)
+    if column is not None:
+        prev_capacity, prev_used = resources.get(column, (0, 0))
+        resources[column] = (prev_capacity + capacity, prev_used + used)
+
+
+def _summary_resources(summary):
+    """Return the (capacity, used) per column of an allocation candidates provider summary."""
+    resources = {}
+    for resource_class, resource in summary["resources"].items():
+        _add_resources(resources, resource_class, resource["capacity"], resource["used"])
+    return resources
+
+
+async def _async_provider_resources(provider, cloud_name):
+    """Return the (capacity, used) per column of a resource provider."""
+    inventories, usages = await asyncio.gather(
+        run_blocking(
+            _placement_get,
+            "/resource_providers/{}/inventories".format(provider["uuid"]),
+            cloud_name,
+        ),
+        run_blocking(
+            _placement_get, "/resource_providers/{}/usages".format(provider["uuid"]), cloud_name
+        ),
+    )
+    resources = {}
+    for resource_class, inventory in inventories["inventories"].items():
+        capacity = int(
+            (inventory["total"] - inventory["reserved"]) * inventory["allocation_ratio"]
+        )
+        _add_resources(
+            resources, resource_class, capacity, usages["usages"].get(resource_class, 0)
+        )
+    return resources
+
+
+async def _async_candidate_summaries(request, cloud_name):
+    """Return the provider summaries of the allocation candidates of a resource request.
+
+    They hold the capacity and usage of every provider in the trees of the nodes the
+    request fits on, in a single call.
+
+    :param request: dictionary of amounts keyed on resource class
+    :return: dictionary of provider summaries keyed on provider uuid, empty if the
+        Placement API is too old for nested candidates
+    """
+    url = "/allocation_candidates?resources={}".format(
+        ",".join("{}:{}".format(rc, amount) for rc, amount in request.items() if amount)
+    )
+    try:
+        body = await run_blocking(_placement_get, url, cloud_name, CANDIDATES_MICROVERSION)
+    except openstack.exceptions.HttpException as err:
+        logging.warning("Cannot list allocation candidates, query every provider: %s", err)
+        return {}
+    return body["provider_summaries"]
+
+
+def _fits(free, capacity, vcpus, ram, disk, vnfspecs, hugepages_tracked):
+    """Return how many instances of the flavor fit in the free resources of a node.
+
+    Disk is only counted on nodes with local disk, the disk of the others comes from a
+    shared storage provider. The hugepages of vnfspecs instances are only counted if
+    Placement tracks them.
+    """
+    if not vcpus or not ram:
+        return 0
+    fits = min(free["PCPU" if vnfspecs else "VCPU"] // vcpus, free["MEMORY_MB"] // ram)
+    if disk and capacity["DISK_GB"]:
+        fits = min(fits, free["DISK_GB"] // disk)
+    if vnfspecs and hugepages_tracked:
+        fits = min(fits, free[HUGEPAGES] // math.ceil(ram / HUGEPAGE_SIZE_MB))
+    return max(fits, 0)
+
+
+async def async_capacity_report(vcpus, ram, disk, vnfspecs=False, cloud_name="cloud1"):
+    """Report the free resources of every compute node and how many test instances fit.
+
+    The resource providers are listed in one call, and the capacity and usage of all the
+    nodes the flavor fits on come from one allocation candidates call. Only the providers
+    without a candidate, e.g. full nodes, have their inventories and usages fetched one by
+    one, concurrently. Nested providers (e.g. NUMA nodes) are summed into their root
+    provider, the compute node; trees without compute resources are not reported.
+
+    :param vcpus: vcpus of the test flavor
+    :param ram: ram of the test flavor in MB
+    :param disk: disk of the test flavor in GB
+    :param vnfspecs: count pinned CPUs (PCPU) and 1G hugepages instead of shared VCPU
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary with the per-node resources and a summary
+    """
+    request = {"PCPU" if vnfspecs else "VCPU": vcpus, "MEMORY_MB": ram, "DISK_GB": disk}
+    providers, summaries = await asyncio.gather(
+        run_blocking(_placement_get, "/resource_providers", cloud_name),
+        _async_candidate_summaries(request, cloud_name),
+    )
+    providers = providers["resource_providers"]
+    missing = [rp for rp in providers if rp["uuid"] not in summaries]
+    provider_resources = dict(
+        zip(
+            [rp["uuid"] for rp in missing],
+            await asyncio.gather(*[_async_provider_resources(rp, cloud_name) for rp in missing]),
+        )
+    )
+    for uuid, summary in summaries.items():
+        provider_resources[uuid] = _summary_resources(summary)
+
+    # (capacity, used) per resource and root provider
+    columns = (*RESOURCE_CLASSES, HUGEPAGES)
+    trees = {}
+    for rp in providers:
+        tree = trees.setdefault(rp["root_provider_uuid"], {column: [0, 0] for column in columns})
+        for column, (cap, use) in provider_resources.get(rp["uuid"], {}).items():
+            tree[column][0] += cap
+            tree[column][1] += use
+    names = {
+        rp["uuid"]: rp["name"]
+        for rp in providers
+        if rp["uuid"] == rp["root_provider_uuid"]
+        and any(trees[rp["uuid"]][column][0] for column in COMPUTE_CLASSES)
+    }
+    hugepages_tracked = any(trees[uuid][HUGEPAGES][0] for uuid in names)
+
+    report = {}
+    for uuid, name in sorted(names.items(), key=lambda item: item[1]):
+        capacity = {column: cap for column, (cap, _) in trees[uuid].items()}
+        free = {column: cap - use for column, (cap, use) in trees[uuid].items()}
+        report[name] = {
+            **free,
+            "used-pct": {
+                column: round(use * 100 / cap, 1)
+                for column, (cap, use) in trees[uuid].items()
+                if cap
+            },
+            "fits": _fits(free, capacity, vcpus, ram, disk, vnfspecs, hugepages_tracked),
+        }
+    fits = {name: node["fits"] for name, node in report.items()}
+    summary = {
+        "nodes": len(report),
+        "free": {column: sum(node[column] for node in report.values()) for column in columns},
+        "flavor": {"vcpus": vcpus, "ram": ram, "disk": disk, "pinned": bool(vnfspecs)},
+        "nodes-fitting": sum(1 for n in fits.values() if n),
+        "instances-fitting": sum(fits.values()),
+        "full-nodes": [name for name, n in fits.items() if not n],
+    }
+    if vnfspecs:
+        summary["flavor"]["hugepages"] = math.ceil(ram / HUGEPAGE_SIZE_MB)
+        if not hugepages_tracked:
+            summary["warning"] = "Hugepages are not tracked in Placement, not counted"
+    return {"nodes": report, "summary": summary}
+
+
+def capacity_table(nodes):
+    """Render the per-node report as a compact text table."""
+    rows = [[header for header, _ in TABLE_COLUMNS]]
+    for name, resources in sorted(nodes.items()):
+        rows.append([name] + [str(resources[key]) for _, key in TABLE_COLUMNS if key is not None])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(TABLE_COLUMNS))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows
+    )
+
+
+def capacity_report(vcpus, ram, disk, vnfspecs=False, cloud_name="cloud1"):
+    """Report the free resources of every compute node, see async_capacity_report."""
+    return asyncio.run(async_capacity_report(vcpus, ram, disk, vnfspecs, cloud_name))
@@ -0,0 +1,231 @@
+"""This module contains the sweeper of leftover test resources.
+
+create_port creates the ports of a test instance before the instance, and nova keeps
+ports it did not create when the instance is deleted. Failed or interrupted boots and
+deleted test instances therefore leave ports on the test network, which make ensure_net
+fail to replace the network. The sweeper finds the test resources nothing uses any
+more, and deletes them concurrently, one dependency level at a time.
+"""
+
+import asyncio
+import logging
+import re
+import time
+
+from os_canary import CANARY_FLAVOR
+from os_testing import (
+    DEFAULT_FLAVOR,
+    PREWARM_FLAVOR,
+    TEST_AGGREGATE,
+    TEST_NETWORK,
+    TEST_SECGROUP,
+    async_wait_for_delete,
+    con,
+    resource_age,
+    run_blocking,
+)
+from warm_pool import POOL_FLAVOR, async_pool_servers
+
+# servers in these states do not run a test and are always swept
+ORPHAN_SERVER_STATUS = ("ERROR",)
+# seconds an unbound port is left alone, the instance of a boot in flight binds it later
+PORT_GRACE_PERIOD = 600
+
+
+async def _async_delete_all(kind, resources, delete, reclaimed, errors):
+    """Delete resources concurrently, recording what was deleted or failed.
+
+    :param kind: key of the resources in reclaimed
+    :param resources: dictionary of resources keyed on the id to report
+    :param delete: coroutine function deleting a resource
+    :param reclaimed: dictionary of lists of deleted resource ids keyed on kind
+    :param errors: dictionary of errors keyed on resource id
+    """
+    results = await asyncio.gather(
+        *[delete(resource) for resource in resources.values()], return_exceptions=True
+    )
+    for resource_id, result in zip(resources, results):
+        if isinstance(result, Exception):
+            logging.warning("Fault deleting %s %s: %s", kind, resource_id, result)
+            errors[resource_id] = str(result)
+        else:
+            reclaimed.setdefault(kind, []).append(resource_id)
+
+
+def _recent(port):
+    """Return whether a port was created within the grace period, unknown ages are not."""
+    age = resource_age(port)
+    return age is not None and age < PORT_GRACE_PERIOD
+
+
+async def _async_delete_server(server, cloud_name):
+    """Delete a server and wait until it is gone, releasing its ports."""
+    await run_blocking(con(cloud_name).compute.delete_server, server.id)
+    await async_wait_for_delete(con(cloud_name).compute.get_server, server.id, wait=300)
+
+
+async def _async_delete_aggregate(agg, cloud_name):
+    """Remove all hosts from an aggregate, then delete it."""
+    await asyncio.gather(
+        *[
+            run_blocking(con(cloud_name).compute.remove_host_from_aggregate, agg.id, host)
+            for host in agg.hosts or []
+        ]
+    )
+    await run_blocking(con(cloud_name).compute.delete_aggregate, agg.id)
+
+
+async def _async_find(find, names):
+    """Return the existing resources of the given names, keyed on name."""
+    found = await asyncio.gather(*[run_blocking(find, name) for name in names])
+    return {name: resource for name, resource in zip(names, found) if resource is not None}
+
+
+async def async_cleanup_test_artifacts(
+    pattern, all_servers=False, name_prefix=None, pool=False, cloud_name="cloud1"
+):
+    """Delete the test resources that are not used any more.
+
+    Test servers in ERROR state, or all test servers if all_servers is set, are deleted
+    first, then the ports on the test network not bound to any server. The ports created
+    within PORT_GRACE_PERIOD are kept, they may belong to a boot in flight. When no test
+    server is left, the test flavors, the test aggregate and its hosts, the test secgroup
+    and the test network are orphans too, and are deleted in that order. The warm pool
+    instances are only deleted with pool, otherwise they keep the shared test resources
+    in use.
+
+    :param pattern: name pattern of the test servers
+    :param all_servers: also delete the test servers that may still run a test
+    :param name_prefix: name prefix of the test instances, to find the warm pool
+    :param pool: also delete the warm pool instances, e.g. once the pool is disabled
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary of the reclaimed resources, errors and seconds per stage
+    """
+    started = time.monotonic()
+    compute = con(cloud_name).compute
+    network = con(cloud_name).network
+    reclaimed, errors, stages = {}, {}, {}
+    pat = re.compile(pattern)
+
+    def stage(name, since):
+        stages[name] = round(time.monotonic() - since, 3)
+        return time.monotonic()
+
+    servers = [
+        srv
+        for srv in await run_blocking(lambda: list(compute.servers(name=pattern)))
+        if pat.match(srv.name)
+    ]
+    pool_servers = []
+    if name_prefix:
+        pool_servers = [
+            srv
+            for servers in (await async_pool_servers(name_prefix, cloud_name)).values()
+            for srv in servers
+        ]
+    doomed = {srv.id: srv for srv in servers if all_servers or srv.status in ORPHAN_SERVER_STATUS}
+    if pool:
+        doomed.update({srv.id: srv for srv in pool_servers})
+    await _async_delete_all(
+        "servers",
+        doomed,
+        lambda srv: _async_delete_server(srv, cloud_name),
+        reclaimed,
+        errors,
+    )
+    remaining = [
+        srv.name for srv in servers + pool_servers if srv.id not in reclaimed.get("servers", [])
+    ]
+    since = stage("servers", started)
+
+    # ports of the test network, not bound to a server, and their dependants
+    net = await run_blocking(network.find_network, TEST_NETWORK)
+    ports = {}
+    if net is not None:
+        ports = {
+            port.id: port
+            for port in await run_blocking(
+                lambda: list(network.ports(network_id=net.id, name=TEST_NETWORK))
+            )
+            if not port.device_id and not _recent(port)
+        }
+    level = [
+        _async_delete_all(
+            "ports",
+            ports,
+            lambda port: run_blocking(network.delete_port, port.id),
+            reclaimed,
+            errors,
+        )
+    ]
+    if not remaining:
+        flavors = await _async_find(
+            compute.find_flavor,
+            [DEFAULT_FLAVOR["name"], PREWARM_FLAVOR, POOL_FLAVOR, CANARY_FLAVOR],
+        )
+        aggregates = await _async_find(compute.find_aggregate, [TEST_AGGREGATE])
+        level += [
+            _async_delete_all(
+                "flavors",
+                flavors,
+                lambda flavor: run_blocking(compute.delete_flavor, flavor.id),
+                reclaimed,
+                errors,
+            ),
+            _async_delete_all(
+                "aggregates",
+                aggregates,
+                lambda agg: _async_delete_aggregate(agg, cloud_name),
+                reclaimed,
+                errors,
+            ),
+        ]
+    await asyncio.gather(*level)
+    since = stage("ports-flavors-aggregates", since)
+
+    if not remaining:
+        secgroups = await _async_find(network.find_security_group, [TEST_SECGROUP])
+        await asyncio.gather(
+            _async_delete_all(
+                "security-groups",
+                secgroups,
+                lambda sg: run_blocking(network.delete_security_group, sg.id),
+                reclaimed,
+                errors,
+            ),
+            _async_delete_all(
+                "networks",
+                {TEST_NETWORK: net} if net is not None else {},
+                lambda test_net: run_blocking(network.delete_network, test_net.id),
+                reclaimed,
+                errors,
+            ),
+        )
+        stage("secgroups-networks", since)
+
+    results = {
+        "reclaimed": reclaimed,
+        "errors": errors,
+        "stages": stages,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    if remaining:
+        results["kept"] = "test servers left: {}".format(", ".join(sorted(remaining)))
+    return results
+
+
+def cleanup_test_artifacts(
+    pattern, all_servers=False, name_prefix=None, pool=False, cloud_name="cloud1"
+):
+    """Delete the test resources that are not used any more.
+
+    :param pattern: name pattern of the test servers
+    :param all_servers: also delete the test servers that may still run a test
+    :param name_prefix: name prefix of the test instances, to find the warm pool
+    :param pool: also delete the warm pool instances, e.g. once the pool is disabled
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary of the reclaimed resources, errors and seconds per stage
+    """
+    return asyncio.run(
+        async_cleanup_test_artifacts(pattern, all_servers, name_prefix, pool, cloud_name)
+    )
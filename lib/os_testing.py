@@ -1,10 +1,18 @@
 """This module contains methods to run OpenStack commands."""
 
+import asyncio
+import functools
+import hashlib
 import logging
 import os
 import re
+import shlex
+import statistics
+import time
 import warnings
-from datetime import datetime
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 from cryptography.utils import CryptographyDeprecationWarning
 
@@ -14,6 +22,8 @@ import fabric  # noqa: E402
 
 import openstack  # noqa: E402
 import openstack.exceptions  # noqa: E402
+import token_cache  # noqa: E402
+from api_control import AdaptiveLimiter  # noqa: E402
 
 _con = None
 
@@ -25,9 +35,8 @@ def con(cloud_name, reconnect=False):
         _con.close()
         _con = None
     if _con is None:
-        _con = openstack.connect(
-            cacert=os.environ.get("OS_CACERT", "/etc/openstack/ssl_ca.crt"),
-            cloud=cloud_name,
+        _con = token_cache.connect(
+            cloud_name, cacert=os.environ.get("OS_CACERT", "/etc/openstack/ssl_ca.crt")
         )
     return _con
 
@@ -53,8 +62,44 @@ TEST_CIDR = "192.168.99.0/24"
 TEST_AGGREGATE = "cloudsupport-test-agg"
 TEST_SECGROUP = "cloudsupport-test-secgroup"
 TEST_SSH_KEY = ".ssh/id_rsa_cloudsupport"
+PREWARM_FLAVOR = "cloudsupport-prewarm-flavor"
+NOVA_IMAGE_CACHE = "/var/lib/nova/instances/_base"
+NOVA_CONF = "/etc/nova/nova.conf"
 OVS_NET_NS = "qdhcp"
 OVN_NET_NS = "ovnmeta"
+PING_LOSS = re.compile(r"([\d.]+)% packet loss")
+PING_RTT = re.compile(r"rtt min/avg/max/mdev = [\d.]+/([\d.]+)/")
+# path MTU search range and the IPv4 + ICMP header size added to the ping payload
+MTU_MIN = 576
+MTU_MAX = 9000
+ICMP_OVERHEAD = 28
+# binary search of the largest don't-fragment ping payload, in one remote shell
+MTU_SEARCH_CMD = (
+    "ping_df() {{ ip netns exec {net_ns} ping -q -M do -c 2 -i 0.2 -W 1 -s $1 {addr} "
+    ">/dev/null 2>&1; }}; "
+    "lo={lo}; hi={hi}; ping_df $lo || {{ echo 0; exit 0; }}; "
+    "while [ $lo -lt $hi ]; do mid=$(( (lo + hi + 1) / 2 )); "
+    "if ping_df $mid; then lo=$mid; else hi=$(( mid - 1 )); fi; done; echo $lo"
+)
+# boot markers of the console log, in boot order; the kernel timestamp of the first
+# userspace line, then the uptime printed by each cloud-init stage
+USERSPACE_START = re.compile(
+    r"^\[\s*([\d.]+)\].*(?:Run /(?:s?bin/)?init as init process|systemd\[1\]: )", re.MULTILINE
+)
+CLOUD_INIT_STAGE = re.compile(r"Cloud-init v\. \S+ running '([\w:-]+)' at .*?Up ([\d.]+) seconds")
+CLOUD_INIT_FINISHED = re.compile(r"Cloud-init v\. \S+ finished at .*?Up ([\d.]+) seconds")
+# (phase, marker ending it); each phase starts at the marker ending the previous one
+BOOT_PHASES = (
+    ("kernel", "userspace"),
+    ("early-userspace", "init-local"),
+    ("dhcp-metadata", "init"),
+    ("init-modules", "modules:config"),
+    ("config-services", "modules:final"),
+    ("final-modules", "finished"),
+)
+CONSOLE_POLL_INTERVAL = 5
+# seconds between polls of a live-migrated server
+MIGRATION_POLL_INTERVAL = 5
 
 
 def ensure_net(netname, cidr, cloud_name="cloud1"):
@@ -113,22 +158,36 @@ def create_port(netname, physnet=None, cloud_name="cloud1"):
     net = con(cloud_name).network.find_network(netname)
     if not net:
         raise CloudSupportError("net not found: {}".format(netname))
-    if physnet is None:
-        port = con(cloud_name).network.create_port(
-            network_id=net.id,
-            name=netname,
-        )
-    else:
-        port = con(cloud_name).network.create_port(
-            network_id=net.id,
-            name=netname,
-            binding_profile={"physical_network": physnet},
-            binding_vnic_type="direct",
-        )
+    port = con(cloud_name).network.create_port(**port_spec(net, netname, physnet))
     logging.debug("Port created: %s", port)
     return port
 
 
+def port_spec(net, netname, physnet=None):
+    """Return the create_port parameters of a test port.
+
+    :param net: network to create port in
+    :param netname: name of the port
+    :param physnet: optionally make it a sr-iov port
+    :return: dictionary of create_port keyword arguments
+    """
+    spec = {"network_id": net.id, "name": netname}
+    if physnet is not None:
+        spec.update(
+            {"binding_profile": {"physical_network": physnet}, "binding_vnic_type": "direct"}
+        )
+    return spec
+
+
+def resource_age(resource):
+    """Return the seconds since a server or port was created, or None if unknown."""
+    try:
+        created = datetime.strptime(resource.created_at, "%Y-%m-%dT%H:%M:%SZ")
+    except (TypeError, ValueError):
+        return None
+    return int((datetime.now(timezone.utc) - created.replace(tzinfo=timezone.utc)).total_seconds())
+
+
 def ensure_flavor(name, vcpus, ram, disk, vnfspecs=True, cloud_name="cloud1"):
     """Re-create test flavor.
 
@@ -216,6 +275,835 @@ def ensure_sg_rules(secgroup, tcp_ports=None, cloud_name="cloud1"):
     return sg
 
 
+# Async API
+#
+# openstacksdk and fabric are blocking libraries, so the coroutines below hand every REST
+# or SSH call to a shared, bounded worker pool. A per-loop semaphore of the same size caps
+# the number of requests in flight; waiting for state transitions is done by polling from
+# the event loop, so a slow boot does not hold a worker while it sleeps. The semaphore is
+# an AIMD-controlled window that backs off when the API is overloaded, see api_control.
+#
+# Only single API calls go through the window. SSH commands, which can run for minutes
+# (a ping held for a whole migration, fio, iperf), and the ensure_* helpers, which chain
+# several calls and cannot be retried as a whole, run in a separate pool with run_worker.
+
+MAX_IN_FLIGHT = 32
+MAX_WORKERS = 64
+
+_executor = None
+_worker_executor = None
+_limiters = weakref.WeakKeyDictionary()
+
+
+def _get_executor():
+    """Return the worker pool shared by all async operations."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT, thread_name_prefix="os_testing")
+    return _executor
+
+
+def _get_worker_executor():
+    """Return the worker pool of the SSH commands and multi-call helpers."""
+    global _worker_executor
+    if _worker_executor is None:
+        _worker_executor = ThreadPoolExecutor(
+            max_workers=MAX_WORKERS, thread_name_prefix="os_testing_worker"
+        )
+    return _worker_executor
+
+
+def _get_limiter():
+    """Return the adaptive limiter bounding in-flight requests for the running loop."""
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = _limiters[loop] = AdaptiveLimiter(MAX_IN_FLIGHT)
+    return limiter
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a single blocking SDK call without blocking the event loop.
+
+    Requests rejected by an overloaded API (HTTP 429, or 503 with Retry-After) are retried
+    with backoff, so func must make one API request, or only read.
+
+    :param func: callable to run in the shared worker pool
+    :return: the result of func(*args, **kwargs)
+    """
+    return await _get_limiter().run(_get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def run_worker(func, *args, **kwargs):
+    """Run a blocking SSH command or multi-call helper without blocking the event loop.
+
+    Unlike run_blocking, the call holds no slot of the API window and is not retried.
+
+    :param func: callable to run in the worker pool
+    :return: the result of func(*args, **kwargs)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_worker_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+async def async_wait_for_status(
+    fetch, resource_id, status="ACTIVE", failures=("ERROR",), interval=2, wait=120
+):
+    """Poll a resource until it reaches the given status.
+
+    :param fetch: blocking callable returning the resource for resource_id
+    :param resource_id: id of the resource to poll
+    :param status: status to wait for
+    :param failures: statuses that mean the transition failed
+    :param interval: seconds between polls
+    :param wait: seconds before giving up
+    :return: the resource in its final status
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        resource = await run_blocking(fetch, resource_id)
+        current = (resource.status or "").upper()
+        if current == status.upper():
+            return resource
+        if current in failures:
+            raise openstack.exceptions.ResourceFailure(
+                "{} transitioned to failure state {}".format(resource_id, current)
+            )
+        if time.monotonic() >= deadline:
+            raise openstack.exceptions.ResourceTimeout(
+                "Timeout waiting for {} to transition to {}".format(resource_id, status)
+            )
+        await asyncio.sleep(interval)
+
+
+async def async_wait_for_delete(fetch, resource_id, interval=2, wait=120):
+    """Poll a resource until it is gone.
+
+    :param fetch: blocking callable returning the resource for resource_id
+    :param resource_id: id of the resource to poll
+    :param interval: seconds between polls
+    :param wait: seconds before giving up
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            await run_blocking(fetch, resource_id)
+        except openstack.exceptions.NotFoundException:
+            return
+        if time.monotonic() >= deadline:
+            raise openstack.exceptions.ResourceTimeout(
+                "Timeout waiting for {} to be deleted".format(resource_id)
+            )
+        await asyncio.sleep(interval)
+
+
+async def async_wait_for_migration(server_id, source, interval, wait, cloud_name):
+    """Wait until a live migration finished.
+
+    :param server_id: id of the migrated server
+    :param source: compute host the server is migrated from
+    :param interval: seconds between polls
+    :param wait: seconds before giving up
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: the server once it is ACTIVE with no task pending
+    :raises CloudSupportError: if the server errored or stayed on its source host
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        await asyncio.sleep(interval)
+        srv = await run_blocking(con(cloud_name).compute.get_server, server_id)
+        if srv.status == "ERROR":
+            raise CloudSupportError("server went to ERROR during migration")
+        if srv.status == "ACTIVE" and not srv.task_state:
+            if srv.compute_host == source:
+                raise CloudSupportError("migration did not move the server")
+            return srv
+        if time.monotonic() >= deadline:
+            raise CloudSupportError("timeout waiting for migration")
+
+
+async def _async_boot_instance(name, img, flavor, sg, network, physnet, key_name, cloud_name):
+    """Boot one test instance and wait for it to become active.
+
+    A failed boot is returned as an error result rather than raised, so that the other
+    boots of a bulk create complete and are reported.
+
+    :return: result list ["success"|"error", server id, detail, compute host, boot seconds]
+    """
+    start = time.monotonic()
+    server_id = None
+    try:
+        # gate each request of create_port on its own, rather than create_port as a whole
+        net = await run_blocking(con(cloud_name).network.find_network, network)
+        if not net:
+            raise CloudSupportError("net not found: {}".format(network))
+        ports = [
+            await run_blocking(con(cloud_name).network.create_port, **port_spec(net, network))
+        ]
+        if physnet:
+            ports.append(
+                await run_blocking(
+                    con(cloud_name).network.create_port, **port_spec(net, network, physnet)
+                )
+            )
+
+        optional_params = {}
+        if key_name:
+            optional_params["key_name"] = key_name
+
+        server = await run_blocking(
+            con(cloud_name).compute.create_server,
+            name=name,
+            image_id=img.id,
+            flavor_id=flavor.id,
+            networks=[{"port": p.id} for p in ports],
+            **optional_params,
+        )
+        server_id = server.id
+        logging.debug("Spawn instance: %s", server)
+        server = await async_wait_for_status(con(cloud_name).compute.get_server, server.id)
+        boot_time = round(time.monotonic() - start, 3)
+        await run_blocking(con(cloud_name).compute.add_security_group_to_server, server, sg)
+    except (CloudSupportError, openstack.exceptions.SDKException) as detail:
+        logging.warning("Fault spawning test instance: %s: %s", server_id, detail)
+        return ["error", server_id, str(detail), None, round(time.monotonic() - start, 3)]
+    return ["success", server.id, "ok", server.compute_host, boot_time]
+
+
+async def async_ensure_test_resources(
+    nodes, vcpus, ram, disk, image, cidr, network=TEST_NETWORK, vnfspecs=True, cloud_name="cloud1"
+):
+    """Set up the aggregate, network, flavor and secgroup used by test instances.
+
+    :param nodes: nodes to put into the test aggregate
+    :param vcpus: flavor vcpus
+    :param ram: flavor ram in MB
+    :param disk: flavor disk in GB
+    :param image: name of the image to boot, must already exist
+    :param cidr: test network cidr
+    :param network: name of the test network
+    :param vnfspecs: flag, use typical VNF specs if given
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: tuple (flavor, secgroup, image)
+    :raises CloudSupportError: if the network or image is not usable
+    """
+    await run_worker(ensure_host_aggregate, TEST_AGGREGATE, nodes, cloud_name=cloud_name)
+    ok, detail = await run_worker(ensure_net, network, cidr, cloud_name=cloud_name)
+    if not ok:
+        raise CloudSupportError(detail)
+    flavor = await run_worker(
+        ensure_flavor, DEFAULT_FLAVOR["name"], vcpus, ram, disk, vnfspecs, cloud_name=cloud_name
+    )
+    sg = await run_worker(ensure_sg_rules, TEST_SECGROUP, cloud_name=cloud_name)
+    img = await run_blocking(con(cloud_name).image.find_image, image)
+    if not img:
+        raise CloudSupportError("Image not found: {}".format(image))
+    return flavor, sg, img
+
+
+async def async_iter_create_instance(
+    nodes,
+    vcpus,
+    ram,
+    disk,
+    image,
+    name_prefix,
+    cidr,
+    network=TEST_NETWORK,
+    physnet=None,
+    num_instances=None,
+    vnfspecs=True,
+    key_name=None,
+    cloud_name="cloud1",
+):
+    """Create test instances concurrently, yielding each result as soon as it is known.
+
+    See create_instance for the parameters. The shared test resources are set up first,
+    then all instances are booted at once, bounded by MAX_IN_FLIGHT requests.
+
+    :return: async iterator of result lists
+    """
+    logging.debug("Creating instance on: %s", nodes)
+    try:
+        flavor, sg, img = await async_ensure_test_resources(
+            nodes, vcpus, ram, disk, image, cidr, network, vnfspecs, cloud_name=cloud_name
+        )
+    except CloudSupportError as detail:
+        yield ["error", None, str(detail)]
+        return
+    ts = datetime.utcnow()
+    name = "{}-{}".format(name_prefix, ts.strftime("%Y-%m-%dT%H%M"))
+    if num_instances is None:
+        num_instances = len(nodes)
+    boots = [
+        _async_boot_instance(name, img, flavor, sg, network, physnet, key_name, cloud_name)
+        for _ in range(num_instances)
+    ]
+    for boot in asyncio.as_completed(boots):
+        yield await boot
+
+
+async def async_create_instance(*args, **kwargs):
+    """Create test instances concurrently, see create_instance for the parameters.
+
+    :return: list of list with results
+    """
+    created = [result async for result in async_iter_create_instance(*args, **kwargs)]
+    logging.info("Done create: %s", created)
+    return created
+
+
+def _image_cached(node, image_id):
+    """Check whether nova on a compute node has an image in its local image cache.
+
+    Nodes with rbd ephemeral storage clone the image in Ceph and never populate the local
+    _base cache, so their cache state cannot be told from it.
+
+    :return: "hit", "miss" or "unknown" if the node could not be checked or uses rbd
+    """
+    cache_file = "{}/{}".format(NOVA_IMAGE_CACHE, hashlib.sha1(image_id.encode()).hexdigest())
+    check = (
+        "if grep -Eqs '^\\s*images_type\\s*=\\s*rbd' {conf}; then echo rbd; "
+        "elif test -e {cache}; then echo hit; else echo miss; fi"
+    ).format(conf=NOVA_CONF, cache=cache_file)
+    try:
+        res = node_connection(node).sudo("sh -c {}".format(shlex.quote(check)), hide=True)
+    except Exception as err:
+        logging.warning("Cannot check image cache on %s: %s", node, err)
+        return "unknown"
+    state = res.stdout.strip()
+    if state == "rbd":
+        logging.info("Image cache of %s is in rbd, not checked", node)
+        return "unknown"
+    return state
+
+
+async def _async_prewarm_node(node, name, img, flavor, net, cloud_name):
+    """Boot and delete a throwaway instance on a node so that it caches the image.
+
+    :return: dictionary with the image cache state before the boot and the boot time
+    """
+    services = await run_blocking(
+        lambda: list(con(cloud_name).compute.services(binary="nova-compute", host=node))
+    )
+    zone = services[0].availability_zone if services else "nova"
+    result = {"cache": await run_worker(_image_cached, node, img.id)}
+    start = time.monotonic()
+    server = await run_blocking(
+        con(cloud_name).compute.create_server,
+        name=name,
+        image_id=img.id,
+        flavor_id=flavor.id,
+        networks=[{"uuid": net.id}],
+        availability_zone="{}:{}".format(zone, node),
+    )
+    try:
+        await async_wait_for_status(con(cloud_name).compute.get_server, server.id, wait=600)
+        result["status"] = "success"
+    except openstack.exceptions.SDKException as detail:
+        logging.warning("Fault pre-warming %s: %s", node, detail)
+        result["status"] = "error"
+        result["detail"] = str(detail)
+    result["seconds"] = round(time.monotonic() - start, 3)
+    await run_blocking(con(cloud_name).compute.delete_server, server.id)
+    return result
+
+
+async def async_iter_prewarm_image(
+    nodes, image, disk, cidr, network=TEST_NETWORK, cloud_name="cloud1"
+):
+    """Make sure an image is in the image cache of every node, in parallel.
+
+    A tiny throwaway instance is booted on each node of the test aggregate, so that the
+    glance download and image conversion are not accounted to the test instances.
+
+    :param nodes: nodes to pre-warm, they are put into the test aggregate
+    :param image: name of the image to cache
+    :param disk: root disk size in GB of the throwaway instances
+    :param cidr: test network cidr
+    :param network: name of the test network
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: async iterator of (node, result) tuples in completion order, the result is a
+        dictionary of image cache hit/miss, boot time and status
+    """
+    await run_worker(ensure_host_aggregate, TEST_AGGREGATE, nodes, cloud_name=cloud_name)
+    ok, net = await run_worker(ensure_net, network, cidr, cloud_name=cloud_name)
+    if not ok:
+        raise CloudSupportError(net)
+    img = await run_blocking(con(cloud_name).image.find_image, image)
+    if not img:
+        raise CloudSupportError("Image not found: {}".format(image))
+    flavor = await run_worker(
+        ensure_flavor, PREWARM_FLAVOR, 1, 512, disk, vnfspecs=False, cloud_name=cloud_name
+    )
+    name = "cloudsupport-test-prewarm-{}".format(datetime.utcnow().strftime("%Y-%m-%dT%H%M"))
+
+    async def prewarm(node):
+        return node, await _async_prewarm_node(node, name, img, flavor, net, cloud_name)
+
+    for outcome in asyncio.as_completed([prewarm(node) for node in nodes]):
+        yield await outcome
+
+
+def parse_boot_markers(console):
+    """Extract the boot markers from a console log.
+
+    :param console: console log of an instance
+    :return: dictionary of seconds since kernel start keyed on marker
+    """
+    markers = {}
+    userspace = USERSPACE_START.search(console)
+    if userspace:
+        markers["userspace"] = float(userspace.group(1))
+    # a reboot restarts the clocks, only keep the first boot
+    for stage, uptime in CLOUD_INIT_STAGE.findall(console):
+        markers.setdefault(stage, float(uptime))
+    finished = CLOUD_INIT_FINISHED.search(console)
+    if finished:
+        markers["finished"] = float(finished.group(1))
+    return markers
+
+
+def boot_phases(markers):
+    """Return the duration of each boot phase whose start and end markers are known.
+
+    :param markers: boot markers, see parse_boot_markers
+    :return: dictionary of seconds keyed on phase, with the total up to cloud-init finished
+    """
+    phases = {}
+    start = 0.0
+    for phase, end in BOOT_PHASES:
+        if start is not None and end in markers:
+            phases[phase] = round(markers[end] - start, 3)
+        start = markers.get(end)
+    if "finished" in markers:
+        phases["total"] = markers["finished"]
+    return phases
+
+
+async def _async_console_markers(server_id, wait, cloud_name):
+    """Poll the console log of an instance until cloud-init finished, or wait expired.
+
+    :return: boot markers of the last console log
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        console = await run_blocking(con(cloud_name).compute.get_server_console_output, server_id)
+        markers = parse_boot_markers(console.get("output") or "")
+        if "finished" in markers or time.monotonic() >= deadline:
+            return markers
+        await asyncio.sleep(CONSOLE_POLL_INTERVAL)
+
+
+async def async_boot_phase_report(create_results, wait=300, cloud_name="cloud1"):
+    """Break down the boot of new test instances into phases, from their console logs.
+
+    The console logs of all instances are fetched in parallel, and polled until cloud-init
+    finished, since an instance is ACTIVE as soon as its guest starts booting. Slow
+    dhcp-metadata phases on some nodes point at their DHCP or metadata agents.
+
+    :param create_results: results of create_instance
+    :param wait: seconds to wait for cloud-init to finish
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary with the per-node median phase durations, and the instances whose
+        boot did not finish
+    """
+    booted = [result for result in create_results if result[0] == "success"]
+    markers = await asyncio.gather(
+        *[_async_console_markers(result[1], wait, cloud_name) for result in booted],
+        return_exceptions=True,
+    )
+    per_node = {}
+    incomplete = {}
+    for result, instance_markers in zip(booted, markers):
+        if isinstance(instance_markers, Exception):
+            incomplete[result[1]] = str(instance_markers)
+            continue
+        if "finished" not in instance_markers:
+            incomplete[result[1]] = "cloud-init not finished after {}s".format(wait)
+        per_node.setdefault(result[3], []).append(boot_phases(instance_markers))
+    nodes = {}
+    for node, instances in per_node.items():
+        nodes[node] = {"instances": len(instances)}
+        for phase in [phase for phase, _ in BOOT_PHASES] + ["total"]:
+            durations = [phases[phase] for phases in instances if phase in phases]
+            if durations:
+                nodes[node][phase] = round(statistics.median(durations), 3)
+    return {"nodes": nodes, "incomplete": incomplete}
+
+
+async def async_delete_instance(nodes, pattern, cloud_name="cloud1"):
+    """Delete instances matching pattern on given nodes concurrently.
+
+    :param nodes: list of node names
+    :param pattern: instance name pattern
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: list of deletion results
+    """
+    nodes = set(nodes)
+    pat = re.compile(pattern)
+    servers = await run_blocking(lambda: list(con(cloud_name).compute.servers()))
+    instances = [i.id for i in servers if i.compute_host in nodes and pat.match(i.name)]
+    await asyncio.gather(
+        *[run_blocking(con(cloud_name).compute.delete_server, i) for i in instances]
+    )
+    logging.info("Deleted: %s", instances)
+    return [["success", i] for i in instances]
+
+
+async def async_get_instances(instance=None, cloud_name="cloud1"):
+    """Get the list of instance ids from the cloud, see get_instances."""
+    if isinstance(instance, list):
+        return instance
+    if instance:
+        return [instance]
+    servers = await run_blocking(lambda: list(con(cloud_name).compute.servers()))
+    instances = [i.id for i in servers if i.name.startswith("cloudsupport-test-")]
+    if not instances:
+        logging.warning("No instances found")
+        return {"warning": "No instances found"}
+    return instances
+
+
+def netns_target(srv, net, cloud_name="cloud1"):
+    """Find the host and netns from which an instance on the test network is reachable.
+
+    :param srv: the server
+    :param net: the test network
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: tuple (host, netns name)
+    """
+    if is_ovn_used(srv.hypervisor_hostname, cloud_name=cloud_name):
+        return srv.hypervisor_hostname, "{}-{}".format(OVN_NET_NS, net.id)
+    # is OVS
+    dhcp_agent = next(con(cloud_name).network.network_hosting_dhcp_agents(net))
+    return dhcp_agent.host, "{}-{}".format(OVS_NET_NS, net.id)
+
+
+def node_connection(host):
+    """Return a ssh connection to a cloud node."""
+    return fabric.Connection(
+        host,
+        user="ubuntu",
+        connect_kwargs={
+            "key_filename": [TEST_SSH_KEY],
+        },
+    )
+
+
+def guest_connection(srv, net, cloud_name="cloud1"):
+    """Return a ssh connection to a test instance, proxied through its netns.
+
+    The instance must accept the charm's ssh key, e.g. by booting it with a keypair holding
+    the matching public key.
+
+    :param srv: the server
+    :param net: the test network
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: fabric connection to the instance
+    """
+    host, net_ns = netns_target(srv, net, cloud_name=cloud_name)
+    proxy = (
+        "ssh -i {} -o StrictHostKeyChecking=no ubuntu@{} sudo ip netns exec {} nc %h %p".format(
+            TEST_SSH_KEY, host, net_ns
+        )
+    )
+    return fabric.Connection(
+        srv.addresses[TEST_NETWORK][0]["addr"],
+        user="ubuntu",
+        gateway=proxy,
+        connect_kwargs={
+            "key_filename": [TEST_SSH_KEY],
+        },
+    )
+
+
+def _probe_mtu(node, net_ns, addr):
+    """Binary-search the path MTU to an address with don't-fragment pings.
+
+    :param node: connection to the node hosting the netns
+    :param net_ns: netns to ping from
+    :param addr: address to probe
+    :return: the path MTU, or None if even MTU_MIN does not get through
+    """
+    cmd = MTU_SEARCH_CMD.format(
+        net_ns=net_ns, addr=addr, lo=MTU_MIN - ICMP_OVERHEAD, hi=MTU_MAX - ICMP_OVERHEAD
+    )
+    res = node.sudo("bash -c {}".format(shlex.quote(cmd)), warn=True, hide=True)
+    try:
+        payload = int(res.stdout.strip())
+    except ValueError:
+        logging.warning("MTU probe of %s failed: %s", addr, res.stderr)
+        return None
+    return payload + ICMP_OVERHEAD if payload else None
+
+
+def _probe_instance(srv, net, cloud_name="cloud1", mtu=False):
+    """Ping and connect to tcp:22 of an instance from its netns.
+
+    :param mtu: also search the path MTU to the instance
+    :return: dictionary with the ping and ssh results, and the path and network MTU
+    """
+    host, net_ns = netns_target(srv, net, cloud_name=cloud_name)
+    node = node_connection(host)
+    logging.debug("Testing conn from: %s", host)
+
+    addr = srv.addresses[TEST_NETWORK][0]["addr"]
+    logging.debug("Pinging: %s", addr)
+
+    ping_res = node.sudo(
+        "sudo ip netns exec {} ping -c3 -q {}".format(net_ns, addr),
+        warn=True,
+        hide=True,
+    )
+    logging.debug("Ping res: %s", ping_res)
+    ssh_res = node.sudo(
+        "sudo ip netns exec {} nc -vzw 3 {} 22".format(net_ns, addr),
+        warn=True,
+        hide=True,
+    )
+    logging.debug("Nc tcp:22 res: %s", ssh_res)
+    result = {
+        "host": srv.compute_host,
+        "ping": "{}\n{}".format(ping_res.stdout, ping_res.stderr),
+        "ssh": "{}\n{}".format(ssh_res.stdout, ssh_res.stderr),
+    }
+    if mtu:
+        result["path-mtu"] = _probe_mtu(node, net_ns, addr)
+        result["net-mtu"] = net.mtu
+    return result
+
+
+def parse_ping(output):
+    """Extract packet loss and average rtt from a ping summary.
+
+    :param output: ping output
+    :return: tuple (loss in percent, average rtt in ms or None)
+    """
+    loss = PING_LOSS.search(output)
+    rtt = PING_RTT.search(output)
+    return (
+        float(loss.group(1)) if loss else 100.0,
+        float(rtt.group(1)) if rtt else None,
+    )
+
+
+async def async_probe_servers(servers, cloud_name="cloud1", return_exceptions=False):
+    """Test connectivity to the given servers concurrently.
+
+    :param servers: list of servers
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :param return_exceptions: return the error of a failed probe instead of raising it
+    :return: list of probe results, in the order of servers
+    """
+    net = await run_blocking(con(cloud_name).network.find_network, TEST_NETWORK)
+    return await asyncio.gather(
+        *[run_worker(_probe_instance, srv, net, cloud_name=cloud_name) for srv in servers],
+        return_exceptions=return_exceptions,
+    )
+
+
+async def async_iter_test_connectivity(instance=None, cloud_name="cloud1", mtu=False):
+    """Test connectivity to instance(s) concurrently, see test_connectivity.
+
+    :return: async iterator of (instance id, test results) tuples, in completion order
+    """
+    instances = await async_get_instances(instance=instance, cloud_name=cloud_name)
+    if isinstance(instances, dict):
+        for item in instances.items():
+            yield item
+        return
+    net = await run_blocking(con(cloud_name).network.find_network, TEST_NETWORK)
+
+    async def probe(i):
+        srv = await run_blocking(con(cloud_name).compute.get_server, i)
+        return i, await run_worker(_probe_instance, srv, net, cloud_name=cloud_name, mtu=mtu)
+
+    for result in asyncio.as_completed([probe(i) for i in instances]):
+        yield await result
+
+
+async def async_test_connectivity(instance=None, cloud_name="cloud1", mtu=False):
+    """Test connectivity to instance(s) concurrently, see test_connectivity."""
+    return {
+        i: result
+        async for i, result in async_iter_test_connectivity(
+            instance, cloud_name=cloud_name, mtu=mtu
+        )
+    }
+
+
+async def _async_iter_server_action(action, servers, cloud_name):
+    """Run a server action (e.g. stop_server) on all servers concurrently.
+
+    :return: async iterator of (server id, succeeded) tuples, in completion order
+    """
+    func = getattr(con(cloud_name).compute, action)
+
+    async def run(vm):
+        try:
+            logging.debug("%s: %s(%s)", action, vm.name, vm.id)
+            await run_blocking(func, vm.id)
+        except openstack.exceptions.SDKException as error:
+            logging.warning("%s failed for VM %s with error: %s", action, vm.id, error)
+            return vm.id, False
+        return vm.id, True
+
+    for outcome in asyncio.as_completed([run(vm) for vm in servers]):
+        yield await outcome
+
+
+async def _async_server_action(action, servers, cloud_name):
+    """Run a server action (e.g. stop_server) on all servers concurrently.
+
+    :return: tuple (ids of servers that succeeded, ids of servers that failed)
+    """
+    outcomes = {
+        vm_id: ok async for vm_id, ok in _async_iter_server_action(action, servers, cloud_name)
+    }
+    done = [vm.id for vm in servers if outcomes[vm.id]]
+    failed = [vm.id for vm in servers if not outcomes[vm.id]]
+    return done, failed
+
+
+async def async_stop_servers(servers, cloud_name="cloud1"):
+    """Stop servers concurrently.
+
+    :param servers: list of servers to stop
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: tuple (stopped server ids, failed server ids)
+    """
+    return await _async_server_action("stop_server", list(servers), cloud_name)
+
+
+async def async_start_servers(servers, cloud_name="cloud1"):
+    """Start servers concurrently.
+
+    :param servers: list of servers to start
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: tuple (started server ids, failed server ids)
+    """
+    return await _async_server_action("start_server", list(servers), cloud_name)
+
+
+def async_iter_stop_servers(servers, cloud_name="cloud1"):
+    """Stop servers concurrently.
+
+    :return: async iterator of (server id, stopped) tuples, in completion order
+    """
+    return _async_iter_server_action("stop_server", list(servers), cloud_name)
+
+
+def async_iter_start_servers(servers, cloud_name="cloud1"):
+    """Start servers concurrently.
+
+    :return: async iterator of (server id, started) tuples, in completion order
+    """
+    return _async_iter_server_action("start_server", list(servers), cloud_name)
+
+
+async def _async_live_migrate(vm, source, destinations, retries, wait, cloud_name):
+    """Live-migrate a server off its host, retrying failures on other hosts.
+
+    The first attempt lets the scheduler pick the destination; each retry asks for the
+    next destination that has not failed yet, still checked by the scheduler.
+
+    :return: dictionary with the destination, duration and attempts, or the error
+    """
+    start = time.monotonic()
+    failed_hosts = set()
+    errors = []
+    for attempt in range(retries + 1):
+        candidates = [host for host in destinations if host not in failed_hosts]
+        destination = None
+        if attempt:
+            if not candidates:
+                break
+            destination = candidates[0]
+        try:
+            await run_blocking(
+                con(cloud_name).compute.live_migrate_server,
+                vm.id,
+                host=destination,
+                block_migration="auto",
+            )
+            srv = await async_wait_for_migration(
+                vm.id, source, MIGRATION_POLL_INTERVAL, wait, cloud_name
+            )
+        except (CloudSupportError, openstack.exceptions.SDKException) as error:
+            logging.warning("Live migration of %s to %s failed: %s", vm.id, destination, error)
+            errors.append("{}: {}".format(destination or "scheduler", error))
+            if destination:
+                failed_hosts.add(destination)
+            continue
+        return {
+            "destination": srv.compute_host,
+            "duration": round(time.monotonic() - start, 3),
+            "attempts": attempt + 1,
+            "errors": errors,
+        }
+    return {"error": errors[-1] if errors else "no destination", "errors": errors}
+
+
+async def async_iter_evacuate_servers(
+    servers, source, destinations, max_concurrent=4, retries=2, wait=900, cloud_name="cloud1"
+):
+    """Live-migrate servers off a compute host, a bounded number at a time.
+
+    :param servers: list of servers to migrate
+    :param source: compute host to evacuate
+    :param destinations: hosts to retry failed migrations on, in order of preference
+    :param max_concurrent: number of migrations run at the same time
+    :param retries: number of retries of a failed migration
+    :param wait: seconds to wait for a migration
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: async iterator of (server id, result) tuples, in completion order
+    """
+    limiter = asyncio.Semaphore(max_concurrent)
+
+    async def migrate(index, vm):
+        # spread the retries of concurrent migrations over the destinations
+        shift = index % len(destinations) if destinations else 0
+        async with limiter:
+            return vm.id, await _async_live_migrate(
+                vm,
+                source,
+                destinations[shift:] + destinations[:shift],
+                retries,
+                wait,
+                cloud_name,
+            )
+
+    for outcome in asyncio.as_completed([migrate(i, vm) for i, vm in enumerate(servers)]):
+        yield await outcome
+
+
+# Sync API, thin wrappers around the async API
+
+
+def iterate(async_iterator):
+    """Iterate over an async iterator from sync code.
+
+    The event loop runs while the next item is awaited, so operations started by the
+    iterator make progress while earlier items are being consumed.
+
+    :param async_iterator: the async iterator
+    :return: iterator of the same items
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_iterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
 def create_instance(
     nodes,
     vcpus,
@@ -249,51 +1137,72 @@ def create_instance(
     :param cloud_name: string cloud name to select auth info in clouds.yaml
     :return: list of list with results
     """
-    logging.debug("Creating instance on: %s", nodes)
-    ensure_host_aggregate(TEST_AGGREGATE, nodes, cloud_name=cloud_name)
-    ok, detail = ensure_net(network, cidr, cloud_name=cloud_name)
-    if not ok:
-        return [["error", None, detail]]
-    flavor = ensure_flavor(
-        DEFAULT_FLAVOR["name"], vcpus, ram, disk, vnfspecs, cloud_name=cloud_name
+    return asyncio.run(
+        async_create_instance(
+            nodes,
+            vcpus,
+            ram,
+            disk,
+            image,
+            name_prefix,
+            cidr,
+            network=network,
+            physnet=physnet,
+            num_instances=num_instances,
+            vnfspecs=vnfspecs,
+            key_name=key_name,
+            cloud_name=cloud_name,
+        )
     )
-    sg = ensure_sg_rules(TEST_SECGROUP, cloud_name=cloud_name)
-    img = con(cloud_name).image.find_image(image)
-    if not img:
-        return ["error", "Image not found", image]
-    ts = datetime.utcnow()
-    name = "{}-{}".format(name_prefix, ts.strftime("%Y-%m-%dT%H%M"))
-    if num_instances is None:
-        num_instances = len(nodes)
-    created = []
-    for _ in range(num_instances):
-        ports = [create_port(network, cloud_name=cloud_name)]
-        if physnet:
-            ports.append(create_port(network, physnet, cloud_name=cloud_name))
 
-        optional_params = {}
-        if key_name:
-            optional_params["key_name"] = key_name
 
-        server = con(cloud_name).compute.create_server(
-            name=name,
-            image_id=img.id,
-            flavor_id=flavor.id,
-            networks=[{"port": p.id} for p in ports],
-            wait=True,
-            **optional_params
-        )
-        logging.debug("Spawn instance: %s", server)
-        try:
-            con(cloud_name).compute.wait_for_server(server)
-        except openstack.exceptions.ResourceFailure as detail:
-            logging.warning("Fault spawning test instance: %s: %s", server, detail)
-            created.append(["error", server.id, detail])
-        else:
-            con(cloud_name).compute.add_security_group_to_server(server, sg)
-            created.append(["success", server.id, "ok"])
-    logging.info("Done create: %s", created)
-    return created
+def iter_create_instance(*args, **kwargs):
+    """Create test instances, yielding each result as it completes.
+
+    See create_instance for the parameters.
+
+    :return: iterator of result lists
+    """
+    return iterate(async_iter_create_instance(*args, **kwargs))
+
+
+def iter_prewarm_image(*args, **kwargs):
+    """Make sure an image is in the image cache of every node, yielding each node as it is done.
+
+    See async_iter_prewarm_image for the parameters.
+
+    :return: iterator of (node, result) tuples
+    """
+    return iterate(async_iter_prewarm_image(*args, **kwargs))
+
+
+def prewarm_image(*args, **kwargs):
+    """Make sure an image is in the image cache of every node.
+
+    See async_iter_prewarm_image for the parameters.
+
+    :return: dictionary of image cache hit/miss, boot time and status keyed on node
+    """
+    return dict(iter_prewarm_image(*args, **kwargs))
+
+
+def boot_phase_report(create_results, wait=300, cloud_name="cloud1"):
+    """Break down the boot of new test instances into phases, see async_boot_phase_report.
+
+    :param create_results: results of create_instance
+    :param wait: seconds to wait for cloud-init to finish
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary with the per-node median phase durations and incomplete boots
+    """
+    return asyncio.run(async_boot_phase_report(create_results, wait, cloud_name))
+
+
+def iter_evacuate_servers(*args, **kwargs):
+    """Live-migrate servers off a compute host, see async_iter_evacuate_servers.
+
+    :return: iterator of (server id, result) tuples, in completion order
+    """
+    return iterate(async_iter_evacuate_servers(*args, **kwargs))
 
 
 def delete_instance(nodes, pattern, cloud_name="cloud1"):
@@ -304,40 +1213,17 @@ def delete_instance(nodes, pattern, cloud_name="cloud1"):
     :param cloud_name: string cloud name to select auth info in clouds.yaml
     :return: list of deletion results
     """
-    nodes = set(nodes)
-    pat = re.compile(pattern)
-    instances = [
-        i.id
-        for i in con(cloud_name).compute.servers()
-        if i.compute_host in nodes and pat.match(i.name)
-    ]
-    results = []
-    for i in instances:
-        con(cloud_name).compute.delete_server(i)
-        results.append(["success", i])
-    logging.info("Deleted: %s", instances)
-    return results
+    return asyncio.run(async_delete_instance(nodes, pattern, cloud_name=cloud_name))
 
 
 def get_instances(instance=None, cloud_name="cloud1"):
     """Get the list of instance ids from the cloud.
 
-    :param instance: get particular instance if specified
+    :param instance: get particular instance, or list of instances, if specified
     :param cloud_name: the cloud name to get the instances from
     :return: list of instances
     """
-    if not instance:
-        instances = [
-            i.id
-            for i in con(cloud_name).compute.servers()
-            if i.name.startswith("cloudsupport-test-")
-        ]
-        if not instances:
-            logging.warning("No instances found")
-            return {"warning": "No instances found"}
-    else:
-        instances = [instance]
-    return instances
+    return asyncio.run(async_get_instances(instance=instance, cloud_name=cloud_name))
 
 
 def is_ovn_used(hypervisor_hostname, cloud_name="cloud1"):
@@ -358,65 +1244,82 @@ def is_ovn_used(hypervisor_hostname, cloud_name="cloud1"):
     return False
 
 
-def test_connectivity(instance=None, cloud_name="cloud1"):
+def test_connectivity(instance=None, cloud_name="cloud1", mtu=False):
     """Test connectivity to instance(s).
 
     The test will ping and connect to tcp:22 and tcp:80 from the qdhcp netns towards the
     non-sriov ports
 
-    :param instance: instance id. If missing, all instances whose names start with
+    :param instance: instance id, or list of instance ids. If missing, all instances whose
+    names start with "cloudsupport-test-" will be tested
     :param cloud_name: string cloud name to select auth info in clouds.yaml
-    "cloudsupport-test-" will be tested
+    :param mtu: also binary-search the path MTU with don't-fragment pings
 
     :return: dictionary with test results, keyed on instances' UUIDs
     """
-    instances = get_instances(instance=instance, cloud_name=cloud_name)
+    return asyncio.run(async_test_connectivity(instance=instance, cloud_name=cloud_name, mtu=mtu))
 
-    results = {}
-    for i in instances:
-        srv = con(cloud_name).compute.get_server(i)
-        hypervisor_hostname = srv.hypervisor_hostname
-        net = con(cloud_name).network.find_network(TEST_NETWORK)
-        is_ovn = is_ovn_used(hypervisor_hostname, cloud_name=cloud_name)
-
-        if is_ovn:
-            host = hypervisor_hostname
-            net_ns = OVN_NET_NS
-        else:
-            # is OVS
-            dhcp_agent = next(con(cloud_name).network.network_hosting_dhcp_agents(net))
-            host = dhcp_agent.host
-            net_ns = OVS_NET_NS
-
-        node = fabric.Connection(
-            host,
-            user="ubuntu",
-            connect_kwargs={
-                "key_filename": [TEST_SSH_KEY],
-            },
-        )
-        logging.debug("Testing conn from: %s", host)
 
-        addr = srv.addresses[TEST_NETWORK][0]["addr"]
-        logging.debug("Pinging: %s", addr)
+def iter_test_connectivity(instance=None, cloud_name="cloud1", mtu=False):
+    """Test connectivity to instance(s), yielding each result as it completes.
 
-        ping_res = node.sudo(
-            "sudo ip netns exec {}-{} ping -c3 -q {}".format(net_ns, net.id, addr),
-            warn=True,
-            hide=True,
-        )
-        logging.debug("Ping res: %s", ping_res)
-        ssh_res = node.sudo(
-            "sudo ip netns exec {}-{} nc -vzw 3 {} 22".format(net_ns, net.id, addr),
-            warn=True,
-            hide=True,
+    See test_connectivity for the parameters.
+
+    :return: iterator of (instance id, test results) tuples
+    """
+    return iterate(async_iter_test_connectivity(instance=instance, cloud_name=cloud_name, mtu=mtu))
+
+
+def mtu_summary(test_results):
+    """Aggregate the path MTU of test_connectivity(mtu=True) results per compute node.
+
+    :param test_results: test results keyed on instance id
+    :return: dictionary of the per-instance and minimum path MTU, the network MTU and a
+    mismatch flag, keyed on compute node
+    """
+    summary = {}
+    for i, result in test_results.items():
+        if not isinstance(result, dict) or "path-mtu" not in result:
+            continue
+        host = summary.setdefault(result["host"], {"net-mtu": result["net-mtu"], "instances": {}})
+        host["instances"][i] = result["path-mtu"]
+    for host in summary.values():
+        mtus = list(host["instances"].values())
+        host["path-mtu"] = None if None in mtus else min(mtus)
+        host["mismatch"] = host["path-mtu"] is None or (
+            host["net-mtu"] is not None and host["path-mtu"] < host["net-mtu"]
         )
-        logging.debug("Nc tcp:22 res: %s", ssh_res)
-        results[i] = {
-            "ping": "{}\n{}".format(ping_res.stdout, ping_res.stderr),
-            "ssh": "{}\n{}".format(ssh_res.stdout, ssh_res.stderr),
-        }
-    return results
+    return summary
+
+
+def stop_servers(servers, cloud_name="cloud1"):
+    """Stop servers.
+
+    :param servers: list of servers to stop
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: tuple (stopped server ids, failed server ids)
+    """
+    return asyncio.run(async_stop_servers(servers, cloud_name=cloud_name))
+
+
+def start_servers(servers, cloud_name="cloud1"):
+    """Start servers.
+
+    :param servers: list of servers to start
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: tuple (started server ids, failed server ids)
+    """
+    return asyncio.run(async_start_servers(servers, cloud_name=cloud_name))
+
+
+def iter_stop_servers(servers, cloud_name="cloud1"):
+    """Stop servers, yielding (server id, stopped) tuples as they complete."""
+    return iterate(async_iter_stop_servers(servers, cloud_name=cloud_name))
+
+
+def iter_start_servers(servers, cloud_name="cloud1"):
+    """Start servers, yielding (server id, started) tuples as they complete."""
+    return iterate(async_iter_start_servers(servers, cloud_name=cloud_name))
 
 
 def get_ssh_cmd(instance=None, cloud_name="cloud1"):
@@ -432,27 +1335,15 @@ def get_ssh_cmd(instance=None, cloud_name="cloud1"):
     connection_string = (
         "ssh ubuntu@{vm_ip} "
         '-o ProxyCommand="juju ssh {host} '
-        'sudo ip netns exec {net_ns}-{net_id} nc %h %p"'
+        'sudo ip netns exec {net_ns} nc %h %p"'
     )
     results = {}
+    net = con(cloud_name).network.find_network(TEST_NETWORK)
     for i in instances:
         srv = con(cloud_name).compute.get_server(i)
-        hypervisor_hostname = srv.hypervisor_hostname
-        net = con(cloud_name).network.find_network(TEST_NETWORK)
         addr = srv.addresses[TEST_NETWORK][0]["addr"]
-
-        is_ovn = is_ovn_used(hypervisor_hostname, cloud_name=cloud_name)
-
-        if is_ovn:
-            host = hypervisor_hostname
-            net_ns = OVN_NET_NS
-        else:
-            host = next(con(cloud_name).network.network_hosting_dhcp_agents(net)).host
-            net_ns = OVS_NET_NS
-
-        results[i] = "\n" + connection_string.format(
-            vm_ip=addr, host=host, net_ns=net_ns, net_id=net.id
-        )
+        host, net_ns = netns_target(srv, net, cloud_name=cloud_name)
+        results[i] = "\n" + connection_string.format(vm_ip=addr, host=host, net_ns=net_ns)
 
     return results
 
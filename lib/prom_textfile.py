@@ -0,0 +1,118 @@
+"""This module contains the Prometheus node_exporter textfile export of the action results.
+
+Every run of an action rewrites its own file in the textfile collector directory, so only
+the latest results of each action are exposed. The test instance ids change on every run,
+so the number of series per file is capped to MAX_SERIES; the dropped series are counted in
+cloudsupport_dropped_series.
+"""
+
+import logging
+import os
+import pathlib
+
+# metric of the samples: (metric name, help, scale to the base unit)
+METRICS = {
+    "boot-time": ("cloudsupport_boot_seconds", "Boot time of a test instance.", 1.0),
+    "rtt": ("cloudsupport_ping_rtt_seconds", "Average ping RTT to a test instance.", 0.001),
+    "loss": ("cloudsupport_ping_loss_ratio", "Ping packet loss to a test instance.", 0.01),
+}
+ACTION_METRICS = (
+    ("cloudsupport_action_last_run_timestamp_seconds", "Start of the last run of an action."),
+    ("cloudsupport_action_duration_seconds", "Duration of the last run of an action."),
+    ("cloudsupport_action_success", "Whether the last run of an action succeeded."),
+)
+DROPPED_METRIC = "cloudsupport_dropped_series"
+# maximum number of sample series per file
+MAX_SERIES = 500
+
+
+def escape_label(value):
+    """Escape a label value of the text exposition format."""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _series(name, labels, value):
+    """Return a line of the text exposition format, leaving out empty labels."""
+    label_text = ",".join(
+        '{}="{}"'.format(key, escape_label(label)) for key, label in labels if label
+    )
+    return "{}{{{}}} {}".format(name, label_text, repr(float(value)))
+
+
+def _family(name, help_text, lines):
+    """Return the HELP and TYPE comments followed by the series of a gauge."""
+    return ["# HELP {} {}".format(name, help_text), "# TYPE {} gauge".format(name)] + lines
+
+
+def render_run(action, started, duration, outcome, points, host=None, max_series=MAX_SERIES):
+    """Render an action run in the text exposition format.
+
+    :param action: name of the action, the test label
+    :param started: unix timestamp of the start of the run
+    :param duration: duration of the run in seconds
+    :param outcome: outcome of the run, e.g. "success" or "error"
+    :param points: iterable of (host, instance, metric, value) samples of the run
+    :param host: host the action ran against, e.g. the compute node of stop-vms
+    :param max_series: maximum number of sample series
+    :return: text of the metrics file
+    """
+    action_labels = (("test", action), ("host", host))
+    lines = []
+    for (name, help_text), value in zip(
+        ACTION_METRICS, (started, duration, 1 if outcome == "success" else 0)
+    ):
+        lines += _family(name, help_text, [_series(name, action_labels, value)])
+
+    known = sorted(
+        (metric, host, instance, value)
+        for host, instance, metric, value in points
+        if metric in METRICS and value is not None
+    )
+    dropped = max(0, len(known) - max_series)
+    if dropped:
+        logging.warning("dropping %d of %d %s series", dropped, len(known), action)
+    families = {}
+    for metric, host, instance, value in known[:max_series]:
+        name, _, scale = METRICS[metric]
+        labels = (("test", action), ("host", host), ("instance", instance))
+        families.setdefault(metric, []).append(_series(name, labels, value * scale))
+    for metric, series in families.items():
+        name, help_text, _ = METRICS[metric]
+        lines += _family(name, help_text, series)
+    lines += _family(
+        DROPPED_METRIC,
+        "Sample series left out of the last run of an action.",
+        [_series(DROPPED_METRIC, action_labels[:1], dropped)],
+    )
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(directory, action, text):
+    """Atomically replace the metrics file of an action.
+
+    The file is written next to its final path and renamed, so that node_exporter never
+    reads a partial file; the .prom suffix is only given by the rename.
+
+    :param directory: textfile collector directory
+    :param action: name of the action
+    :param text: text of the metrics file
+    :return: path of the metrics file
+    """
+    path = pathlib.Path(directory) / "cloudsupport-{}.prom".format(action)
+    tmp = path.with_name(".{}.tmp".format(path.name))
+    with open(str(tmp), "w") as fp:
+        fp.write(text)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.chmod(str(tmp), 0o644)
+    os.replace(str(tmp), str(path))
+    return path
+
+
+def export_run(directory, action, started, duration, outcome, points, host=None):
+    """Write the metrics of an action run, see render_run for the parameters.
+
+    :return: path of the metrics file
+    """
+    text = render_run(action, started, duration, outcome, points, host)
+    return write_textfile(directory, action, text)
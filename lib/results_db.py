@@ -0,0 +1,324 @@
+"""This module contains the local SQLite store of test results."""
+
+import json
+import pathlib
+import sqlite3
+import statistics
+import time
+
+DB_PATH = pathlib.Path("/var/lib/cloudsupport/results.db")
+
+# raw sweep samples older than this are folded into hourly rows
+RAW_RETENTION = 48 * 3600
+HOUR = 3600
+
+
+def connect(path=DB_PATH):
+    """Open the results database, creating it if needed.
+
+    :param path: path of the database file
+    :return: sqlite3 connection
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(str(path), timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    return db
+
+
+class ConnectivityStore:
+    """Time series of connectivity sweep results.
+
+    Each sweep stores one row per host, clustered on (host, ts) so that per-host range
+    queries only touch the rows they return. Rows older than RAW_RETENTION are downsampled
+    to one row per host and hour.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS hosts (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS sweep_samples (
+            host_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            loss REAL,
+            rtt REAL,
+            PRIMARY KEY (host_id, ts)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS sweep_hourly (
+            host_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            loss REAL,
+            max_loss REAL,
+            rtt REAL,
+            samples INTEGER NOT NULL,
+            PRIMARY KEY (host_id, ts)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db):
+        """Construct the store on an open database."""
+        self.db = db
+        self.db.executescript(self.SCHEMA)
+
+    def _host_id(self, name):
+        """Return the id of a host, registering it if needed."""
+        self.db.execute("INSERT OR IGNORE INTO hosts (name) VALUES (?)", (name,))
+        return self.db.execute("SELECT id FROM hosts WHERE name = ?", (name,)).fetchone()[0]
+
+    def add_samples(self, samples, ts=None):
+        """Store the results of one sweep.
+
+        :param samples: dictionary of (loss in percent, rtt in ms) keyed on host
+        :param ts: unix timestamp of the sweep, defaults to now
+        """
+        ts = int(ts if ts is not None else time.time())
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO sweep_samples VALUES (?, ?, ?, ?)",
+                [(self._host_id(host), ts, loss, rtt) for host, (loss, rtt) in samples.items()],
+            )
+
+    def downsample(self, retention_days, now=None):
+        """Fold old raw samples into hourly rows and drop expired rows.
+
+        :param retention_days: days hourly rows are kept
+        :param now: unix timestamp, defaults to now
+        """
+        now = int(now if now is not None else time.time())
+        # only fold complete hours, so that an hour is never folded twice
+        cutoff = (now - RAW_RETENTION) // HOUR * HOUR
+        with self.db:
+            self.db.execute(
+                """
+                INSERT OR REPLACE INTO sweep_hourly
+                SELECT host_id, ts / ? * ?, AVG(loss), MAX(loss), AVG(rtt), COUNT(*)
+                FROM sweep_samples WHERE ts < ?
+                GROUP BY host_id, ts / ?
+                """,
+                (HOUR, HOUR, cutoff, HOUR),
+            )
+            self.db.execute("DELETE FROM sweep_samples WHERE ts < ?", (cutoff,))
+            self.db.execute(
+                "DELETE FROM sweep_hourly WHERE ts < ?", (now - retention_days * 86400,)
+            )
+
+    def query(self, hours, host=None, now=None):
+        """Summarize the samples of the last hours.
+
+        :param hours: size of the window in hours
+        :param host: only return this host if given
+        :param now: unix timestamp, defaults to now
+        :return: dictionary of samples, avg/max loss and avg rtt keyed on host
+        """
+        since = int(now if now is not None else time.time()) - int(hours * HOUR)
+        where = "WHERE s.ts >= ?"
+        params = [since]
+        if host:
+            where += " AND h.name = ?"
+            params.append(host)
+        rows = self.db.execute(
+            """
+            SELECT
+                h.name,
+                SUM(n),
+                SUM(loss * n) / SUM(n),
+                MAX(max_loss),
+                SUM(rtt * n) / SUM(CASE WHEN rtt IS NOT NULL THEN n END)
+            FROM (
+                SELECT host_id, ts, loss, loss AS max_loss, rtt, 1 AS n FROM sweep_samples
+                UNION ALL
+                SELECT host_id, ts, loss, max_loss, rtt, samples AS n FROM sweep_hourly
+            ) s JOIN hosts h ON h.id = s.host_id
+            {}
+            GROUP BY h.name
+            """.format(where),
+            params,
+        )
+        return {
+            name: {
+                "samples": samples,
+                "avg-loss": round(avg_loss, 2),
+                "max-loss": round(max_loss, 2),
+                "avg-rtt": round(avg_rtt, 3) if avg_rtt is not None else None,
+            }
+            for name, samples, avg_loss, max_loss, avg_rtt in rows
+        }
+
+
+class RunHistory:
+    """History of action runs with per-host metrics.
+
+    Every run keeps its outcome and duration; per-host metrics such as boot time or RTT
+    are stored as the median over the instances of that host. Samples are clustered on
+    (metric, host, run) so that trends and rolling baselines are range scans.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY,
+            action TEXT NOT NULL,
+            started INTEGER NOT NULL,
+            duration REAL NOT NULL,
+            outcome TEXT NOT NULL,
+            params TEXT
+        );
+        CREATE INDEX IF NOT EXISTS runs_action_started ON runs (action, started);
+        CREATE TABLE IF NOT EXISTS run_samples (
+            metric TEXT NOT NULL,
+            host TEXT NOT NULL,
+            run_id INTEGER NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (metric, host, run_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS run_samples_run ON run_samples (run_id, metric);
+    """
+
+    def __init__(self, db):
+        """Construct the history on an open database."""
+        self.db = db
+        self.db.executescript(self.SCHEMA)
+
+    def record(self, action, started, duration, outcome, params=None, samples=()):
+        """Store a run.
+
+        :param action: name of the action
+        :param started: unix timestamp of the start of the run
+        :param duration: duration of the run in seconds
+        :param outcome: outcome of the run, e.g. "success" or "error"
+        :param params: optional dictionary of action parameters
+        :param samples: iterable of (host, metric, value) tuples
+        :return: id of the run
+        """
+        per_host = {}
+        for host, metric, value in samples:
+            per_host.setdefault((metric, host), []).append(value)
+        with self.db:
+            run_id = self.db.execute(
+                "INSERT INTO runs (action, started, duration, outcome, params) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (action, int(started), duration, outcome, json.dumps(params or {})),
+            ).lastrowid
+            self.db.executemany(
+                "INSERT INTO run_samples VALUES (?, ?, ?, ?)",
+                [
+                    (metric, host, run_id, statistics.median(values))
+                    for (metric, host), values in per_host.items()
+                ],
+            )
+        return run_id
+
+    def runs(self, limit=20, action=None):
+        """Return the latest runs, newest first."""
+        query = "SELECT id, action, started, duration, outcome FROM runs"
+        params = []
+        if action:
+            query += " WHERE action = ?"
+            params.append(action)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        return [
+            {
+                "id": run_id,
+                "action": run_action,
+                "started": started,
+                "duration": round(duration, 3),
+                "outcome": outcome,
+            }
+            for run_id, run_action, started, duration, outcome in self.db.execute(query, params)
+        ]
+
+    def latest_run(self, metric):
+        """Return the id of the latest run having samples of metric, or None."""
+        row = self.db.execute(
+            "SELECT MAX(run_id) FROM run_samples WHERE metric = ?", (metric,)
+        ).fetchone()
+        return row[0]
+
+    def run_metrics(self, run_id, metric):
+        """Return the values of metric in a run, keyed on host."""
+        return dict(
+            self.db.execute(
+                "SELECT host, value FROM run_samples WHERE run_id = ? AND metric = ?",
+                (run_id, metric),
+            )
+        )
+
+    def rolling_median(self, metric, hosts, before_run, window=5):
+        """Return the median of metric over the last window runs before a run, per host."""
+        medians = {}
+        for host in hosts:
+            values = [
+                value
+                for (value,) in self.db.execute(
+                    "SELECT value FROM run_samples WHERE metric = ? AND host = ? AND run_id < ? "
+                    "ORDER BY run_id DESC LIMIT ?",
+                    (metric, host, before_run, window),
+                )
+            ]
+            if values:
+                medians[host] = statistics.median(values)
+        return medians
+
+    def trend(self, metric, host, limit=20):
+        """Return the latest values of metric on a host, oldest first."""
+        rows = self.db.execute(
+            "SELECT s.run_id, r.started, s.value FROM run_samples s JOIN runs r ON r.id = s.run_id "
+            "WHERE s.metric = ? AND s.host = ? ORDER BY s.run_id DESC LIMIT ?",
+            (metric, host, limit),
+        ).fetchall()
+        return [
+            {"run": run_id, "started": started, "value": value}
+            for run_id, started, value in rows[::-1]
+        ]
+
+    def compare(self, metric, run_id=None, baseline=None, window=5, threshold=20.0):
+        """Compare the per-host metric of a run against a baseline run or rolling median.
+
+        :param metric: name of the metric, higher values are worse
+        :param run_id: run to check, defaults to the latest run with the metric
+        :param baseline: baseline run, defaults to the median of the window previous runs
+        :param window: number of previous runs of the rolling median
+        :param threshold: regression threshold in percent, any increase is a regression on a
+            zero baseline
+        :return: dictionary with the compared runs, per-host comparison and regressed hosts
+        """
+        run_id = run_id or self.latest_run(metric)
+        if run_id is None:
+            return {"hosts": {}, "regressed": []}
+        current = self.run_metrics(run_id, metric)
+        if baseline:
+            reference = self.run_metrics(baseline, metric)
+        else:
+            reference = self.rolling_median(metric, current, run_id, window)
+        hosts = {}
+        for host, value in sorted(current.items()):
+            base = reference.get(host)
+            if base is None:
+                hosts[host] = {"value": round(value, 3), "baseline": None}
+                continue
+            if base == 0:
+                # no relative change from a zero baseline, any increase is a regression
+                delta = value - base
+                hosts[host] = {
+                    "value": round(value, 3),
+                    "baseline": 0,
+                    "change": round(delta, 3),
+                    "change-pct": None,
+                    "regressed": delta > 0,
+                }
+                continue
+            change = (value - base) / base * 100
+            hosts[host] = {
+                "value": round(value, 3),
+                "baseline": round(base, 3),
+                "change-pct": round(change, 1),
+                "regressed": change > threshold,
+            }
+        return {
+            "run": run_id,
+            "baseline": baseline or "median of {} previous runs".format(window),
+            "hosts": hosts,
+            "regressed": [host for host, cmp in hosts.items() if cmp.get("regressed")],
+        }
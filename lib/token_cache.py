@@ -0,0 +1,117 @@
+"""This module contains the on-disk Keystone token cache shared by the charm entry points.
+
+Every action process and every run of the nagios plugin would otherwise do a full Keystone
+authentication. The token and service catalog of a cloud are stored in CACHE_DIR and
+reused until EXPIRY_MARGIN seconds before they expire. The cache files are keyed on a
+digest of clouds.yaml, so that changing the clouds-yaml option never reuses a token of
+the old credentials; the charm also drops all cache files when it rewrites clouds.yaml.
+
+This module is copied next to the nagios plugin, so it only depends on openstacksdk.
+"""
+
+import grp
+import hashlib
+import logging
+import os
+import pathlib
+
+import openstack
+
+CLOUDS_YAML = pathlib.Path("/etc/openstack/clouds.yaml")
+CACHE_DIR = pathlib.Path("/etc/openstack/token-cache")
+# group allowed to read the cache, i.e. the user running the nagios plugin
+CACHE_GROUP = "nagios"
+# seconds before expiry a cached token is no longer used
+EXPIRY_MARGIN = 300
+
+
+def cache_path(cloud_name, clouds_yaml=CLOUDS_YAML, cache_dir=CACHE_DIR):
+    """Return the cache file of a cloud for the current clouds.yaml.
+
+    :param cloud_name: string cloud name in clouds.yaml
+    :param clouds_yaml: path of clouds.yaml
+    :param cache_dir: cache directory
+    :return: path of the cache file
+    """
+    digest = hashlib.sha256(pathlib.Path(clouds_yaml).read_bytes())
+    digest.update(cloud_name.encode())
+    return pathlib.Path(cache_dir) / "{}-{}.json".format(cloud_name, digest.hexdigest()[:16])
+
+
+def restore(auth, path):
+    """Install the cached auth state into an identity plugin.
+
+    :param auth: keystoneauth identity plugin
+    :param path: cache file
+    :return: True if a valid cached token was installed
+    """
+    try:
+        auth.set_auth_state(pathlib.Path(path).read_text())
+    except (OSError, ValueError, KeyError) as error:
+        logging.debug("no usable token cache %s: %s", path, error)
+        return False
+    if auth.auth_ref is None or auth.auth_ref.will_expire_soon(EXPIRY_MARGIN):
+        auth.set_auth_state(None)
+        return False
+    return True
+
+
+def save(auth, path):
+    """Atomically write the auth state of an identity plugin to the cache.
+
+    The file is only readable by root and CACHE_GROUP. Failing to write the cache, e.g.
+    from the unprivileged nagios plugin, is not an error.
+
+    :param auth: keystoneauth identity plugin
+    :param path: cache file
+    """
+    state = auth.get_auth_state()
+    if not state:
+        return
+    path = pathlib.Path(path)
+    tmp = path.with_name(".{}.tmp".format(path.name))
+    try:
+        try:
+            gid = grp.getgrnam(CACHE_GROUP).gr_gid
+        except KeyError:
+            gid = -1
+        path.parent.mkdir(mode=0o750, exist_ok=True)
+        os.chown(str(path.parent), -1, gid)
+        fd = os.open(str(tmp), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o640 if gid >= 0 else 0o600)
+        with os.fdopen(fd, "w") as fp:
+            fp.write(state)
+        os.chown(str(tmp), -1, gid)
+        os.replace(str(tmp), str(path))
+    except OSError as error:
+        logging.debug("failed to write token cache %s: %s", path, error)
+
+
+def invalidate(cache_dir=CACHE_DIR):
+    """Drop all cached tokens."""
+    for path in pathlib.Path(cache_dir).glob("*.json"):
+        path.unlink()
+
+
+def connect(cloud_name, clouds_yaml=CLOUDS_YAML, cache_dir=CACHE_DIR, **kwargs):
+    """Return an OpenStack connection reusing the cached token of a cloud.
+
+    The connection authenticates right away, unless a cached token is still valid.
+
+    :param cloud_name: string cloud name in clouds.yaml, also the cache key
+    :param clouds_yaml: path of clouds.yaml
+    :param cache_dir: cache directory
+    :param kwargs: arguments of openstack.connect, cloud defaults to cloud_name
+    :return: openstack connection
+    """
+    kwargs.setdefault("cloud", cloud_name)
+    conn = openstack.connect(**kwargs)
+    try:
+        path = cache_path(cloud_name, clouds_yaml, cache_dir)
+    except OSError as error:
+        logging.debug("token cache disabled: %s", error)
+        return conn
+    auth = conn.session.auth
+    if not restore(auth, path):
+        auth.get_access(conn.session)
+        save(auth, path)
+    return conn
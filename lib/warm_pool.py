@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""Warm pool of pre-booted test instances, one per compute node of an aggregate.
+
+Run by the cloudsupport-warm-pool systemd timer, see CloudSupportHelper.render_warm_pool_timer.
+Every run replaces the pool instances that are missing, failed or on the wrong node, so
+that test-connectivity pool=true can test all nodes without booting anything.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import time
+
+import openstack.exceptions
+from os_testing import (
+    TEST_NETWORK,
+    TEST_SECGROUP,
+    CloudSupportError,
+    async_wait_for_status,
+    con,
+    ensure_flavor,
+    ensure_net,
+    ensure_sg_rules,
+    resource_age,
+    run_blocking,
+    run_worker,
+)
+
+WARM_POOL_SERVICE = "cloudsupport-warm-pool"
+POOL_FLAVOR = "cloudsupport-pool-flavor"
+STATUS_FILE = pathlib.Path("/var/lib/cloudsupport/warm_pool.json")
+# pool instances in these states are left alone
+PENDING_STATUS = ("BUILD",)
+
+
+def pool_prefix(name_prefix):
+    """Return the name prefix of the pool instances.
+
+    It does not start with the name prefix of the test instances, so that the pool
+    instances are not picked up by test-connectivity, the benchmarks, the stale server
+    check, delete-test-instances or cleanup-test-artifacts.
+    """
+    return "pool-{}-".format(name_prefix)
+
+
+async def async_pool_servers(name_prefix, cloud_name="cloud1"):
+    """Return the pool instances grouped on the node they were booted for.
+
+    :param name_prefix: name prefix of the test instances
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary of lists of servers keyed on node
+    """
+    prefix = pool_prefix(name_prefix)
+    servers = await run_blocking(lambda: list(con(cloud_name).compute.servers()))
+    pool = {}
+    for srv in servers:
+        if srv.name.startswith(prefix):
+            pool.setdefault(srv.name.replace(prefix, "", 1), []).append(srv)
+    return pool
+
+
+async def _async_boot_pool_instance(node, name, img, flavor, net, key_name, cloud_name):
+    """Boot the pool instance of a node and wait for it to become active.
+
+    :return: the active server
+    """
+    services = await run_blocking(
+        lambda: list(con(cloud_name).compute.services(binary="nova-compute", host=node))
+    )
+    zone = services[0].availability_zone if services else "nova"
+    optional_params = {}
+    if key_name:
+        optional_params["key_name"] = key_name
+    server = await run_blocking(
+        con(cloud_name).compute.create_server,
+        name=name,
+        image_id=img.id,
+        flavor_id=flavor.id,
+        networks=[{"uuid": net.id}],
+        security_groups=[{"name": TEST_SECGROUP}],
+        availability_zone="{}:{}".format(zone, node),
+        **optional_params,
+    )
+    return await async_wait_for_status(con(cloud_name).compute.get_server, server.id, wait=600)
+
+
+async def async_replenish(
+    aggregate, image, disk, cidr, name_prefix, max_age=None, key_name=None, cloud_name="cloud1"
+):
+    """Make sure every node of an aggregate has one healthy pool instance.
+
+    Pool instances that failed, stopped, are older than max_age, or belong to a node that
+    left the aggregate are deleted, and the missing ones are booted, all concurrently.
+    Recycling old instances makes the pool pick up a new image of the same name.
+
+    :param aggregate: name of the aggregate whose nodes get a pool instance
+    :param image: name of the image to boot
+    :param disk: root disk size in GB of the pool instances
+    :param cidr: test network cidr
+    :param name_prefix: name prefix of the test instances
+    :param max_age: seconds after which a pool instance is replaced, None to keep it
+    :param key_name: optional keypair of the pool instances
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary with the per-node outcome and the deleted instances
+    """
+    agg = await run_blocking(con(cloud_name).compute.find_aggregate, aggregate)
+    if agg is None:
+        raise CloudSupportError("Aggregate not found: {}".format(aggregate))
+    ok, net = await run_worker(ensure_net, TEST_NETWORK, cidr, cloud_name=cloud_name)
+    if not ok:
+        raise CloudSupportError(net)
+    await run_worker(ensure_sg_rules, TEST_SECGROUP, cloud_name=cloud_name)
+    img = await run_blocking(con(cloud_name).image.find_image, image)
+    if not img:
+        raise CloudSupportError("Image not found: {}".format(image))
+    # ensure_flavor replaces the flavor, only create it when missing
+    flavor = await run_blocking(con(cloud_name).compute.find_flavor, POOL_FLAVOR)
+    if flavor is None:
+        flavor = await run_worker(
+            ensure_flavor, POOL_FLAVOR, 1, 512, disk, vnfspecs=False, cloud_name=cloud_name
+        )
+
+    pool = await async_pool_servers(name_prefix, cloud_name)
+    hosts = agg.hosts or []
+    nodes = {}
+    stale = [srv for node, servers in pool.items() if node not in hosts for srv in servers]
+    boots = {}
+    for node in hosts:
+        servers = sorted(pool.get(node, []), key=lambda srv: srv.status != "ACTIVE")
+        keep = next(
+            (
+                srv
+                for srv in servers
+                if srv.status in PENDING_STATUS
+                or (
+                    srv.status == "ACTIVE"
+                    and srv.compute_host == node
+                    and (max_age is None or (resource_age(srv) or 0) < max_age)
+                )
+            ),
+            None,
+        )
+        stale += [srv for srv in servers if srv is not keep]
+        if keep is not None:
+            nodes[node] = {"instance": keep.id, "action": "kept", "status": keep.status}
+        else:
+            boots[node] = _async_boot_pool_instance(
+                node, pool_prefix(name_prefix) + node, img, flavor, net, key_name, cloud_name
+            )
+
+    deletes = [run_blocking(con(cloud_name).compute.delete_server, srv.id) for srv in stale]
+    results = await asyncio.gather(*boots.values(), *deletes, return_exceptions=True)
+    booted = len(boots)
+    for result in results:
+        if isinstance(result, Exception) and not isinstance(
+            result, openstack.exceptions.SDKException
+        ):
+            raise result
+    for node, result in zip(boots, results):
+        if isinstance(result, Exception):
+            logging.warning("Fault booting the pool instance of %s: %s", node, result)
+            nodes[node] = {"action": "error", "error": str(result)}
+        else:
+            nodes[node] = {"instance": result.id, "action": "booted", "status": result.status}
+    deleted = []
+    for srv, result in zip(stale, results[booted:]):
+        if isinstance(result, Exception):
+            logging.warning("Fault deleting pool instance %s: %s", srv.id, result)
+        else:
+            deleted.append(srv.id)
+    return {"nodes": nodes, "deleted": deleted}
+
+
+def replenish(
+    aggregate, image, disk, cidr, name_prefix, max_age=None, key_name=None, cloud_name="cloud1"
+):
+    """Replenish the pool and store the outcome in STATUS_FILE, see async_replenish.
+
+    :return: dictionary with the per-node outcome and the deleted instances
+    """
+    status = asyncio.run(
+        async_replenish(aggregate, image, disk, cidr, name_prefix, max_age, key_name, cloud_name)
+    )
+    status.update({"aggregate": aggregate, "updated": int(time.time())})
+    tmp = STATUS_FILE.with_name(".{}.tmp".format(STATUS_FILE.name))
+    STATUS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp.write_text(json.dumps(status, indent=2, sort_keys=True))
+    os.replace(str(tmp), str(STATUS_FILE))
+    return status
+
+
+async def async_pool_status(name_prefix, cloud_name="cloud1"):
+    """Return the health and age of the pool instances, see pool_status."""
+    pool = await async_pool_servers(name_prefix, cloud_name)
+    nodes = {}
+    for node, servers in pool.items():
+        for srv in servers:
+            healthy = srv.status == "ACTIVE" and srv.compute_host == node
+            if node not in nodes or healthy:
+                nodes[node] = {
+                    "instance": srv.id,
+                    "status": srv.status,
+                    "healthy": healthy,
+                    "age-seconds": resource_age(srv),
+                }
+    status = {
+        "nodes": nodes,
+        "healthy": sum(1 for node in nodes.values() if node["healthy"]),
+    }
+    try:
+        last = json.loads(STATUS_FILE.read_text())
+    except (OSError, ValueError):
+        return status
+    status["last-replenish"] = {
+        "updated": last.get("updated"),
+        "errors": {
+            node: result["error"]
+            for node, result in last.get("nodes", {}).items()
+            if result.get("action") == "error"
+        },
+    }
+    missing = sorted(set(last.get("nodes", {})) - set(nodes))
+    if missing:
+        status["missing"] = missing
+    return status
+
+
+def pool_status(name_prefix, cloud_name="cloud1"):
+    """Return the health and age of the pool instances.
+
+    :param name_prefix: name prefix of the test instances
+    :param cloud_name: string cloud name to select auth info in clouds.yaml
+    :return: dictionary with the pool instance, status, health and age per node, and the
+        outcome of the last replenishment
+    """
+    return asyncio.run(async_pool_status(name_prefix, cloud_name))
+
+
+def parse_args():
+    """Parse the command line arguments."""
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--cloud-name", dest="cloud_name", type=str, default="cloud1")
+    ap.add_argument("--aggregate", dest="aggregate", type=str, required=True)
+    ap.add_argument("--image", dest="image", type=str, default="cloudsupport-image")
+    ap.add_argument("--disk", dest="disk", type=int, default=4)
+    ap.add_argument("--cidr", dest="cidr", type=str, default="192.168.99.0/24")
+    ap.add_argument("--name-prefix", dest="name_prefix", type=str, default="cloudsupport-test")
+    ap.add_argument("--max-age-hours", dest="max_age_hours", type=int, default=24)
+    ap.add_argument("--key-name", dest="key_name", type=str, default=None)
+    return ap.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    replenish(
+        args.aggregate,
+        args.image,
+        args.disk,
+        args.cidr,
+        args.name_prefix,
+        max_age=args.max_age_hours * 3600 if args.max_age_hours else None,
+        key_name=args.key_name,
+        cloud_name=args.cloud_name,
+    )
@@ -4,20 +4,82 @@
 # See LICENSE file for licensing details.
 """Operator charm main library."""
 
+import json
 import logging
+import re
+import statistics
+import time
 
-from lib_cloudsupport import CloudSupportHelper
+from action_profiler import profiled
+from api_control import STATS as API_STATS
+from lib_cloudsupport import (
+    CloudSupportHelper,
+    boot_time_points,
+    canary_points,
+    connectivity_points,
+)
 from ops.charm import CharmBase
 from ops.framework import StoredState
 from ops.main import main
 from ops.model import ActiveStatus
+from os_benchmarks import (
+    east_west_matrix,
+    live_migration_benchmark,
+    scheduler_load_test,
+    sriov_benchmark,
+    storage_benchmark,
+    vnf_validation,
+    volume_latency_probe,
+)
+from os_canary import canary_summary, iter_rolling_canary
+from os_capacity import capacity_report, capacity_table
+from os_cleanup import cleanup_test_artifacts
 from os_testing import (
     CloudSupportError,
-    create_instance,
+    boot_phase_report,
     delete_instance,
     get_ssh_cmd,
-    test_connectivity,
+    iter_create_instance,
+    iter_prewarm_image,
+    iter_test_connectivity,
+    mtu_summary,
 )
+from warm_pool import pool_status
+
+# minimum seconds between two checkpoints of partial action results
+CHECKPOINT_INTERVAL = 10
+
+
+class ActionProgress:
+    """Stream per-item progress of an action and checkpoint its partial results.
+
+    Every item is logged to the action as it completes; the partial results are stored
+    with set_results at most every CHECKPOINT_INTERVAL seconds, so that they survive an
+    action timeout. The API throughput and throttling of the action are reported with the
+    final results.
+    """
+
+    def __init__(self, event):
+        """Construct the progress reporter of an action event."""
+        self.event = event
+        self.count = 0
+        self.last_checkpoint = time.monotonic()
+        API_STATS.reset()
+
+    def update(self, message, partial_results):
+        """Report a completed item."""
+        self.count += 1
+        self.event.log("[{}] {}".format(self.count, message))
+        if time.monotonic() - self.last_checkpoint >= CHECKPOINT_INTERVAL:
+            self.event.set_results(partial_results)
+            self.last_checkpoint = time.monotonic()
+
+    def finish(self, results):
+        """Set the final results, adding the API stats if any API call was made."""
+        stats = API_STATS.snapshot()
+        if stats["calls"] or stats["throttled"]:
+            results["api-stats"] = json.dumps(stats, indent=2)
+        self.event.set_results(results)
 
 
 class CloudSupportCharm(CharmBase):
@@ -34,9 +96,27 @@ class CloudSupportCharm(CharmBase):
         self.framework.observe(self.on.create_test_instances_action, self.on_create_test_instances)
         self.framework.observe(self.on.delete_test_instances_action, self.on_delete_test_instances)
         self.framework.observe(self.on.test_connectivity_action, self.on_test_connectivity)
+        self.framework.observe(self.on.rolling_canary_action, self.on_rolling_canary)
         self.framework.observe(self.on.get_ssh_cmd_action, self.on_get_ssh_cmd)
         self.framework.observe(self.on.stop_vms_action, self.on_stop_vms)
         self.framework.observe(self.on.start_vms_action, self.on_start_vms)
+        self.framework.observe(self.on.evacuate_node_action, self.on_evacuate_node)
+        self.framework.observe(self.on.scheduler_load_test_action, self.on_scheduler_load_test)
+        self.framework.observe(self.on.storage_benchmark_action, self.on_storage_benchmark)
+        self.framework.observe(self.on.volume_latency_probe_action, self.on_volume_latency_probe)
+        self.framework.observe(
+            self.on.live_migration_benchmark_action, self.on_live_migration_benchmark
+        )
+        self.framework.observe(self.on.vnf_validation_action, self.on_vnf_validation)
+        self.framework.observe(self.on.sriov_benchmark_action, self.on_sriov_benchmark)
+        self.framework.observe(self.on.east_west_matrix_action, self.on_east_west_matrix)
+        self.framework.observe(self.on.capacity_report_action, self.on_capacity_report)
+        self.framework.observe(
+            self.on.cleanup_test_artifacts_action, self.on_cleanup_test_artifacts
+        )
+        self.framework.observe(self.on.connectivity_history_action, self.on_connectivity_history)
+        self.framework.observe(self.on.compare_runs_action, self.on_compare_runs)
+        self.framework.observe(self.on.run_history_action, self.on_run_history)
         self.framework.observe(
             self.on.nrpe_external_master_relation_joined,
             self.on_nrpe_external_master_relation_joined,
@@ -67,6 +147,7 @@ class CloudSupportCharm(CharmBase):
         self.helper.update_config()
         self.unit.status = ActiveStatus("Unit is ready")
 
+    @profiled
     def on_create_test_instances(self, event):
         """Run create-test-instance action."""
         cfg = self.model.config
@@ -77,8 +158,24 @@ class CloudSupportCharm(CharmBase):
         disk = event.params.get("disk", cfg["disk"])
         vnfspecs = event.params.get("vnfspecs")
         key_name = event.params.get("key-name", cfg.get("key-name"))
+        started = time.time()
+        progress = ActionProgress(event)
+        create_results = []
+        prewarm_results = {}
+        boot_phases = {}
         try:
-            create_results = create_instance(
+            if event.params.get("prewarm"):
+                for node, result in iter_prewarm_image(
+                    nodes, cfg["image"], disk, cfg["cidr"], cloud_name=self.helper.cloud_name
+                ):
+                    prewarm_results[node] = result
+                    progress.update(
+                        "pre-warmed {}: cache {} in {}s".format(
+                            node, result["cache"], result["seconds"]
+                        ),
+                        {"prewarm": json.dumps(prewarm_results)},
+                    )
+            for result in iter_create_instance(
                 nodes,
                 vcpus,
                 ram,
@@ -90,40 +187,152 @@ class CloudSupportCharm(CharmBase):
                 vnfspecs=vnfspecs,
                 key_name=key_name,
                 cloud_name=self.helper.cloud_name,
-            )
+            ):
+                create_results.append(result)
+                progress.update(
+                    " ".join(str(field) for field in result),
+                    {"create-details": create_results},
+                )
+            if event.params.get("boot-phases"):
+                event.log("waiting for the test instances to finish booting")
+                boot_phases = boot_phase_report(
+                    create_results,
+                    wait=event.params.get("boot-wait", 300),
+                    cloud_name=self.helper.cloud_name,
+                )
         except BaseException as err:
-            event.set_results({"error": err})
+            self.helper.record_run("create-test-instances", started, "error", event.params)
+            event.set_results({"error": str(err)})
             raise
         errs = any([a for a in create_results if a[0] == "error"])
-        event.set_results(
-            {
-                "create-results": "success" if not errs else "error",
-                "create-details": create_results,
-            }
+        self.helper.record_run(
+            "create-test-instances",
+            started,
+            "success" if not errs else "error",
+            event.params,
+            points=boot_time_points(create_results),
         )
+        results = {
+            "create-results": "success" if not errs else "error",
+            "create-details": create_results,
+        }
+        if prewarm_results:
+            # keyed on node names, which may contain dots
+            results["prewarm"] = json.dumps(prewarm_results, indent=2, sort_keys=True)
+        if boot_phases:
+            results["boot-phases"] = json.dumps(boot_phases, indent=2, sort_keys=True)
+        progress.finish(results)
 
+    @profiled
     def on_delete_test_instances(self, event):
         """Run delete-test-instance action."""
         nodes = event.params["nodes"].split(",")
         pattern = event.params["pattern"]
+        started = time.time()
         delete_results = delete_instance(nodes, pattern, cloud_name=self.helper.cloud_name)
+        self.helper.record_run("delete-test-instances", started, "success", event.params)
         event.set_results({"delete-results": delete_results})
 
+    @profiled
     def on_test_connectivity(self, event):
         """Run test-connectivity action."""
+        started = time.time()
+        progress = ActionProgress(event)
+        test_results = {}
         try:
             # workaround for old juju
             # on 2.7.x params is None when nothing is passed.
             if not event.params:
-                instance = None
+                instance, mtu = None, False
             else:
-                instance = event.params.get("instance")
-            test_results = test_connectivity(instance, cloud_name=self.helper.cloud_name)
+                instance, mtu = event.params.get("instance"), event.params.get("mtu", False)
+            if event.params and event.params.get("pool"):
+                pool = pool_status(self.model.config["name-prefix"], self.helper.cloud_name)
+                # keyed on node names, which may contain dots
+                test_results["pool"] = json.dumps(pool, indent=2, sort_keys=True)
+                instance = [node["instance"] for node in pool["nodes"].values() if node["healthy"]]
+                if not instance:
+                    test_results["warning"] = "No healthy warm pool instances found"
+                    progress.finish(test_results)
+                    return
+            for i, result in iter_test_connectivity(
+                instance, cloud_name=self.helper.cloud_name, mtu=mtu
+            ):
+                test_results[i] = result
+                progress.update("{} {}".format(i, result), test_results)
+        except BaseException as err:
+            self.helper.record_run("test-connectivity", started, "error", event.params)
+            event.set_results({"error": str(err)})
+            raise
+        self.helper.record_run(
+            "test-connectivity",
+            started,
+            "success",
+            event.params,
+            points=connectivity_points(test_results),
+        )
+        if mtu:
+            # keyed on host names, which may contain dots
+            test_results["mtu"] = json.dumps(mtu_summary(test_results), indent=2, sort_keys=True)
+            for result in test_results.values():
+                if isinstance(result, dict):
+                    result.pop("path-mtu", None)
+                    result.pop("net-mtu", None)
+        progress.finish(test_results)
+
+    @profiled
+    def on_rolling_canary(self, event):
+        """Run rolling-canary action."""
+        cfg = self.model.config
+        started = time.time()
+        progress = ActionProgress(event)
+        report = {}
+        try:
+            for node, result in iter_rolling_canary(
+                cfg["image"],
+                event.params.get("disk", cfg["disk"]),
+                cfg["cidr"],
+                cfg["name-prefix"],
+                zone=event.params.get("zone"),
+                aggregate=event.params.get("aggregate"),
+                wave_size=event.params.get("wave-size", 20),
+                max_in_flight=event.params.get("max-in-flight", 20),
+                max_failures=event.params.get("max-failures", 0),
+                probe_wait=event.params.get("probe-wait", 120),
+                key_name=event.params.get("key-name", cfg.get("key-name")),
+                cloud_name=self.helper.cloud_name,
+            ):
+                report[node] = result
+                message = "wave {} {}: {}".format(result["wave"], node, result["result"])
+                if "seconds" in result:
+                    message += " in {}s".format(result["seconds"])
+                if "error" in result:
+                    message += " ({})".format(result["error"])
+                progress.update(
+                    message,
+                    # keyed on node names, which may contain dots
+                    {"nodes": json.dumps(report, indent=2, sort_keys=True)},
+                )
         except BaseException as err:
-            event.set_results({"error": err})
+            self.helper.record_run("rolling-canary", started, "error", event.params)
+            event.set_results({"error": str(err)})
             raise
-        event.set_results(test_results)
+        summary = canary_summary(report)
+        self.helper.record_run(
+            "rolling-canary",
+            started,
+            "success" if not summary["fail"] else "error",
+            event.params,
+            points=canary_points(report),
+        )
+        progress.finish(
+            {
+                "nodes": json.dumps(report, indent=2, sort_keys=True),
+                "summary": json.dumps(summary, indent=2, sort_keys=True),
+            }
+        )
 
+    @profiled
     def on_get_ssh_cmd(self, event):
         """Run get-ssh-cmd action."""
         try:
@@ -135,37 +344,401 @@ class CloudSupportCharm(CharmBase):
                 instance = event.params.get("instance")
             results = get_ssh_cmd(instance, cloud_name=self.helper.cloud_name)
         except BaseException as err:
-            event.set_results({"error": err})
+            event.set_results({"error": str(err)})
             raise
         event.set_results(results)
 
+    @profiled
     def on_stop_vms(self, event):
         """Run stop-vms action."""
         cloud_name = event.params.get("cloud-name")
         compute_node = event.params.get("compute-node")
+        started = time.time()
+        progress = ActionProgress(event)
+        stopped_vms, failed_to_stop = [], []
         try:
-            stopped_vms, failed_to_stop = self.helper.stop_vms(compute_node, cloud_name)
+            for vm_id, stopped in self.helper.iter_stop_vms(compute_node, cloud_name):
+                (stopped_vms if stopped else failed_to_stop).append(vm_id)
+                progress.update(
+                    "{} {}".format("stopped" if stopped else "failed to stop", vm_id),
+                    {"stopped-vms": stopped_vms, "failed-to-stop": failed_to_stop},
+                )
         except CloudSupportError as error:
             event.fail(str(error))
             return
+        self.helper.record_run(
+            "stop-vms", started, "success" if not failed_to_stop else "error", event.params
+        )
         self.state.stopped_vms = stopped_vms  # stored IDs of all stopped VMs
-        event.set_results(
+        progress.finish(
             {
                 "stopped-vms": stopped_vms,
                 "failed-to-stop": failed_to_stop,
             }
         )
 
+    @profiled
     def on_start_vms(self, event):
         """Run start-vms action."""
         cloud_name = event.params.get("cloud-name")
         compute_node = event.params.get("compute-node")
         force_all = event.params.get("force-all", False)
-        started_vms, failed_to_start = self.helper.start_vms(
-            compute_node, self.state.stopped_vms, force_all, cloud_name
+        started = time.time()
+        progress = ActionProgress(event)
+        started_vms, failed_to_start = [], []
+        for vm_id, ok in self.helper.iter_start_vms(
+            compute_node, list(self.state.stopped_vms), force_all, cloud_name
+        ):
+            (started_vms if ok else failed_to_start).append(vm_id)
+            progress.update(
+                "{} {}".format("started" if ok else "failed to start", vm_id),
+                {"started-vms": started_vms, "failed-to-start": failed_to_start},
+            )
+        self.helper.record_run(
+            "start-vms", started, "success" if not failed_to_start else "error", event.params
         )
         self.state.stopped_vms = []  # clear stored IDs
-        event.set_results({"started-vms": started_vms, "failed-to-start": failed_to_start})
+        progress.finish({"started-vms": started_vms, "failed-to-start": failed_to_start})
+
+    @profiled
+    def on_evacuate_node(self, event):
+        """Run evacuate-node action."""
+        cloud_name = event.params.get("cloud-name")
+        compute_node = event.params.get("compute-node")
+        started = time.time()
+        progress = ActionProgress(event)
+        details = {}
+        try:
+            for vm_id, result in self.helper.iter_evacuate_node(
+                compute_node,
+                max_concurrent=event.params.get("max-concurrent", 4),
+                retries=event.params.get("retries", 2),
+                wait=event.params.get("wait", 900),
+                cloud_name=cloud_name,
+            ):
+                details[vm_id] = result
+                if "duration" in result:
+                    message = "migrated {} to {} in {}s".format(
+                        vm_id, result["destination"], result["duration"]
+                    )
+                else:
+                    message = "{} {}: {}".format(
+                        "skipped" if "skipped" in result else "failed to migrate",
+                        vm_id,
+                        result.get("skipped") or result.get("error"),
+                    )
+                progress.update(message, {"details": json.dumps(details, indent=2)})
+        except BaseException as err:
+            event.set_results({"error": str(err)})
+            raise
+        migrated = [vm_id for vm_id, result in details.items() if "duration" in result]
+        failed = [vm_id for vm_id, result in details.items() if "error" in result]
+        skipped = [vm_id for vm_id, result in details.items() if "skipped" in result]
+        self.helper.record_run(
+            "evacuate-node", started, "success" if not failed else "error", event.params
+        )
+        durations = [details[vm_id]["duration"] for vm_id in migrated]
+        progress.finish(
+            {
+                "migrated-vms": migrated,
+                "failed-to-migrate": failed,
+                "skipped-vms": skipped,
+                "details": json.dumps(details, indent=2, sort_keys=True),
+                "summary": json.dumps(
+                    {
+                        "seconds": round(time.time() - started, 3),
+                        "median-duration": statistics.median(durations) if durations else None,
+                        "max-duration": max(durations, default=None),
+                        "retried": len(
+                            [vm_id for vm_id in migrated if details[vm_id]["attempts"] > 1]
+                        ),
+                    },
+                    indent=2,
+                ),
+            }
+        )
+
+    @profiled
+    def on_scheduler_load_test(self, event):
+        """Run scheduler-load-test action."""
+        cfg = self.model.config
+        nodes = event.params["nodes"].split(",")
+        try:
+            steps = scheduler_load_test(
+                nodes,
+                event.params.get("vcpus", cfg["vcpus"]),
+                event.params.get("ram", cfg["ram"]),
+                event.params.get("disk", cfg["disk"]),
+                cfg["image"],
+                cfg["name-prefix"],
+                cfg["cidr"],
+                start_rate=event.params.get("start-rate", 1),
+                rate_step=event.params.get("rate-step", 1),
+                max_rate=event.params.get("max-rate", 5),
+                step_duration=event.params.get("step-duration", 30),
+                timeout=event.params.get("timeout", 600),
+                vnfspecs=event.params.get("vnfspecs", False),
+                cloud_name=self.helper.cloud_name,
+            )
+        except BaseException as err:
+            event.set_results({"error": str(err)})
+            raise
+        event.set_results({"step-{}".format(i): step for i, step in enumerate(steps)})
+
+    @profiled
+    def on_storage_benchmark(self, event):
+        """Run storage-benchmark action."""
+        profiles = event.params.get("profiles")
+        try:
+            results = storage_benchmark(
+                event.params.get("instance"),
+                profiles=profiles.split(",") if profiles else None,
+                runtime=event.params.get("runtime", 30),
+                size=event.params.get("size", "1G"),
+                volume_size=event.params.get("volume-size"),
+                volume_type=event.params.get("volume-type"),
+                cloud_name=self.helper.cloud_name,
+            )
+        except BaseException as err:
+            event.set_results({"error": str(err)})
+            raise
+        if "warning" in results:
+            event.set_results(results)
+            return
+        event.set_results(
+            {
+                # keyed on host and backend names, e.g. __DEFAULT__ or LVM_iSCSI, which are
+                # not valid action result keys
+                "instances": json.dumps(results["instances"], indent=2, sort_keys=True),
+                "summary": json.dumps(results["summary"], indent=2, sort_keys=True),
+            }
+        )
+
+    @profiled
+    def on_volume_latency_probe(self, event):
+        """Run volume-latency-probe action."""
+        try:
+            results = volume_latency_probe(
+                count=event.params.get("count", 10),
+                size=event.params.get("size", 1),
+                volume_type=event.params.get("volume-type"),
+                instance=event.params.get("instance"),
+                cloud_name=self.helper.cloud_name,
+            )
+        except BaseException as err:
+            event.set_results({"error": str(err)})
+            raise
+        if "warning" in results:
+            event.set_results(results)
+            return
+        # keyed on host names, which may contain dots
+        event.set_results({"latency": json.dumps(results, indent=2, sort_keys=True)})
+
+    @profiled
+    def on_live_migration_benchmark(self, event):
+        """Run live-migration-benchmark action."""
+        try:
+            results = live_migration_benchmark(
+                event.params["destinations"].split(","),
+                instance=event.params.get("instance"),
+                max_concurrent=event.params.get("max-concurrent", 1),
+                wait=event.params.get("timeout", 600),
+                cloud_name=self.helper.cloud_name,
+            )
+        except BaseException as err:
+            event.set_results({"error": str(err)})
+            raise
+        if "warning" in results:
+            event.set_results(results)
+            return
+        event.set_results(
+            {
+                # keyed on host and backend names, e.g. __DEFAULT__ or LVM_iSCSI, which are
+                # not valid action result keys
+                "instances": json.dumps(results["instances"], indent=2, sort_keys=True),
+                "summary": json.dumps(results["summary"], indent=2, sort_keys=True),
+            }
+        )
+
+    @profiled
+    def on_vnf_validation(self, event):
+        """Run vnf-validation action."""
+        try:
+            results = vnf_validation(
+                event.params.get("instance"),
+                mb=event.params.get("size-mb", 1024),
+                threshold=event.params.get("threshold", 20.0),
+                cloud_name=self.helper.cloud_name,
+            )
+        except BaseException as err:
+            event.set_results({"error": str(err)})
+            raise
+        if "warning" in results:
+            event.set_results(results)
+            return
+        event.set_results(
+            {
+                "instances": json.dumps(results["instances"], indent=2, sort_keys=True),
+                "flagged": ",".join(results["flagged"]),
+            }
+        )
+
+    @profiled
+    def on_sriov_benchmark(self, event):
+        """Run sriov-benchmark action."""
+        try:
+            results = sriov_benchmark(
+                duration=event.params.get("duration", 10),
+                streams=event.params.get("streams", 4),
+                cloud_name=self.helper.cloud_name,
+            )
+        except BaseException as err:
+            event.set_results({"error": str(err)})
+            raise
+        if "warning" in results:
+            event.set_results(results)
+            return
+        event.set_results(
+            {
+                # keyed on physnets and host names, which may contain dots
+                "pairs": json.dumps(results["pairs"], indent=2, sort_keys=True),
+                "summary": json.dumps(results["summary"], indent=2, sort_keys=True),
+            }
+        )
+
+    @profiled
+    def on_east_west_matrix(self, event):
+        """Run east-west-matrix action."""
+        try:
+            results = east_west_matrix(
+                count=event.params.get("count", 5), cloud_name=self.helper.cloud_name
+            )
+        except BaseException as err:
+            event.set_results({"error": str(err)})
+            raise
+        if "warning" in results:
+            event.set_results(results)
+            return
+        event.set_results(
+            {
+                "matrix": results["matrix"],
+                # keyed on host names, which may contain dots
+                "summary": json.dumps(results["summary"], indent=2, sort_keys=True),
+                "instances": json.dumps(results["instances"], indent=2, sort_keys=True),
+                "failed": json.dumps(results["failed"], indent=2, sort_keys=True),
+            }
+        )
+
+    @profiled
+    def on_capacity_report(self, event):
+        """Run capacity-report action."""
+        cfg = self.model.config
+        try:
+            report = capacity_report(
+                event.params.get("vcpus", cfg["vcpus"]),
+                event.params.get("ram", cfg["ram"]),
+                event.params.get("disk", cfg["disk"]),
+                vnfspecs=event.params.get("vnfspecs", False),
+                cloud_name=self.helper.cloud_name,
+            )
+        except BaseException as err:
+            event.set_results({"error": str(err)})
+            raise
+        event.set_results(
+            {
+                "nodes": capacity_table(report["nodes"]),
+                "summary": json.dumps(report["summary"], indent=2, sort_keys=True),
+            }
+        )
+
+    @profiled
+    def on_cleanup_test_artifacts(self, event):
+        """Run cleanup-test-artifacts action."""
+        name_prefix = self.model.config["name-prefix"]
+        pattern = event.params.get("pattern") or "^{}-".format(re.escape(name_prefix))
+        started = time.time()
+        try:
+            results = cleanup_test_artifacts(
+                pattern,
+                all_servers=event.params.get("all-servers", False),
+                name_prefix=name_prefix,
+                # nothing maintains the pool instances once the pool is disabled
+                pool=event.params.get("pool", False)
+                or not self.model.config["warm-pool-aggregate"],
+                cloud_name=self.helper.cloud_name,
+            )
+        except BaseException as err:
+            self.helper.record_run("cleanup-test-artifacts", started, "error", event.params)
+            event.set_results({"error": str(err)})
+            raise
+        self.helper.record_run(
+            "cleanup-test-artifacts",
+            started,
+            "success" if not results["errors"] else "error",
+            event.params,
+        )
+        event.set_results(
+            {
+                key: (
+                    json.dumps(value, indent=2, sort_keys=True)
+                    if isinstance(value, dict)
+                    else value
+                )
+                for key, value in results.items()
+            }
+        )
+
+    @profiled
+    def on_connectivity_history(self, event):
+        """Run connectivity-history action."""
+        try:
+            history = self.helper.connectivity_history(
+                event.params.get("hours", 24), event.params.get("compute-node")
+            )
+        except BaseException as err:
+            event.set_results({"error": str(err)})
+            raise
+        # keyed on host names, which may contain dots
+        event.set_results({"history": json.dumps(history, indent=2, sort_keys=True)})
+
+    @profiled
+    def on_compare_runs(self, event):
+        """Run compare-runs action."""
+        try:
+            comparison = self.helper.compare_runs(
+                event.params.get("metric", "boot-time"),
+                run_id=event.params.get("run"),
+                baseline=event.params.get("baseline"),
+                window=event.params.get("window", 5),
+                threshold=event.params.get("threshold", 20),
+            )
+        except BaseException as err:
+            event.set_results({"error": str(err)})
+            raise
+        event.set_results(
+            {
+                "run": comparison.get("run"),
+                "baseline": comparison.get("baseline"),
+                "regressed": ",".join(comparison["regressed"]),
+                # keyed on host names, which may contain dots
+                "hosts": json.dumps(comparison["hosts"], indent=2, sort_keys=True),
+            }
+        )
+
+    @profiled
+    def on_run_history(self, event):
+        """Run run-history action."""
+        try:
+            history = self.helper.run_history(
+                limit=event.params.get("limit", 20),
+                action=event.params.get("action"),
+                metric=event.params.get("metric"),
+                compute_node=event.params.get("compute-node"),
+            )
+        except BaseException as err:
+            event.set_results({"error": str(err)})
+            raise
+        event.set_results({"history": json.dumps(history, indent=2)})
 
     def on_nrpe_external_master_relation_joined(self, event):
         """Handle nrpe-external-master relation joined."""
@@ -249,7 +249,11 @@ class CloudSupportTests(CloudSupportBaseTest):
         content = result.get("Stdout")
         self.assertTrue(expected_nrpe_check in content)
 
-        # Verify it returns ok.
+        # Collect the servers, then verify the check returns ok.
+        cmd = "systemctl start cloudsupport-stale-collector.service"
+        result = model.run_on_unit(self.unit_name, cmd)
+        if result.get("Code") != "0":
+            raise model.CommandRunFailed(cmd, result)
         cmd = "{} --cloud-name {} --name-prefix {} --warn-days 7 --crit-days 14".format(
             nagios_plugin, cloud_name, name_prefix
         )
@@ -5,6 +5,7 @@
 from unittest import mock
 
 import lib_cloudsupport
+import os_testing
 import pytest
 from ops.testing import Harness
 
@@ -14,11 +15,10 @@ from charm import CloudSupportCharm
 @pytest.fixture
 def openstack():
     """Mock openstack connection."""
-    mocker_os_testing_con = mock.patch.object(lib_cloudsupport, "con")
-    mock_con = mocker_os_testing_con.start()
-    mock_openstack = mock_con.return_value = mock.MagicMock()
-    yield mock_openstack
-    mocker_os_testing_con.stop()
+    mock_openstack = mock.MagicMock()
+    with mock.patch.object(lib_cloudsupport, "con", return_value=mock_openstack):
+        with mock.patch.object(os_testing, "con", return_value=mock_openstack):
+            yield mock_openstack
 
 
 @pytest.fixture
@@ -30,6 +30,7 @@ def harness():
     harness._backend.action_get = mock.MagicMock()
     harness._backend.action_set = mock.MagicMock()
     harness._backend.action_fail = mock.MagicMock()
+    harness._backend.action_log = mock.MagicMock()
     yield harness
     harness.cleanup()
 
@@ -56,3 +57,9 @@ def action_set(harness):
 def action_fail(harness):
     """Return mocked action_fail object."""
     yield harness._backend.action_fail
+
+
+@pytest.fixture
+def action_log(harness):
+    """Return mocked action_log object."""
+    yield harness._backend.action_log
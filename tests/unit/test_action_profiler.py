@@ -0,0 +1,58 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for action-profiler."""
+
+import collections
+import pathlib
+import pstats
+import threading
+import time
+
+import action_profiler
+
+
+def busy_worker(stop):
+    """Spin until stopped."""
+    while not stop.is_set():
+        sum(range(100))
+
+
+def test_top_functions():
+    """Test the total and self percentages of the sampled functions."""
+    stacks = collections.Counter(
+        {"a.py:main;b.py:ssh;c.py:recv": 6, "a.py:main;d.py:api": 3, "a.py:main": 1}
+    )
+    assert action_profiler.top_functions(stacks, top=3) == [
+        "100.0%  10.0% a.py:main",
+        " 60.0%   0.0% b.py:ssh",
+        " 60.0%  60.0% c.py:recv",
+    ]
+    assert action_profiler.top_functions(collections.Counter()) == []
+
+
+def test_action_profiler(tmp_path):
+    """Test that the profiles of the main and other threads are saved."""
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_worker, args=(stop,))
+    with action_profiler.ActionProfiler("test", tmp_path, interval=0.001, top=100) as profiler:
+        worker.start()
+        time.sleep(0.1)
+        stop.set()
+        worker.join()
+
+    summary = profiler.summary
+    assert summary["samples"] > 0
+    assert any("busy_worker" in line for line in summary["top-functions"])
+    assert pstats.Stats(summary["pstats"]).total_calls > 0
+    collapsed = pathlib.Path(summary["collapsed"]).read_text()
+    assert "test_action_profiler.py:busy_worker" in collapsed
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in collapsed.splitlines())
+
+
+def test_action_profiler_unwritable(tmp_path):
+    """Test that failing to save the profiles still returns the summary."""
+    (tmp_path / "file").touch()
+    with action_profiler.ActionProfiler("test", tmp_path / "file" / "dir") as profiler:
+        pass
+    assert "error" in profiler.summary
+    assert "pstats" not in profiler.summary
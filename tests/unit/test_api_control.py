@@ -0,0 +1,122 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for api-control."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import api_control
+import pytest
+from openstack.exceptions import HttpException
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    """Return fresh stats and retry without waiting."""
+    stats = api_control.ApiStats()
+    monkeypatch.setattr(api_control, "STATS", stats)
+    monkeypatch.setattr(api_control, "BACKOFF_BASE", 0)
+    return stats
+
+
+def throttled(status, retry_after=None):
+    """Return an overload response exception."""
+    response = MagicMock(
+        status_code=status, headers={"Retry-After": retry_after} if retry_after else {}
+    )
+    return HttpException("overloaded", response=response, http_status=status)
+
+
+@pytest.mark.parametrize(
+    "header, exp_seconds",
+    [(None, None), ("2", 2.0), ("3600", api_control.BACKOFF_CAP), ("garbage", None)],
+)
+def test_retry_after(header, exp_seconds):
+    """Test parsing of the Retry-After header."""
+    assert api_control.retry_after(throttled(429, header)) == exp_seconds
+
+
+def test_backoff_delay():
+    """Test jittered exponential backoff and Retry-After hint."""
+    for attempt in range(10):
+        delay = api_control.backoff_delay(attempt)
+        assert 0 <= delay <= min(api_control.BACKOFF_CAP, api_control.BACKOFF_BASE * 2**attempt)
+    assert 2 <= api_control.backoff_delay(0, hint=2) <= 2 + api_control.BACKOFF_BASE
+
+
+def test_call_retries_rejections(stats):
+    """Test that the sync call retries 429 and 503 with Retry-After, and records them."""
+    func = MagicMock(side_effect=[throttled(429), throttled(503, "0"), "result"])
+    assert api_control.call(func, 1, a=2) == "result"
+    assert func.call_count == 3
+    report = stats.snapshot()
+    assert report["calls"] == 1
+    assert report["retries"] == 2
+    assert report["throttled"] == {"429": 1, "503": 1}
+
+
+@pytest.mark.parametrize(
+    "error", [throttled(503), throttled(504), HttpException("not found", http_status=404)]
+)
+def test_call_does_not_retry(stats, error):
+    """Test that 503 without Retry-After, gateway timeouts and other errors are not retried."""
+    func = MagicMock(side_effect=error)
+    with pytest.raises(HttpException):
+        api_control.call(func)
+    assert func.call_count == 1
+    assert stats.retries == 0
+
+
+def test_limiter_aimd(stats):
+    """Test that the window is halved on overload and grows back on success."""
+    limiter = api_control.AdaptiveLimiter(8, stats=stats)
+    func = MagicMock(side_effect=[throttled(429), "result"])
+
+    async def run():
+        return await limiter.run(ThreadPoolExecutor(1), func)
+
+    assert asyncio.run(run()) == "result"
+    assert 4 < limiter.limit < 5
+    assert stats.snapshot()["min-concurrency"] == 4
+
+    func = MagicMock(return_value="result")
+
+    async def run_many():
+        executor = ThreadPoolExecutor(1)
+        for _ in range(40):
+            await limiter.run(executor, func)
+
+    asyncio.run(run_many())
+    assert limiter.limit == 8
+
+
+def test_limiter_gives_up(stats, monkeypatch):
+    """Test that the limiter raises once the retries are exhausted."""
+    monkeypatch.setattr(api_control, "MAX_RETRIES", 2)
+    limiter = api_control.AdaptiveLimiter(4, stats=stats)
+    func = MagicMock(side_effect=throttled(429))
+
+    async def run():
+        return await limiter.run(ThreadPoolExecutor(1), func)
+
+    with pytest.raises(HttpException):
+        asyncio.run(run())
+    assert func.call_count == 3
+    assert limiter.limit >= 1
+    assert stats.snapshot()["events"][-1].endswith("failed, concurrency 2")
+
+
+def test_limiter_does_not_retry_bare_503(stats):
+    """Test that a 503 without Retry-After is not retried, a POST may have gone through."""
+    limiter = api_control.AdaptiveLimiter(4, stats=stats)
+    func = MagicMock(side_effect=throttled(503))
+
+    async def run():
+        return await limiter.run(ThreadPoolExecutor(1), func)
+
+    with pytest.raises(HttpException):
+        asyncio.run(run())
+    assert func.call_count == 1
+    assert stats.snapshot()["throttled"] == {"503": 1}
+    assert limiter.limit == 2
@@ -4,12 +4,16 @@
 # See LICENSE file for licensing details.
 
 """Unittests for charm-cloudsupport."""
+
+import json
 from contextlib import contextmanager
 from unittest import mock
 
 import pytest
 from os_testing import CloudSupportError
 
+import charm as charm_module
+
 
 @contextmanager
 def mock_juju_action(name):
@@ -23,6 +27,11 @@ def mock_juju_action(name):
         patcher.stop()
 
 
+def iter_outcomes(succeeded, failed):
+    """Return (VM ID, succeeded) tuples like iter_stop_vms/iter_start_vms."""
+    return iter([(vm, True) for vm in succeeded] + [(vm, False) for vm in failed])
+
+
 def test_init_charm(charm):
     """Test initialization of charm."""
     assert charm.unit.status.name == "active"
@@ -38,11 +47,11 @@ def test_on_stop_vms(charm, action_set, action_get, exp_result):
         "cloud-name": "test-cloud",
     }
     stopped_vms, failed_to_stop = exp_result
-    charm.helper.stop_vms.return_value = exp_result
+    charm.helper.iter_stop_vms.return_value = iter_outcomes(*exp_result)
     with mock_juju_action("stop-vms"):
         charm.on.stop_vms_action.emit()  # emit action
 
-    charm.helper.stop_vms.assert_called_once_with("test-node", "test-cloud")
+    charm.helper.iter_stop_vms.assert_called_once_with("test-node", "test-cloud")
     assert charm.state.stopped_vms == stopped_vms
     action_set.assert_called_once_with(
         {"stopped-vms": stopped_vms, "failed-to-stop": failed_to_stop}
@@ -56,11 +65,11 @@ def test_on_stop_vms_without_disabled_compute_node(charm, action_fail, action_ge
         "compute-node": "test-node",
         "cloud-name": "test-cloud",
     }
-    charm.helper.stop_vms.side_effect = CloudSupportError("test-message")
+    charm.helper.iter_stop_vms.side_effect = CloudSupportError("test-message")
     with mock_juju_action("stop-vms"):
         charm.on.stop_vms_action.emit()  # emit action
 
-    charm.helper.stop_vms.assert_called_once_with("test-node", "test-cloud")
+    charm.helper.iter_stop_vms.assert_called_once_with("test-node", "test-cloud")
     action_fail.assert_called_once_with("test-message")
 
 
@@ -79,14 +88,432 @@ def test_on_start_vms(
         "cloud-name": "test-cloud",
     }
     charm.state.stopped_vms = stopped_vms
-    charm.helper.start_vms.return_value = (started_vms, failed_to_start)
+    charm.helper.iter_start_vms.return_value = iter_outcomes(started_vms, failed_to_start)
     with mock_juju_action("start-vms"):
         charm.on.start_vms_action.emit()  # emit action
 
-    charm.helper.start_vms.assert_called_once_with(
+    charm.helper.iter_start_vms.assert_called_once_with(
         "test-node", stopped_vms, force_all, "test-cloud"
     )
     assert charm.state.stopped_vms == []
     action_set.assert_called_once_with(
         {"started-vms": started_vms, "failed-to-start": failed_to_start}
     )
+
+
+def test_on_scheduler_load_test(charm, action_set, action_get):
+    """Test scheduler-load-test action."""
+    action_get.return_value = {"nodes": "node1,node2", "max-rate": 2}
+    steps = [{"rate": 1, "launched": 30}, {"rate": 2, "launched": 60}]
+    with mock.patch("charm.scheduler_load_test", return_value=steps) as load_test:
+        with mock_juju_action("scheduler-load-test"):
+            charm.on.scheduler_load_test_action.emit()
+
+    assert load_test.call_args.args[0] == ["node1", "node2"]
+    assert load_test.call_args.kwargs["max_rate"] == 2
+    action_set.assert_called_once_with({"step-0": steps[0], "step-1": steps[1]})
+
+
+def test_on_storage_benchmark(charm, action_set, action_get):
+    """Test storage-benchmark action."""
+    action_get.return_value = {"profiles": "randread-4k", "volume-size": 10}
+    results = {
+        "instances": {
+            "uuid1": {"host": "node1.maas", "backends": {"__DEFAULT__": {"randread-4k": {}}}}
+        },
+        "summary": {"node1.maas": {"LVM_iSCSI": {"randread-4k": {"iops": 1000.0}}}},
+    }
+    with mock.patch("charm.storage_benchmark", return_value=results) as benchmark:
+        with mock_juju_action("storage-benchmark"):
+            charm.on.storage_benchmark_action.emit()
+
+    assert benchmark.call_args.kwargs["profiles"] == ["randread-4k"]
+    assert benchmark.call_args.kwargs["volume_size"] == 10
+    action_set.assert_called_once_with(
+        {
+            "instances": json.dumps(results["instances"], indent=2, sort_keys=True),
+            "summary": json.dumps(results["summary"], indent=2, sort_keys=True),
+        }
+    )
+
+
+def test_on_volume_latency_probe(charm, action_set, action_get):
+    """Test volume-latency-probe action."""
+    action_get.return_value = {"count": 4}
+    results = {"node1.maas": {"volumes": 4, "errors": 0, "attach": {"p50": 2.5}}}
+    with mock.patch("charm.volume_latency_probe", return_value=results) as probe:
+        with mock_juju_action("volume-latency-probe"):
+            charm.on.volume_latency_probe_action.emit()
+
+    assert probe.call_args.kwargs["count"] == 4
+    action_set.assert_called_once_with({"latency": json.dumps(results, indent=2, sort_keys=True)})
+
+
+def test_on_live_migration_benchmark(charm, action_set, action_get):
+    """Test live-migration-benchmark action."""
+    action_get.return_value = {"destinations": "node1,node2", "max-concurrent": 2}
+    results = {
+        "instances": {"uuid1": {"source": "node1", "destination": "node2", "duration": 8.2}},
+        "summary": {"node1->node2": {"migrations": 1, "failures": 0}},
+    }
+    with mock.patch("charm.live_migration_benchmark", return_value=results) as benchmark:
+        with mock_juju_action("live-migration-benchmark"):
+            charm.on.live_migration_benchmark_action.emit()
+
+    assert benchmark.call_args.args[0] == ["node1", "node2"]
+    assert benchmark.call_args.kwargs["max_concurrent"] == 2
+    action_set.assert_called_once_with(
+        {
+            "instances": json.dumps(results["instances"], indent=2, sort_keys=True),
+            "summary": json.dumps(results["summary"], indent=2, sort_keys=True),
+        }
+    )
+
+
+def test_on_connectivity_history(charm, action_set, action_get):
+    """Test connectivity-history action."""
+    action_get.return_value = {"hours": 6}
+    history = {"node1.maas": {"samples": 36, "avg-loss": 0.0}}
+    charm.helper.connectivity_history.return_value = history
+    with mock_juju_action("connectivity-history"):
+        charm.on.connectivity_history_action.emit()
+
+    charm.helper.connectivity_history.assert_called_once_with(6, None)
+    action_set.assert_called_once_with({"history": json.dumps(history, indent=2, sort_keys=True)})
+
+
+def test_on_compare_runs(charm, action_set, action_get):
+    """Test compare-runs action."""
+    action_get.return_value = {"metric": "rtt", "threshold": 10}
+    hosts = {"node1.maas": {"value": 2.0, "baseline": 1.0, "change-pct": 100.0}}
+    charm.helper.compare_runs.return_value = {
+        "run": 7,
+        "baseline": "median of 5 previous runs",
+        "hosts": hosts,
+        "regressed": ["node1.maas"],
+    }
+    with mock_juju_action("compare-runs"):
+        charm.on.compare_runs_action.emit()
+
+    charm.helper.compare_runs.assert_called_once_with(
+        "rtt", run_id=None, baseline=None, window=5, threshold=10
+    )
+    action_set.assert_called_once_with(
+        {
+            "run": 7,
+            "baseline": "median of 5 previous runs",
+            "regressed": "node1.maas",
+            "hosts": json.dumps(hosts, indent=2, sort_keys=True),
+        }
+    )
+
+
+def test_on_stop_vms_records_run(charm, action_get):
+    """Test stop-vms runs are recorded in the run history."""
+    params = {"i-really-mean-it": True, "compute-node": "test-node", "cloud-name": "test-cloud"}
+    action_get.return_value = params
+    charm.helper.iter_stop_vms.return_value = iter_outcomes([1], [2])
+    with mock_juju_action("stop-vms"):
+        charm.on.stop_vms_action.emit()
+
+    charm.helper.record_run.assert_called_once_with("stop-vms", mock.ANY, "error", params)
+
+
+def test_on_evacuate_node(charm, action_set, action_get):
+    """Test evacuate-node sorts the VMs on their outcome."""
+    params = {"i-really-mean-it": True, "compute-node": "test-node"}
+    action_get.return_value = params
+    charm.helper.iter_evacuate_node.return_value = iter(
+        [
+            ("uuid1", {"skipped": "cannot live-migrate a VM in status SHUTOFF"}),
+            ("uuid2", {"destination": "node2", "duration": 4.0, "attempts": 1, "errors": []}),
+            ("uuid3", {"destination": "node3", "duration": 8.0, "attempts": 2, "errors": ["x"]}),
+            ("uuid4", {"error": "timeout waiting for migration", "errors": ["y"]}),
+        ]
+    )
+    with mock_juju_action("evacuate-node"):
+        charm.on.evacuate_node_action.emit()
+
+    results = action_set.call_args.args[0]
+    assert results["migrated-vms"] == ["uuid2", "uuid3"]
+    assert results["failed-to-migrate"] == ["uuid4"]
+    assert results["skipped-vms"] == ["uuid1"]
+    summary = json.loads(results["summary"])
+    assert summary["median-duration"] == 6.0
+    assert summary["max-duration"] == 8.0
+    assert summary["retried"] == 1
+    charm.helper.record_run.assert_called_once_with("evacuate-node", mock.ANY, "error", params)
+
+
+def test_on_evacuate_node_not_disabled(charm, action_get, action_set):
+    """Test evacuate-node fails on a compute node that is not disabled."""
+    action_get.return_value = {"i-really-mean-it": True, "compute-node": "test-node"}
+    charm.helper.iter_evacuate_node.side_effect = CloudSupportError("Please disable host")
+    with mock_juju_action("evacuate-node"), pytest.raises(CloudSupportError):
+        charm.on.evacuate_node_action.emit()
+
+    action_set.assert_called_once_with({"error": "Please disable host"})
+    charm.helper.record_run.assert_not_called()
+
+
+def test_on_rolling_canary(charm, action_set, action_get):
+    """Test rolling-canary reports every node and summarizes the failures."""
+    params = {"zone": "az1", "wave-size": 2}
+    action_get.return_value = params
+    report = {
+        "node1": {"result": "pass", "wave": 1, "instance": "uuid1", "seconds": 40.0},
+        "node2": {"result": "fail", "wave": 1, "instance": "uuid2", "error": "no ping reply"},
+    }
+    with mock.patch("charm.iter_rolling_canary", return_value=iter(report.items())) as canary:
+        with mock_juju_action("rolling-canary"):
+            charm.on.rolling_canary_action.emit()
+
+    assert canary.call_args.kwargs["zone"] == "az1"
+    assert canary.call_args.kwargs["wave_size"] == 2
+    results = action_set.call_args.args[0]
+    assert json.loads(results["nodes"]) == report
+    assert json.loads(results["summary"])["fail"] == ["node2"]
+    charm.helper.record_run.assert_called_once_with(
+        "rolling-canary", mock.ANY, "error", params, points=mock.ANY
+    )
+
+
+def test_on_rolling_canary_no_nodes(charm, action_get, action_set):
+    """Test rolling-canary fails when no compute node is selected."""
+    action_get.return_value = {"aggregate": "empty"}
+    error = CloudSupportError("No enabled compute node found")
+    with mock.patch("charm.iter_rolling_canary", side_effect=error):
+        with mock_juju_action("rolling-canary"), pytest.raises(CloudSupportError):
+            charm.on.rolling_canary_action.emit()
+
+    action_set.assert_called_once_with({"error": "No enabled compute node found"})
+    charm.helper.record_run.assert_called_once_with(
+        "rolling-canary", mock.ANY, "error", {"aggregate": "empty"}
+    )
+
+
+def test_on_test_connectivity_streams_progress(
+    charm, action_set, action_get, action_log, monkeypatch
+):
+    """Test test-connectivity logs each result and checkpoints partial results."""
+    monkeypatch.setattr(charm_module, "CHECKPOINT_INTERVAL", 0)
+    action_get.return_value = {}
+    results = [("uuid1", {"host": "node1", "ping": ""}), ("uuid2", {"host": "node2", "ping": ""})]
+    with mock.patch("charm.iter_test_connectivity", return_value=iter(results)):
+        with mock_juju_action("test-connectivity"):
+            charm.on.test_connectivity_action.emit()
+
+    assert action_log.call_count == 2
+    assert action_log.call_args_list[0].args[0].startswith("[1] uuid1")
+    assert action_set.call_count == 3  # two checkpoints and the final results
+    action_set.assert_called_with(dict(results))
+
+
+def test_on_create_test_instances_prewarm(charm, action_set, action_get, action_log):
+    """Test create-test-instances pre-warms the image on the nodes first."""
+    action_get.return_value = {"nodes": "node1,node2", "prewarm": True}
+    prewarm = {
+        "node1": {"cache": "hit", "seconds": 5.0, "status": "success"},
+        "node2": {"cache": "miss", "seconds": 60.0, "status": "success"},
+    }
+    created = [["success", "uuid1", "ok", "node1", 10.0]]
+    with mock.patch(
+        "charm.iter_prewarm_image", return_value=iter(prewarm.items())
+    ) as prewarm_image, mock.patch("charm.iter_create_instance", return_value=iter(created)):
+        with mock_juju_action("create-test-instances"):
+            charm.on.create_test_instances_action.emit()
+
+    assert prewarm_image.call_args.args[0] == ["node1", "node2"]
+    assert action_log.call_count == 3
+    assert action_log.call_args_list[0].args[0] == "[1] pre-warmed node1: cache hit in 5.0s"
+    action_set.assert_called_with(
+        {
+            "create-results": "success",
+            "create-details": created,
+            "prewarm": json.dumps(prewarm, indent=2, sort_keys=True),
+        }
+    )
+
+
+def test_on_start_vms_api_stats(charm, action_set, action_get):
+    """Test that the API throughput and throttling are reported with the results."""
+    action_get.return_value = {"compute-node": "test-node"}
+
+    def iter_start_vms(*_):
+        charm_module.API_STATS.record_call()
+        charm_module.API_STATS.record_throttle(429, 1.0, 16)
+        yield "vm1", True
+
+    charm.helper.iter_start_vms.side_effect = iter_start_vms
+    with mock_juju_action("start-vms"):
+        charm.on.start_vms_action.emit()
+
+    results = action_set.call_args.args[0]
+    assert results["started-vms"] == ["vm1"]
+    stats = json.loads(results["api-stats"])
+    assert stats["calls"] == 1
+    assert stats["throttled"] == {"429": 1}
+    assert stats["min-concurrency"] == 16
+
+
+def test_on_capacity_report(charm, action_set, action_get):
+    """Test capacity-report action."""
+    action_get.return_value = {"vcpus": 2}
+    report = {"nodes": {"node1.maas": {"fits": 1}}, "summary": {"nodes": 1}}
+    with mock.patch("charm.capacity_report", return_value=report) as capacity_report, mock.patch(
+        "charm.capacity_table", return_value="table"
+    ):
+        with mock_juju_action("capacity-report"):
+            charm.on.capacity_report_action.emit()
+
+    assert capacity_report.call_args.args[0] == 2
+    action_set.assert_called_once_with(
+        {"nodes": "table", "summary": json.dumps({"nodes": 1}, indent=2, sort_keys=True)}
+    )
+
+
+def test_on_vnf_validation(charm, action_set, action_get):
+    """Test vnf-validation action."""
+    action_get.return_value = {"threshold": 10}
+    results = {"instances": {"uuid1": {"issues": ["vcpus share host cpus"]}}, "flagged": ["uuid1"]}
+    with mock.patch("charm.vnf_validation", return_value=results) as vnf_validation:
+        with mock_juju_action("vnf-validation"):
+            charm.on.vnf_validation_action.emit()
+
+    assert vnf_validation.call_args.kwargs["threshold"] == 10
+    action_set.assert_called_once_with(
+        {
+            "instances": json.dumps(results["instances"], indent=2, sort_keys=True),
+            "flagged": "uuid1",
+        }
+    )
+
+
+def test_on_sriov_benchmark(charm, action_set, action_get):
+    """Test sriov-benchmark action."""
+    action_get.return_value = {"duration": 5}
+    results = {"pairs": {"physnet1": []}, "summary": {"physnet1": {"pairs": 0}}}
+    with mock.patch("charm.sriov_benchmark", return_value=results) as sriov_benchmark:
+        with mock_juju_action("sriov-benchmark"):
+            charm.on.sriov_benchmark_action.emit()
+
+    assert sriov_benchmark.call_args.kwargs["duration"] == 5
+    action_set.assert_called_once_with(
+        {
+            "pairs": json.dumps(results["pairs"], indent=2, sort_keys=True),
+            "summary": json.dumps(results["summary"], indent=2, sort_keys=True),
+        }
+    )
+
+
+def test_on_test_connectivity_mtu(charm, action_set, action_get):
+    """Test test-connectivity action with the path MTU probe."""
+    action_get.return_value = {"mtu": True}
+    results = [("uuid1", {"host": "node1", "ping": "", "path-mtu": 1450, "net-mtu": 1500})]
+    with mock.patch(
+        "charm.iter_test_connectivity", return_value=iter(results)
+    ) as iter_test_connectivity:
+        with mock_juju_action("test-connectivity"):
+            charm.on.test_connectivity_action.emit()
+
+    assert iter_test_connectivity.call_args.kwargs["mtu"] is True
+    test_results = action_set.call_args.args[0]
+    assert test_results["uuid1"] == {"host": "node1", "ping": ""}
+    assert json.loads(test_results["mtu"])["node1"]["mismatch"] is True
+
+
+def test_on_east_west_matrix(charm, action_set, action_get):
+    """Test east-west-matrix action."""
+    action_get.return_value = {"count": 3}
+    results = {"matrix": "src\\dst", "summary": {}, "instances": {}, "failed": {}}
+    with mock.patch("charm.east_west_matrix", return_value=results) as east_west_matrix:
+        with mock_juju_action("east-west-matrix"):
+            charm.on.east_west_matrix_action.emit()
+
+    assert east_west_matrix.call_args.kwargs["count"] == 3
+    action_set.assert_called_once_with(
+        {"matrix": "src\\dst", "summary": "{}", "instances": "{}", "failed": "{}"}
+    )
+
+
+def test_on_create_test_instances_boot_phases(charm, action_set, action_get, action_log):
+    """Test create-test-instances reports the boot phases of the new instances."""
+    action_get.return_value = {"nodes": "node1", "boot-phases": True, "boot-wait": 60}
+    created = [["success", "uuid1", "ok", "node1", 10.0]]
+    report = {"nodes": {"node1": {"instances": 1, "dhcp-metadata": 4.2}}, "incomplete": {}}
+    with mock.patch(
+        "charm.boot_phase_report", return_value=report
+    ) as boot_phase_report, mock.patch("charm.iter_create_instance", return_value=iter(created)):
+        with mock_juju_action("create-test-instances"):
+            charm.on.create_test_instances_action.emit()
+
+    assert boot_phase_report.call_args.args[0] == created
+    assert boot_phase_report.call_args.kwargs["wait"] == 60
+    action_set.assert_called_with(
+        {
+            "create-results": "success",
+            "create-details": created,
+            "boot-phases": json.dumps(report, indent=2, sort_keys=True),
+        }
+    )
+
+
+def test_on_capacity_report_profile(charm, action_set, action_get, tmp_path):
+    """Test that an action run with profile set reports its profile."""
+    action_get.return_value = {"vcpus": 2, "profile": True}
+    report = {"nodes": {}, "summary": {}}
+    with mock.patch("charm.capacity_report", return_value=report), mock.patch(
+        "charm.capacity_table", return_value="table"
+    ), mock.patch("action_profiler.PROFILE_DIR", tmp_path):
+        with mock_juju_action("capacity-report"):
+            charm.on.capacity_report_action.emit()
+
+    profile = json.loads(action_set.call_args.args[0]["profile"])
+    assert profile["pstats"].startswith(str(tmp_path / "capacity-report-"))
+    assert (tmp_path / profile["collapsed"]).exists()
+
+
+def test_on_cleanup_test_artifacts(charm, action_set, action_get):
+    """Test cleanup-test-artifacts action."""
+    action_get.return_value = {"all-servers": True}
+    results = {"reclaimed": {"ports": ["port1"]}, "errors": {}, "stages": {}, "seconds": 1.5}
+    with mock.patch("charm.cleanup_test_artifacts", return_value=results) as cleanup:
+        with mock_juju_action("cleanup-test-artifacts"):
+            charm.on.cleanup_test_artifacts_action.emit()
+
+    assert cleanup.call_args.args[0] == "^cloudsupport\\-test-"
+    assert cleanup.call_args.kwargs["all_servers"] is True
+    assert cleanup.call_args.kwargs["name_prefix"] == "cloudsupport-test"
+    # the pool is disabled, its instances are drained
+    assert cleanup.call_args.kwargs["pool"] is True
+    action_set.assert_called_once_with(
+        {
+            "reclaimed": json.dumps({"ports": ["port1"]}, indent=2, sort_keys=True),
+            "errors": "{}",
+            "stages": "{}",
+            "seconds": 1.5,
+        }
+    )
+
+
+def test_on_test_connectivity_pool(charm, action_set, action_get):
+    """Test test-connectivity runs against the healthy warm pool instances."""
+    action_get.return_value = {"pool": True}
+    pool = {
+        "nodes": {
+            "node1": {"instance": "uuid1", "healthy": True},
+            "node2": {"instance": "uuid2", "healthy": False},
+        },
+        "healthy": 1,
+    }
+    results = [("uuid1", {"host": "node1", "ping": ""})]
+    with mock.patch("charm.pool_status", return_value=pool), mock.patch(
+        "charm.iter_test_connectivity", return_value=iter(results)
+    ) as iter_test_connectivity:
+        with mock_juju_action("test-connectivity"):
+            charm.on.test_connectivity_action.emit()
+
+    assert iter_test_connectivity.call_args.args[0] == ["uuid1"]
+    action_set.assert_called_with(
+        {"pool": json.dumps(pool, indent=2, sort_keys=True), "uuid1": results[0][1]}
+    )
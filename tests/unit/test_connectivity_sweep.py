@@ -0,0 +1,43 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for the connectivity sweep."""
+
+import asyncio
+from unittest import mock
+from unittest.mock import MagicMock
+
+import connectivity_sweep
+
+PING = "3 packets transmitted, 3 received, 0% packet loss\nrtt min/avg/max/mdev = 0.1/0.4/0.9/0.1"
+
+
+def mock_server(id_, name, host, status="ACTIVE"):
+    """Return mocked server object."""
+    server = MagicMock()  # name needs to be set with configure_mock
+    server.configure_mock(id=id_, name=name, compute_host=host, status=status)
+    return server
+
+
+def test_sweep_records_failed_probe():
+    """Test a failed probe counts as full loss without aborting the sweep."""
+    conn = MagicMock()
+    conn.compute.servers.return_value = [
+        mock_server("srv1", "prefix-1", "node1"),
+        mock_server("srv2", "prefix-2", "node2"),
+        mock_server("srv3", "prefix-3", "node3", status="SHUTOFF"),
+        mock_server("srv4", "other-4", "node4"),
+    ]
+
+    async def probe(servers, cloud_name, return_exceptions):
+        assert return_exceptions
+        return [
+            OSError("no route to host") if srv.compute_host == "node2" else {"ping": PING}
+            for srv in servers
+        ]
+
+    with mock.patch.object(connectivity_sweep, "con", return_value=conn), mock.patch.object(
+        connectivity_sweep, "async_probe_servers", probe
+    ):
+        samples = asyncio.run(connectivity_sweep.async_sweep(name_prefix="prefix"))
+
+    assert samples == {"node1": (0.0, 0.4), "node2": (100.0, None)}
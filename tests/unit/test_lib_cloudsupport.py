@@ -3,10 +3,13 @@
 # Copyright 2022 Canonical Ltd.
 # See LICENSE file for licensing details.
 """Unittests for lib-cloudsupport."""
+
 from unittest import mock
 from unittest.mock import MagicMock, call
 
+import lib_cloudsupport
 import pytest
+import results_db
 from lib_cloudsupport import CloudSupportHelper
 from openstack.exceptions import SDKException
 from os_testing import CloudSupportError
@@ -19,6 +22,17 @@ def mock_service(name, status):
     return service
 
 
+def side_effects_by_id(servers, side_effects):
+    """Map side effects to servers, calls may happen in any order."""
+    effects = {server.id: effect for server, effect in zip(servers, side_effects)}
+
+    def side_effect(server_id):
+        if effects.get(server_id) is not None:
+            raise effects[server_id]
+
+    return side_effect
+
+
 def mock_vm(id_, name=None):
     """Return mocked VM object."""
     name = name or "vm-{}".format(id_)
@@ -59,6 +73,56 @@ def test_stop_vms_compute_node_not_disabled():
             helper.stop_vms("test-node")
 
 
+def test_evacuate_node_compute_node_not_disabled():
+    """Try to evacuate an enabled compute-node."""
+    helper = CloudSupportHelper(MagicMock(), MagicMock())
+    with mock.patch.object(helper, "_check_compute_node", return_value=False):
+        with pytest.raises(CloudSupportError):
+            helper.iter_evacuate_node("test-node")
+
+
+def test_iter_evacuate_node(openstack):
+    """Test evacuate-node migrates the running VMs to the enabled hosts only."""
+    helper = CloudSupportHelper(MagicMock(), MagicMock())
+    active, shutoff = mock_vm(1), mock_vm(2)
+    active.status, shutoff.status = "ACTIVE", "SHUTOFF"
+    openstack.compute.servers.return_value = [active, shutoff]
+    hypervisors = []
+    for name, status, state in (
+        ("test-node", "disabled", "up"),
+        ("node3", "enabled", "up"),
+        ("node2", "enabled", "up"),
+        ("node4", "disabled", "up"),
+        ("node5", "enabled", "down"),
+    ):
+        hypervisor = MagicMock(status=status, state=state)
+        hypervisor.name = name
+        hypervisors.append(hypervisor)
+    openstack.compute.hypervisors.return_value = hypervisors
+    with mock.patch.object(helper, "_check_compute_node", return_value=True):
+        with mock.patch.object(
+            lib_cloudsupport.os_testing,
+            "iter_evacuate_servers",
+            return_value=iter([(1, {"destination": "node2"})]),
+        ) as evacuate:
+            results = list(helper.iter_evacuate_node("test-node", cloud_name="test-cloud"))
+
+    openstack.compute.servers.assert_called_once_with(host="test-node", all_tenants=True)
+    evacuate.assert_called_once_with(
+        [active],
+        "test-node",
+        ["node2", "node3"],
+        max_concurrent=4,
+        retries=2,
+        wait=900,
+        cloud_name="test-cloud",
+    )
+    assert results == [
+        (2, {"skipped": "cannot live-migrate a VM in status SHUTOFF"}),
+        (1, {"destination": "node2"}),
+    ]
+
+
 @pytest.mark.parametrize(
     "servers, servers_side_effects, exp_stopped, exp_failed",
     [
@@ -72,14 +136,16 @@ def test_stop_vms(openstack, servers, servers_side_effects, exp_stopped, exp_fai
     """Test stop-vms helper function."""
     helper = CloudSupportHelper(MagicMock(), MagicMock())
     openstack.compute.servers.return_value = servers
-    openstack.compute.stop_server.side_effect = servers_side_effects
+    openstack.compute.stop_server.side_effect = side_effects_by_id(servers, servers_side_effects)
     with mock.patch.object(helper, "_check_compute_node", return_value=True):
         stopped_vms, failed_to_stop = helper.stop_vms("test-node")
 
     openstack.compute.servers.assert_called_once_with(
         host="test-node", all_tenants=True, status="ACTIVE"
     )
-    openstack.compute.stop_server.assert_has_calls([call(server.id) for server in servers])
+    openstack.compute.stop_server.assert_has_calls(
+        [call(server.id) for server in servers], any_order=True
+    )
 
     assert stopped_vms == exp_stopped
     assert failed_to_stop == exp_failed
@@ -115,16 +181,201 @@ def test_start_vms(
     """Test start-vms helper function."""
     helper = CloudSupportHelper(MagicMock(), MagicMock())
     openstack.compute.servers.return_value = servers
-    openstack.compute.start_server.side_effect = servers_side_effects
+    openstack.compute.start_server.side_effect = side_effects_by_id(
+        [server for server in servers if force_all or server.id in stopped_vms],
+        servers_side_effects,
+    )
     started_vms, failed_to_start = helper.start_vms("test-node", stopped_vms, force_all)
 
     openstack.compute.servers.assert_called_once_with(
         host="test-node", all_tenants=True, status="SHUTOFF"
     )
     if force_all:
-        openstack.compute.start_server.assert_has_calls([call(server.id) for server in servers])
+        openstack.compute.start_server.assert_has_calls(
+            [call(server.id) for server in servers], any_order=True
+        )
     else:
-        openstack.compute.start_server.assert_has_calls([call(server) for server in stopped_vms])
+        openstack.compute.start_server.assert_has_calls(
+            [call(server) for server in stopped_vms], any_order=True
+        )
 
     assert started_vms == exp_started
     assert failed_to_start == exp_failed
+
+
+def test_connectivity_history_without_db(tmp_path):
+    """Test connectivity history before any sweep ran."""
+    helper = CloudSupportHelper(MagicMock(), MagicMock())
+    with mock.patch.object(results_db, "DB_PATH", tmp_path / "results.db"):
+        with pytest.raises(CloudSupportError):
+            helper.connectivity_history(24)
+
+
+def test_render_sweep_timer(tmp_path):
+    """Test the sweep timer is rendered and enabled."""
+    model = MagicMock()
+    model.config = {
+        "cloud-name": "cloud1",
+        "connectivity-sweep-interval": 10,
+        "connectivity-sweep-sample": 2,
+        "connectivity-sweep-retention-days": 30,
+        "name-prefix": "test-prefix",
+    }
+    helper = CloudSupportHelper(model, "/charm")
+    with mock.patch.object(lib_cloudsupport.Paths, "SYSTEMD_DIR", tmp_path), mock.patch.object(
+        lib_cloudsupport, "subprocess"
+    ), mock.patch.object(lib_cloudsupport, "host") as host:
+        helper.render_sweep_timer()
+
+    service = (tmp_path / "cloudsupport-sweep.service").read_text()
+    assert "--cloud-name cloud1" in service
+    assert "--sample 2 --retention-days 30" in service
+    assert "--name-prefix test-prefix" in service
+    assert "OnUnitActiveSec=10min" in (tmp_path / "cloudsupport-sweep.timer").read_text()
+    host.service.assert_called_once_with("enable", "cloudsupport-sweep.timer")
+
+
+def test_run_samples():
+    """Test per-host samples extracted from action results."""
+    create_results = [
+        ["success", "uuid1", "ok", "node1", 12.5],
+        ["error", "uuid2", "fault", None, 3.0],
+    ]
+    test_results = {
+        "uuid1": {
+            "host": "node1",
+            "ping": "3 packets transmitted, 3 received, 0% packet loss, time 2003ms\n"
+            "rtt min/avg/max/mdev = 0.285/0.340/0.398/0.046 ms\n",
+            "ssh": "",
+        },
+        "uuid2": {"host": "node2", "ping": "3 packets transmitted, 0 received, 100% packet loss"},
+    }
+    assert lib_cloudsupport.boot_time_samples(create_results) == [("node1", "boot-time", 12.5)]
+    assert lib_cloudsupport.connectivity_samples(test_results) == [
+        ("node1", "loss", 0.0),
+        ("node1", "rtt", 0.34),
+        ("node2", "loss", 100.0),
+    ]
+    assert lib_cloudsupport.connectivity_samples({"warning": "No instances found"}) == []
+
+
+def test_canary_points():
+    """Test per-node points extracted from a rolling canary report."""
+    report = {
+        "node1": {"result": "pass", "instance": "uuid1", "boot-seconds": 20.0, "loss": 0.0},
+        "node2": {"result": "fail", "instance": "uuid2", "boot-seconds": 30.0, "rtt": None},
+        "node3": {"result": "skipped", "wave": 2},
+    }
+    assert lib_cloudsupport.canary_points(report) == [
+        ("node1", "uuid1", "boot-time", 20.0),
+        ("node1", "uuid1", "loss", 0.0),
+        ("node2", "uuid2", "boot-time", 30.0),
+    ]
+
+
+def test_record_run_prometheus_export(tmp_path):
+    """Test that action runs are exported with per-instance series."""
+    model = MagicMock()
+    model.config = {"prometheus-textfile-dir": str(tmp_path)}
+    helper = CloudSupportHelper(model, MagicMock())
+    create_results = [["success", "uuid1", "ok", "node1", 12.5]]
+    with mock.patch.object(results_db, "connect", return_value=results_db.connect(":memory:")):
+        helper.record_run(
+            "create-test-instances",
+            1700000000,
+            "success",
+            points=lib_cloudsupport.boot_time_points(create_results),
+        )
+        helper.record_run("stop-vms", 1700000000, "error", {"compute-node": "node1"})
+        history = results_db.RunHistory(results_db.connect.return_value)
+        assert [run["action"] for run in history.runs()] == ["stop-vms", "create-test-instances"]
+
+    metrics = (tmp_path / "cloudsupport-create-test-instances.prom").read_text()
+    assert (
+        'cloudsupport_boot_seconds{test="create-test-instances",host="node1",instance="uuid1"} '
+        "12.5" in metrics
+    )
+    metrics = (tmp_path / "cloudsupport-stop-vms.prom").read_text()
+    assert 'cloudsupport_action_success{test="stop-vms",host="node1"} 0.0' in metrics
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_render_stale_collector(tmp_path):
+    """Test the stale server collector timer is rendered and enabled."""
+    model = MagicMock()
+    model.config = {
+        "cloud-name": "cloud1",
+        "name-prefix": "cloudsupport-test-",
+        "stale-server-check": True,
+        "stale-check-clouds": "region1,region2",
+        "stale-collect-interval": 5,
+    }
+    helper = CloudSupportHelper(model, "/charm")
+    with mock.patch.object(lib_cloudsupport.Paths, "SYSTEMD_DIR", tmp_path), mock.patch.object(
+        lib_cloudsupport, "subprocess"
+    ), mock.patch.object(lib_cloudsupport, "host") as host, mock.patch.object(
+        lib_cloudsupport, "STALE_STATUS_FILE", str(tmp_path / "stale_servers.json")
+    ), mock.patch.object(
+        lib_cloudsupport, "NAGIOS_PLUGINS_DIR", "/plugins"
+    ):
+        helper.render_stale_collector()
+
+    service = (tmp_path / "cloudsupport-stale-collector.service").read_text()
+    assert "/plugins/stale_server_check.py --collect --cloud-name region1,region2" in service
+    assert "TimeoutStartSec=300" in service
+    assert "OnUnitActiveSec=5min" in (tmp_path / "cloudsupport-stale-collector.timer").read_text()
+    host.service.assert_called_once_with("enable", "cloudsupport-stale-collector.timer")
+
+
+def test_update_config_removes_stale_collector(tmp_path):
+    """Test disabling the stale server check removes its collector timer."""
+    model = MagicMock()
+    model.config = {"cloud-name": "cloud1", "stale-server-check": False}
+    helper = CloudSupportHelper(model, "/charm")
+    (tmp_path / "cloudsupport-stale-collector.service").write_text("")
+    (tmp_path / "cloudsupport-stale-collector.timer").write_text("")
+    with mock.patch.object(lib_cloudsupport.Paths, "SYSTEMD_DIR", tmp_path), mock.patch.object(
+        lib_cloudsupport, "subprocess"
+    ), mock.patch.object(lib_cloudsupport, "host") as host, mock.patch.object(
+        helper, "verify_config", return_value=False
+    ), mock.patch.object(
+        helper, "render_nrpe_checks"
+    ) as render_nrpe_checks, mock.patch.object(
+        helper, "render_sweep_timer"
+    ), mock.patch.object(
+        helper, "render_warm_pool_timer"
+    ):
+        helper.update_config()
+
+    render_nrpe_checks.assert_not_called()
+    host.service_stop.assert_called_once_with("cloudsupport-stale-collector.timer")
+    assert not list(tmp_path.iterdir())
+
+
+def test_render_warm_pool_timer(tmp_path):
+    """Test the warm pool timer is rendered when an aggregate is configured."""
+    model = MagicMock()
+    model.config = {
+        "cloud-name": "cloud1",
+        "warm-pool-aggregate": "pool-agg",
+        "warm-pool-interval": 5,
+        "warm-pool-max-age": 24,
+        "image": "cloudsupport-image",
+        "disk": 4,
+        "cidr": "192.168.99.0/24",
+        "name-prefix": "cloudsupport-test",
+        "key-name": None,
+    }
+    helper = CloudSupportHelper(model, "/charm")
+    with mock.patch.object(lib_cloudsupport.Paths, "SYSTEMD_DIR", tmp_path), mock.patch.object(
+        lib_cloudsupport, "subprocess"
+    ), mock.patch.object(lib_cloudsupport, "host"):
+        helper.render_warm_pool_timer()
+        service = (tmp_path / "cloudsupport-warm-pool.service").read_text()
+        assert "--aggregate pool-agg" in service
+        assert "--max-age-hours 24\n" in service
+        assert "TimeoutStartSec=300" in service
+
+        model.config["warm-pool-aggregate"] = ""
+        helper.render_warm_pool_timer()
+    assert not (tmp_path / "cloudsupport-warm-pool.service").exists()
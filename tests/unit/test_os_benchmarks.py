@@ -0,0 +1,574 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for os-benchmarks."""
+
+import asyncio
+import json
+import time
+from unittest import mock
+from unittest.mock import MagicMock
+
+import os_benchmarks
+import pytest
+from openstack.exceptions import NotFoundException, SDKException
+
+
+@pytest.mark.parametrize(
+    "values, exp_result",
+    [
+        ([], {}),
+        ([1.0], {"p50": 1.0, "p95": 1.0, "p99": 1.0}),
+        (list(range(1, 101)), {"p50": 50, "p95": 95, "p99": 99}),
+    ],
+)
+def test_percentiles(values, exp_result):
+    """Test nearest-rank percentiles."""
+    assert os_benchmarks.percentiles(values) == exp_result
+
+
+def mock_cloud_servers(status="ACTIVE", fault=None):
+    """Return a mocked connection whose servers reach status as soon as they are created."""
+    conn = MagicMock()
+    servers = {}
+
+    def create_server(name, **kwargs):
+        server = MagicMock(
+            id="uuid{}".format(len(servers)), compute_host="node1", status=status, fault=fault
+        )
+        servers[server.id] = server
+        return server
+
+    def get_server(server_id):
+        if server_id not in servers:
+            raise NotFoundException("gone")
+        return servers[server_id]
+
+    conn.compute.create_server.side_effect = create_server
+    conn.compute.servers.side_effect = lambda name: list(servers.values())
+    conn.compute.get_server.side_effect = get_server
+    conn.compute.delete_server.side_effect = servers.pop
+    return conn
+
+
+def test_scheduler_load_test_timing():
+    """Test launches are timed from their own submission, not from the end of the step."""
+    conn = mock_cloud_servers()
+    with mock.patch.object(os_benchmarks, "con", return_value=conn), mock.patch.object(
+        os_benchmarks,
+        "async_ensure_test_resources",
+        mock.AsyncMock(return_value=(MagicMock(), None, MagicMock())),
+    ):
+        reports = os_benchmarks.scheduler_load_test(
+            ["node1"],
+            1,
+            512,
+            1,
+            "image",
+            "test",
+            "192.168.99.0/24",
+            start_rate=20.0,
+            rate_step=20.0,
+            max_rate=20.0,
+            step_duration=0.5,
+            interval=0.01,
+        )
+
+    (report,) = reports
+    assert report["launched"] == 10
+    assert report["active"] == 10
+    assert report["errors"] == 0
+    # the step submits for 0.5s, an instant boot must not pick up that delay
+    assert report["time-to-active"]["p95"] < 0.2
+    assert report["schedule-time"]["p95"] < 0.2
+    assert conn.compute.delete_server.call_count == 10
+
+
+def test_scheduler_load_test_waits_for_deletes():
+    """Test a step waits for its servers to be gone, and reports the failed deletes."""
+    conn = mock_cloud_servers()
+    delete_server = conn.compute.delete_server.side_effect
+
+    def delete_failing(server_id):
+        if server_id == "uuid0":
+            raise SDKException("delete refused")
+        delete_server(server_id)
+
+    conn.compute.delete_server.side_effect = delete_failing
+    with mock.patch.object(os_benchmarks, "con", return_value=conn), mock.patch.object(
+        os_benchmarks,
+        "async_ensure_test_resources",
+        mock.AsyncMock(return_value=(MagicMock(), None, MagicMock())),
+    ):
+        reports = os_benchmarks.scheduler_load_test(
+            ["node1"],
+            1,
+            512,
+            1,
+            "image",
+            "test",
+            "192.168.99.0/24",
+            start_rate=20.0,
+            rate_step=20.0,
+            max_rate=40.0,
+            step_duration=0.1,
+            interval=0.01,
+        )
+
+    assert len(reports) == 2
+    assert reports[0]["delete-errors"] == ["uuid0: delete refused"]
+    assert "delete-errors" not in reports[1]
+    # every server deleted was polled until gone
+    polled = {call.args[0] for call in conn.compute.get_server.call_args_list}
+    deleted = {call.args[0] for call in conn.compute.delete_server.call_args_list}
+    assert polled == deleted - {"uuid0"}
+
+
+def test_step_report():
+    """Test the aggregation of the launches of a step."""
+    launches = []
+    for active, error in (
+        (1.0, None),
+        (3.0, None),
+        (None, "No valid host was found"),
+        (None, "x"),
+    ):
+        launch = os_benchmarks._Launch()
+        launch.scheduled = 0.5 if active else None
+        launch.active = active
+        launch.error = error
+        launches.append(launch)
+
+    report = os_benchmarks._step_report(2.0, launches)
+
+    assert report == {
+        "rate": 2.0,
+        "launched": 4,
+        "active": 2,
+        "no-valid-host": 1,
+        "errors": 2,
+        "schedule-time": {"p50": 0.5, "p95": 0.5, "p99": 0.5},
+        "time-to-active": {"p50": 1.0, "p95": 3.0, "p99": 3.0},
+    }
+
+
+def test_parse_fio():
+    """Test parsing of fio json output."""
+    output = json.dumps(
+        {
+            "jobs": [
+                {
+                    "read": {
+                        "io_bytes": 4096,
+                        "iops": 1000.04,
+                        "bw": 4000.0,
+                        "clat_ns": {"percentile": {"50.000000": 500000, "99.000000": 2000000}},
+                    },
+                    "write": {"io_bytes": 0, "iops": 0, "bw": 0},
+                }
+            ]
+        }
+    )
+    assert os_benchmarks.parse_fio(output) == {
+        "iops": 1000.0,
+        "bw-kib": 4000.0,
+        "lat-p50-ms": 0.5,
+        "lat-p99-ms": 2.0,
+    }
+
+
+@pytest.mark.parametrize(
+    "host, volume_type, exp_backend",
+    [
+        ("cinder@ceph-ssd#ceph", "fast", "ceph-ssd"),
+        (None, "fast", "fast"),
+        (None, None, "volume"),
+    ],
+)
+def test_volume_backend(host, volume_type, exp_backend):
+    """Test backend name of a volume."""
+    volume = MagicMock(host=host, volume_type=volume_type)
+    assert os_benchmarks.volume_backend(volume) == exp_backend
+
+
+def mock_cinder(failing_servers=(), attach_delay=0, volume_status="available"):
+    """Return a mocked connection tracking the status of the volumes it creates."""
+    conn = MagicMock()
+    volumes = {}
+
+    def create_volume(name, size, **kwargs):
+        volumes[name] = volume_status
+        return MagicMock(id=name)
+
+    def get_volume(volume_id):
+        if volume_id not in volumes:
+            raise NotFoundException("gone")
+        return MagicMock(id=volume_id, status=volumes[volume_id])
+
+    def attach(server_id, volume):
+        time.sleep(attach_delay)
+        volumes[volume] = "in-use"
+        if server_id in failing_servers:
+            raise SDKException("attach failed")
+
+    def detach(server_id, volume_id):
+        volumes[volume_id] = "available"
+
+    conn.block_storage.create_volume.side_effect = create_volume
+    conn.block_storage.get_volume.side_effect = get_volume
+    conn.block_storage.delete_volume.side_effect = volumes.pop
+    conn.compute.create_volume_attachment.side_effect = attach
+    conn.compute.delete_volume_attachment.side_effect = detach
+
+    def get_server(server_id):
+        server = MagicMock(id=server_id, compute_host=server_id.replace("srv", "node"))
+        server.configure_mock(name=server_id)
+        return server
+
+    conn.compute.get_server.side_effect = get_server
+    conn.volumes = volumes
+    return conn
+
+
+def test_volume_latency_probe():
+    """Test every volume is cycled through all phases, timed and reported per host."""
+    conn = mock_cinder(attach_delay=0.05)
+    with mock.patch.object(os_benchmarks, "con", return_value=conn):
+        report = os_benchmarks.volume_latency_probe(count=3, instance=["srv1", "srv2"])
+
+    assert sorted(report) == ["node1", "node2"]
+    assert report["node1"]["volumes"] == 2
+    assert report["node2"]["volumes"] == 1
+    assert report["node1"]["errors"] == 0
+    for phase in os_benchmarks.VOLUME_PHASES:
+        assert set(report["node1"][phase]) == {"p50", "p95", "p99"}
+    # each phase is timed on its own, only the attach call is slow
+    assert report["node1"]["attach"]["p50"] >= 0.05
+    assert report["node1"]["create"]["p99"] < 0.05
+    assert conn.volumes == {}
+
+
+def test_volume_latency_probe_cleans_up_failed_cycle():
+    """Test a volume whose attach failed is detached and deleted, and counted as error."""
+    conn = mock_cinder(failing_servers=["srv2"])
+    with mock.patch.object(os_benchmarks, "con", return_value=conn):
+        report = os_benchmarks.volume_latency_probe(count=2, instance=["srv1", "srv2"])
+
+    assert report["node1"]["errors"] == 0
+    assert report["node2"]["volumes"] == 1
+    assert report["node2"]["errors"] == 1
+    # only the phases before the failure are timed
+    assert set(report["node2"]["create"]) == {"p50", "p95", "p99"}
+    assert report["node2"]["attach"] == {}
+    # the failed volume was force-detached from its server and deleted
+    conn.compute.delete_volume_attachment.assert_any_call("srv2", mock.ANY)
+    assert conn.volumes == {}
+
+
+def test_volume_latency_probe_deletes_failed_volume():
+    """Test a volume that goes to error is deleted without being attached."""
+    conn = mock_cinder(volume_status="error")
+    with mock.patch.object(os_benchmarks, "con", return_value=conn):
+        report = os_benchmarks.volume_latency_probe(count=1, instance=["srv1"])
+
+    assert report["node1"]["errors"] == 1
+    assert report["node1"]["create"] == {}
+    conn.compute.create_volume_attachment.assert_not_called()
+    conn.block_storage.delete_volume.assert_called_once()
+    assert conn.volumes == {}
+
+
+def mock_guest():
+    """Return a mocked guest connection where fio is installed."""
+    guest = MagicMock()
+    guest.run.side_effect = lambda cmd, **kwargs: MagicMock(
+        ok=True, failed=False, stdout="/dev/vdc\n" if "readlink" in cmd else ""
+    )
+    return guest
+
+
+def test_benchmark_instance_finds_volume_by_serial():
+    """Test fio runs on the guest device of the volume serial, not on the nova device."""
+    conn = mock_cinder()
+    guest = mock_guest()
+    fio = mock.AsyncMock(return_value={})
+    with mock.patch.object(os_benchmarks, "con", return_value=conn), mock.patch.object(
+        os_benchmarks, "guest_connection", return_value=guest
+    ), mock.patch.object(os_benchmarks, "_async_run_fio", fio):
+        report = asyncio.run(
+            os_benchmarks._async_benchmark_instance(
+                "srv1", "net", ["randread"], 10, "1G", 10, None, "cloud1"
+            )
+        )
+
+    assert "error" not in report
+    guest.run.assert_any_call("readlink -f /dev/disk/by-id/virtio-srv1-fio", warn=True, hide=True)
+    assert fio.call_args_list[-1].args[1] == "/dev/vdc"
+    assert conn.volumes == {}
+
+
+def test_benchmark_instance_deletes_failed_volume():
+    """Test a volume that goes to error is deleted without being attached."""
+    conn = mock_cinder(volume_status="error")
+    with mock.patch.object(os_benchmarks, "con", return_value=conn), mock.patch.object(
+        os_benchmarks, "guest_connection", return_value=mock_guest()
+    ), mock.patch.object(os_benchmarks, "_async_run_fio", mock.AsyncMock(return_value={})):
+        report = asyncio.run(
+            os_benchmarks._async_benchmark_instance(
+                "srv1", "net", ["randread"], 10, "1G", 10, None, "cloud1"
+            )
+        )
+
+    assert "error" in report
+    conn.compute.create_volume_attachment.assert_not_called()
+    conn.block_storage.delete_volume.assert_called_once_with("srv1-fio")
+    assert conn.volumes == {}
+
+
+def mock_migration_cloud(conn, ports):
+    """Configure a mocked connection where live migrations complete at once."""
+    hosts = {"srv1": "node1", "srv2": "node2"}
+
+    def get_server(server_id):
+        return MagicMock(
+            id=server_id,
+            status="ACTIVE",
+            task_state=None,
+            compute_host=hosts[server_id],
+            hypervisor_hostname=hosts[server_id],
+            addresses={"cloudsupport-test-net": [{"addr": "10.0.0.1"}]},
+        )
+
+    def live_migrate(server_id, host, block_migration):
+        hosts[server_id] = host
+
+    conn.network.find_network.return_value = MagicMock(id="net1")
+    conn.network.ports.return_value = ports
+    conn.compute.get_server.side_effect = get_server
+    conn.compute.live_migrate_server.side_effect = live_migrate
+
+
+def mock_port(device_id, host):
+    """Return mocked instance port object."""
+    return MagicMock(device_id=device_id, device_owner="compute:nova", binding_host_id=host)
+
+
+@pytest.fixture
+def ping_node(monkeypatch):
+    """Mock the connection to the node running the ping."""
+    monkeypatch.setattr(os_benchmarks, "MIGRATION_INTERVAL", 0)
+    monkeypatch.setattr(os_benchmarks, "is_ovn_used", lambda host, cloud_name: True)
+    node = MagicMock()
+    node.sudo.return_value = MagicMock(
+        ok=True, stdout="1000 packets transmitted, 990 received, 1% packet loss"
+    )
+    with mock.patch.object(os_benchmarks, "node_connection", return_value=node) as connection:
+        yield connection
+
+
+def test_live_migration_benchmark_pings_from_stable_host(openstack, ping_node):
+    """Test the ping runs from the netns of a hypervisor whose instance is not migrated."""
+    ports = [mock_port("srv1", "node1"), mock_port("srv2", "node2"), mock_port("srv3", "node3")]
+    mock_migration_cloud(openstack, ports)
+    with mock.patch.object(os_benchmarks, "con", return_value=openstack):
+        results = os_benchmarks.live_migration_benchmark(
+            ["node1", "node4"], instance=["srv1", "srv2"], max_concurrent=2
+        )
+
+    assert {call.args[0] for call in ping_node.call_args_list} == {"node3"}
+    ping_cmd = ping_node.return_value.sudo.call_args_list[0].args[0]
+    assert ping_cmd.startswith("ip netns exec ovnmeta-net1 ping")
+    assert results["instances"]["srv1"]["destination"] == "node4"
+    assert results["instances"]["srv1"]["downtime"] == 0.1
+    assert results["instances"]["srv2"]["destination"] == "node4"
+    assert results["summary"]["node2->node4"]["migrations"] == 1
+
+
+def test_live_migration_benchmark_without_stable_host(openstack, ping_node):
+    """Test instances are migrated without ping when all instances move."""
+    mock_migration_cloud(openstack, [mock_port("srv1", "node1")])
+    with mock.patch.object(os_benchmarks, "con", return_value=openstack):
+        results = os_benchmarks.live_migration_benchmark(["node2"], instance=["srv1"])
+
+    ping_node.assert_not_called()
+    result = results["instances"]["srv1"]
+    assert "duration" in result
+    assert "downtime" not in result
+    assert result["downtime-error"] == "no hypervisor outside the migration to ping from"
+
+
+@pytest.mark.parametrize(
+    "output, exp_result",
+    [
+        (
+            "--- 10.0.0.5 ping statistics ---\n"
+            "1200 packets transmitted, 1150 received, 4.16667% packet loss, time 12011ms\n",
+            (1200, 1150, 0.5),
+        ),
+        ("ping: connect: Network is unreachable\n", None),
+    ],
+)
+def test_ping_downtime(output, exp_result):
+    """Test downtime estimation from ping summary."""
+    assert os_benchmarks.ping_downtime(output) == exp_result
+
+
+DOMAIN_XML = """<domain type='kvm'>
+  <vcpu placement='static'>2</vcpu>
+  <cputune>
+    <vcpupin vcpu='0' cpuset='{pin0}'/>
+    <vcpupin vcpu='1' cpuset='{pin1}'/>
+  </cputune>
+  <numatune>
+    <memory mode='strict' nodeset='0'/>
+    <memnode cellid='0' mode='strict' nodeset='0'/>
+  </numatune>
+  <memoryBacking>
+    <hugepages>
+      <page size='{page}' unit='KiB'/>
+    </hugepages>
+  </memoryBacking>
+</domain>"""
+
+
+@pytest.mark.parametrize(
+    "pin0, pin1, page, host_output, exp_issues",
+    [
+        ("4", "36", 1048576, "4 4,36 node0\n36 4,36 node0\n", []),
+        ("4", "4", 1048576, "4 4,36 node0\n", ["vcpus share host cpus", "whole cores"]),
+        ("4-5", "36", 1048576, "", ["not pinned 1:1"]),
+        ("8", "40", 1048576, "8 8,40 node1\n40 8,40 node1\n", ["cpus on numa nodes [1]"]),
+        ("4", "36", 2048, "4 4,36 node0\n36 4,36 node0\n", ["1G hugepages"]),
+    ],
+)
+def test_check_vnf_placement(pin0, pin1, page, host_output, exp_issues):
+    """Test pinning, numa and hugepage checks of a libvirt domain."""
+    domain = os_benchmarks.parse_domain(DOMAIN_XML.format(pin0=pin0, pin1=pin1, page=page))
+    issues = os_benchmarks.check_vnf_placement(domain, os_benchmarks.parse_host_cpus(host_output))
+    assert len(issues) == len(exp_issues)
+    for issue, exp_issue in zip(issues, exp_issues):
+        assert exp_issue in issue
+
+
+@pytest.mark.parametrize(
+    "cpuset, exp_cpus", [("4", {4}), ("0-3,8", {0, 1, 2, 3, 8}), ("0-3,^2", {0, 1, 3})]
+)
+def test_parse_cpuset(cpuset, exp_cpus):
+    """Test parsing of cpu lists."""
+    assert os_benchmarks.parse_cpuset(cpuset) == exp_cpus
+
+
+@pytest.mark.parametrize(
+    "output, exp_rate",
+    [
+        ("8589934592 bytes (8.6 GB, 8.0 GiB) copied, 0.5 s, 17.2 GB/s", 17200.0),
+        ("1073741824 bytes (1,1 GB, 1,0 GiB) copied, 1,2 s, 895 MB/s", 895.0),
+        ("dd: error", None),
+    ],
+)
+def test_parse_dd_rate(output, exp_rate):
+    """Test parsing of the dd transfer rate."""
+    assert os_benchmarks.parse_dd_rate(output) == exp_rate
+
+
+def test_flag_deviations():
+    """Test that instances slower than the median are flagged."""
+    reports = {
+        "uuid1": {"cpu-mbps": 500.0, "mem-mbps": 10000.0, "issues": []},
+        "uuid2": {"cpu-mbps": 480.0, "mem-mbps": 9800.0, "issues": []},
+        "uuid3": {"cpu-mbps": 300.0, "mem-mbps": 10100.0, "issues": []},
+    }
+    os_benchmarks.flag_deviations(reports, threshold=20)
+    assert reports["uuid1"]["issues"] == []
+    assert reports["uuid2"]["issues"] == []
+    assert reports["uuid3"]["issues"] == ["cpu-mbps 300.0 is 38% below the median 480.0"]
+
+
+@pytest.mark.parametrize(
+    "output, exp_result",
+    [
+        (json.dumps({"end": {"sum_received": {"bits_per_second": 9.41e9}}}), {"gbps": 9.41}),
+        (
+            json.dumps(
+                {
+                    "end": {
+                        "sum": {
+                            "packets": 2000000,
+                            "lost_packets": 0,
+                            "lost_percent": 0.0,
+                            "seconds": 10.0,
+                        }
+                    }
+                }
+            ),
+            {"kpps": 200.0, "loss-pct": 0.0},
+        ),
+        (
+            json.dumps({"error": "unable to connect to server"}),
+            {"error": "unable to connect to server"},
+        ),
+    ],
+)
+def test_parse_iperf(output, exp_result):
+    """Test parsing of iperf3 json output."""
+    assert os_benchmarks.parse_iperf(output) == exp_result
+
+
+def test_summarize_sriov():
+    """Test per-physnet and per-host summary of the pair results."""
+    pairs = {
+        "physnet1": [
+            {"from": "node1", "to": "node2", "gbps": 9.0, "kpps": 1000.0, "loss-pct": 0.1},
+            {"from": "node2", "to": "node1", "gbps": 5.0, "kpps": 800.0, "loss-pct": 0.0},
+            {"from": "node3", "to": "node1", "error": "timeout"},
+        ]
+    }
+    summary = os_benchmarks._summarize_sriov(pairs)["physnet1"]
+    assert summary["pairs"] == 3
+    assert summary["failed"] == 1
+    assert summary["min-gbps"] == 5.0
+    assert summary["median-gbps"] == 7.0
+    assert summary["hosts"]["node1"] == {
+        "tx-gbps": 9.0,
+        "tx-kpps": 1000.0,
+        "rx-gbps": 5.0,
+        "rx-kpps": 800.0,
+    }
+
+
+def test_east_west_matrix():
+    """Test that all agents run and the results are rendered as a matrix."""
+    servers = {}
+    for i, host in enumerate(["node1", "node2", "node2"]):
+        srv = MagicMock(id="{}0000000-uuid".format(i), compute_host=host)
+        srv.addresses = {os_benchmarks.TEST_NETWORK: [{"addr": "10.0.0.{}".format(i)}]}
+        servers[srv.id] = srv
+    ok = "3 packets transmitted, 3 received, 0% packet loss, time 2003ms rtt min/avg/max/mdev = 0.2/0.5/0.9/0.1 ms"
+    lost = "3 packets transmitted, 0 received, 100% packet loss, time 2003ms"
+
+    async def run_agent(srv, net, peers, count, cloud_name):
+        if srv.id.startswith("2"):
+            raise Exception("ssh failed")
+        return os_benchmarks.parse_probe_agent(
+            "\n".join("{}|{}".format(p, lost if p == "10.0.0.2" else ok) for p in peers)
+        )
+
+    with mock.patch.object(
+        os_benchmarks, "async_get_instances", mock.AsyncMock(return_value=list(servers))
+    ), mock.patch.object(os_benchmarks, "con") as con, mock.patch.object(
+        os_benchmarks, "_async_run_probe_agent", side_effect=run_agent
+    ):
+        con.return_value.compute.get_server.side_effect = servers.get
+        results = os_benchmarks.east_west_matrix(count=3)
+
+    assert results["matrix"].splitlines() == [
+        "src\\dst   00000000  10000000  20000000",
+        "00000000  -         0%/0.50   100%/-",
+        "10000000  0%/0.50   -         100%/-",
+        "20000000  ?         ?         -",
+    ]
+    assert results["summary"]["node1 -> node2"] == {
+        "pairs": 2,
+        "max-loss": 100.0,
+        "median-rtt": 0.5,
+    }
+    assert results["failed"] == {"20000000-uuid": "ssh failed"}
@@ -0,0 +1,169 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for the rolling canary."""
+
+import asyncio
+from unittest import mock
+from unittest.mock import MagicMock
+
+import os_canary
+import pytest
+from openstack.exceptions import NotFoundException
+from os_testing import CloudSupportError
+
+PASS_PING = (
+    "3 packets transmitted, 3 received, 0% packet loss\nrtt min/avg/max/mdev = 0.1/0.4/0.9/0.1"
+)
+FAIL_PING = "3 packets transmitted, 0 received, 100% packet loss"
+SSH_OPEN = "Connection to 192.168.99.10 22 port [tcp/ssh] succeeded!"
+
+
+def mock_service(host, zone="nova", status="enabled", state="up"):
+    """Return mocked nova-compute service object."""
+    return MagicMock(host=host, availability_zone=zone, status=status, state=state)
+
+
+@pytest.fixture
+def cloud():
+    """Mock openstack connection, servers booting on the node they are forced onto."""
+    conn = MagicMock()
+    servers = {}
+
+    def create_server(name, availability_zone, **kwargs):
+        node = availability_zone.split(":")[1]
+        servers[name] = MagicMock(id=name, status="ACTIVE", compute_host=node)
+        return servers[name]
+
+    def get_server(server_id):
+        if server_id not in servers:
+            raise NotFoundException("gone")
+        return servers[server_id]
+
+    conn.compute.create_server.side_effect = create_server
+    conn.compute.get_server.side_effect = get_server
+    conn.compute.delete_server.side_effect = servers.pop
+    conn.compute.services.return_value = [
+        mock_service("node3", "az2"),
+        mock_service("node1", "az1"),
+        mock_service("node2", "az1"),
+        mock_service("node4", "az1", status="disabled"),
+        mock_service("node5", "az2", state="down"),
+    ]
+    conn.compute.find_aggregate.return_value = MagicMock(hosts=["node2", "node3", "node5"])
+    with mock.patch.object(os_canary, "con", return_value=conn), mock.patch.object(
+        os_canary, "ensure_net", return_value=(True, MagicMock(id="net1"))
+    ), mock.patch.object(os_canary, "ensure_sg_rules"), mock.patch.object(
+        os_canary, "ensure_flavor"
+    ):
+        yield conn
+
+
+def probe_results(failing=()):
+    """Return an async_probe_servers replacement failing the ping of the given nodes."""
+
+    async def probe(servers, cloud_name):
+        return [
+            {
+                "host": srv.compute_host,
+                "ping": FAIL_PING if srv.compute_host in failing else PASS_PING,
+                "ssh": SSH_OPEN,
+            }
+            for srv in servers
+        ]
+
+    return probe
+
+
+def test_split_waves():
+    """Test nodes are split into waves of the given size, in order."""
+    assert os_canary.split_waves(["n1", "n2", "n3", "n4", "n5"], 2) == [
+        ["n1", "n2"],
+        ["n3", "n4"],
+        ["n5"],
+    ]
+    assert os_canary.split_waves([], 2) == []
+
+
+@pytest.mark.parametrize(
+    "zone, aggregate, exp_nodes",
+    [
+        (None, None, {"node1": "az1", "node2": "az1", "node3": "az2"}),
+        ("az1", None, {"node1": "az1", "node2": "az1"}),
+        (None, "agg1", {"node2": "az1", "node3": "az2"}),
+        ("az1", "agg1", {"node2": "az1"}),
+    ],
+)
+def test_select_nodes(cloud, zone, aggregate, exp_nodes):
+    """Test only the enabled and up nodes of the zone and aggregate are selected."""
+    assert asyncio.run(os_canary.async_select_nodes(zone, aggregate)) == exp_nodes
+
+
+def test_select_nodes_unknown_aggregate(cloud):
+    """Test an unknown aggregate is an error."""
+    cloud.compute.find_aggregate.return_value = None
+    with pytest.raises(CloudSupportError):
+        list(os_canary.iter_rolling_canary("image", 4, "192.168.99.0/24", "test", aggregate="x"))
+
+
+def test_rolling_canary(cloud):
+    """Test every node is tested in its wave and its canary deleted."""
+    with mock.patch.object(os_canary, "async_probe_servers", probe_results(failing=["node2"])):
+        report = dict(
+            os_canary.iter_rolling_canary(
+                "image",
+                4,
+                "192.168.99.0/24",
+                "test",
+                wave_size=2,
+                max_in_flight=1,
+                probe_wait=0,
+            )
+        )
+
+    assert {node: result["wave"] for node, result in report.items()} == {
+        "node1": 1,
+        "node2": 1,
+        "node3": 2,
+    }
+    assert report["node1"]["result"] == "pass"
+    assert report["node1"]["instance"] == "test-canary-node1"
+    assert report["node1"]["rtt"] == 0.4
+    assert report["node2"]["result"] == "fail"
+    assert report["node2"]["stage"] == "probe"
+    assert report["node2"]["error"] == "no ping reply"
+    assert cloud.compute.delete_server.call_count == 3
+    assert cloud.compute.create_server.call_args.kwargs["availability_zone"] == "az2:node3"
+
+    summary = os_canary.canary_summary(report)
+    assert summary["pass"] == ["node1", "node3"]
+    assert summary["fail"] == ["node2"]
+    assert summary["waves"] == 2
+    assert set(summary) >= {"boot-seconds", "probe-seconds", "delete-seconds", "seconds"}
+
+
+def test_rolling_canary_halts(cloud):
+    """Test the remaining waves are skipped once max_failures nodes failed."""
+    create_server = cloud.compute.create_server.side_effect
+
+    def create_error(**kwargs):
+        server = create_server(**kwargs)
+        server.status = "ERROR"
+        return server
+
+    cloud.compute.create_server.side_effect = create_error
+    with mock.patch.object(os_canary, "async_probe_servers", probe_results()):
+        report = dict(
+            os_canary.iter_rolling_canary(
+                "image", 4, "192.168.99.0/24", "test", wave_size=1, max_failures=1
+            )
+        )
+
+    assert report["node1"]["result"] == "fail"
+    assert report["node1"]["stage"] == "boot"
+    assert report["node2"] == {
+        "result": "skipped",
+        "wave": 2,
+        "error": "halted after 1 failed nodes",
+    }
+    assert report["node3"]["result"] == "skipped"
+    assert cloud.compute.create_server.call_count == 1
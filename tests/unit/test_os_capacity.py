@@ -0,0 +1,146 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for os-capacity."""
+
+from unittest import mock
+
+import os_capacity
+from openstack.exceptions import HttpException
+
+PROVIDERS = [
+    {"uuid": "rp1", "name": "node1", "root_provider_uuid": "rp1"},
+    {"uuid": "rp1-numa0", "name": "node1_NUMA0", "root_provider_uuid": "rp1"},
+    {"uuid": "rp2", "name": "node2", "root_provider_uuid": "rp2"},
+    {"uuid": "rp3", "name": "ceph", "root_provider_uuid": "rp3"},
+]
+
+
+def inventory(total, reserved=0, ratio=1.0):
+    """Return a Placement inventory."""
+    return {"total": total, "reserved": reserved, "allocation_ratio": ratio}
+
+
+PLACEMENT = {
+    "/resource_providers": {"resource_providers": PROVIDERS},
+    "/resource_providers/rp1/inventories": {
+        "inventories": {
+            "VCPU": inventory(16, ratio=2.0),
+            "MEMORY_MB": inventory(65536, reserved=4096),
+            "DISK_GB": inventory(500),
+        }
+    },
+    "/resource_providers/rp1/usages": {"usages": {"VCPU": 28, "MEMORY_MB": 8192, "DISK_GB": 40}},
+    "/resource_providers/rp1-numa0/inventories": {
+        "inventories": {"PCPU": inventory(8), "CUSTOM_HUGEPAGES_1G": inventory(32)}
+    },
+    "/resource_providers/rp1-numa0/usages": {"usages": {"PCPU": 2, "CUSTOM_HUGEPAGES_1G": 4}},
+    "/resource_providers/rp2/inventories": {
+        "inventories": {
+            "VCPU": inventory(8),
+            "MEMORY_MB": inventory(2048),
+            "DISK_GB": inventory(10),
+        }
+    },
+    "/resource_providers/rp2/usages": {"usages": {"VCPU": 0}},
+    "/resource_providers/rp3/inventories": {"inventories": {"DISK_GB": inventory(10000)}},
+    "/resource_providers/rp3/usages": {"usages": {"DISK_GB": 100}},
+}
+
+
+def summary(resources):
+    """Return an allocation candidates provider summary from inventories and usages."""
+    return {
+        "resources": {
+            rc: {
+                "capacity": int((inv["total"] - inv["reserved"]) * inv["allocation_ratio"]),
+                "used": resources["usages"]["usages"].get(rc, 0),
+            }
+            for rc, inv in resources["inventories"]["inventories"].items()
+        }
+    }
+
+
+# the flavors fit on node1 only, which tree is summarized by the allocation candidates
+NODE1_SUMMARIES = {
+    "provider_summaries": {
+        uuid: summary(
+            {
+                "inventories": PLACEMENT["/resource_providers/{}/inventories".format(uuid)],
+                "usages": PLACEMENT["/resource_providers/{}/usages".format(uuid)],
+            }
+        )
+        for uuid in ("rp1", "rp1-numa0")
+    }
+}
+PLACEMENT["/allocation_candidates?resources=VCPU:2,MEMORY_MB:4096,DISK_GB:20"] = NODE1_SUMMARIES
+PLACEMENT["/allocation_candidates?resources=PCPU:2,MEMORY_MB:4096,DISK_GB:20"] = NODE1_SUMMARIES
+PLACEMENT["/allocation_candidates?resources=PCPU:2,MEMORY_MB:16384,DISK_GB:20"] = NODE1_SUMMARIES
+
+
+def placement_get(url, cloud_name, microversion=os_capacity.PLACEMENT_MICROVERSION):
+    """Return the mocked Placement response of a URL."""
+    return PLACEMENT[url]
+
+
+def test_capacity_report():
+    """Test free resources per node, nested providers and flavor fit."""
+    with mock.patch.object(os_capacity, "_placement_get", side_effect=placement_get) as get:
+        report = os_capacity.capacity_report(2, 4096, 20)
+
+    assert report["nodes"]["node1"] == {
+        "VCPU": 4,
+        "PCPU": 6,
+        "MEMORY_MB": 53248,
+        "DISK_GB": 460,
+        "HUGEPAGES": 28,
+        "used-pct": {
+            "VCPU": 87.5,
+            "PCPU": 25.0,
+            "MEMORY_MB": 13.3,
+            "DISK_GB": 8.0,
+            "HUGEPAGES": 12.5,
+        },
+        "fits": 2,
+    }
+    assert report["nodes"]["node2"]["fits"] == 0
+    assert report["summary"]["nodes"] == 2
+    assert report["summary"]["nodes-fitting"] == 1
+    assert report["summary"]["instances-fitting"] == 2
+    assert report["summary"]["full-nodes"] == ["node2"]
+    assert "ceph" not in report["nodes"]
+    # only the providers without a candidate are queried one by one
+    urls = [call.args[0] for call in get.call_args_list]
+    assert "/resource_providers/rp1/usages" not in urls
+    assert "/resource_providers/rp2/usages" in urls
+    assert len(urls) == 6
+
+    table = os_capacity.capacity_table(report["nodes"]).splitlines()
+    assert table[0].split() == [header for header, _ in os_capacity.TABLE_COLUMNS]
+    assert table[1].split() == ["node1", "4", "6", "53248", "460", "28", "2"]
+
+
+def test_capacity_report_pinned():
+    """Test that pinned flavors are fit against PCPU and hugepages."""
+    with mock.patch.object(os_capacity, "_placement_get", side_effect=placement_get):
+        report = os_capacity.capacity_report(2, 4096, 20, vnfspecs=True)
+    assert report["nodes"]["node1"]["fits"] == 3
+    assert report["summary"]["flavor"]["hugepages"] == 4
+
+    with mock.patch.object(os_capacity, "_placement_get", side_effect=placement_get):
+        report = os_capacity.capacity_report(2, 16384, 20, vnfspecs=True)
+    # 28 free 1G pages for 16 per instance
+    assert report["nodes"]["node1"]["fits"] == 1
+
+
+def test_capacity_report_old_placement():
+    """Test every provider is queried when allocation candidates are not available."""
+
+    def old_placement(url, cloud_name, microversion=os_capacity.PLACEMENT_MICROVERSION):
+        if url.startswith("/allocation_candidates"):
+            raise HttpException(http_status=406)
+        return PLACEMENT[url]
+
+    with mock.patch.object(os_capacity, "_placement_get", side_effect=old_placement):
+        report = os_capacity.capacity_report(2, 4096, 20, vnfspecs=True)
+    assert report["nodes"]["node1"]["fits"] == 3
+    assert report["summary"]["full-nodes"] == ["node2"]
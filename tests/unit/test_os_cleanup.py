@@ -0,0 +1,122 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for os-cleanup."""
+
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from unittest.mock import MagicMock
+
+import os_cleanup
+import pytest
+import warm_pool
+from openstack.exceptions import ConflictException, NotFoundException
+
+
+def mock_resource(id_, **kwargs):
+    """Return mocked OpenStack resource."""
+    resource = MagicMock()  # name needs to be set with configure_mock
+    resource.configure_mock(id=id_, **kwargs)
+    return resource
+
+
+@pytest.fixture
+def cloud():
+    """Mock openstack connection with leftover test resources."""
+    conn = MagicMock()
+    conn.compute.servers.return_value = [
+        mock_resource("srv1", name="cloudsupport-test-1", status="ERROR"),
+        mock_resource("srv2", name="cloudsupport-test-2", status="ACTIVE"),
+    ]
+    conn.compute.get_server.side_effect = NotFoundException()
+    conn.network.find_network.return_value = mock_resource("net1")
+    conn.network.ports.return_value = [
+        mock_resource("port1", device_id=""),
+        mock_resource("port2", device_id="srv2"),
+    ]
+    conn.compute.find_flavor.side_effect = lambda name: mock_resource(name)
+    conn.compute.find_aggregate.return_value = mock_resource("agg1", hosts=["node1", "node2"])
+    conn.network.find_security_group.return_value = mock_resource("sg1")
+    with mock.patch.object(os_cleanup, "con", return_value=conn):
+        yield conn
+
+
+def test_cleanup_keeps_used_resources(cloud):
+    """Test that only the ERROR servers and unbound ports go while a test server is left."""
+    results = os_cleanup.cleanup_test_artifacts("^cloudsupport-test-")
+
+    assert results["reclaimed"] == {"servers": ["srv1"], "ports": ["port1"]}
+    assert results["kept"] == "test servers left: cloudsupport-test-2"
+    cloud.compute.delete_server.assert_called_once_with("srv1")
+    cloud.network.delete_port.assert_called_once_with("port1")
+    cloud.compute.delete_flavor.assert_not_called()
+    cloud.network.delete_network.assert_not_called()
+
+
+def test_cleanup_all_servers(cloud):
+    """Test that everything is reclaimed once no test server is left."""
+    cloud.network.delete_network.side_effect = ConflictException("port in use")
+    results = os_cleanup.cleanup_test_artifacts("^cloudsupport-test-", all_servers=True)
+
+    assert results["reclaimed"] == {
+        "servers": ["srv1", "srv2"],
+        "ports": ["port1"],
+        "flavors": [
+            "cloudsupport-test-flavor",
+            "cloudsupport-prewarm-flavor",
+            "cloudsupport-pool-flavor",
+            "cloudsupport-canary-flavor",
+        ],
+        "aggregates": ["cloudsupport-test-agg"],
+        "security-groups": ["cloudsupport-test-secgroup"],
+    }
+    assert "port in use" in results["errors"]["cloudsupport-test-net"]
+    assert list(results["stages"]) == ["servers", "ports-flavors-aggregates", "secgroups-networks"]
+    assert cloud.compute.remove_host_from_aggregate.call_count == 2
+    cloud.compute.delete_aggregate.assert_called_once_with("agg1")
+
+
+def test_cleanup_keeps_recent_ports(cloud):
+    """Test that unbound ports of a boot in flight are kept during the grace period."""
+
+    def created_ago(seconds):
+        created = datetime.now(timezone.utc) - timedelta(seconds=seconds)
+        return created.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    cloud.network.ports.return_value = [
+        mock_resource("port1", device_id="", created_at=created_ago(3600)),
+        mock_resource("port3", device_id="", created_at=created_ago(30)),
+    ]
+    results = os_cleanup.cleanup_test_artifacts("^cloudsupport-test-")
+
+    assert results["reclaimed"]["ports"] == ["port1"]
+    cloud.network.delete_port.assert_called_once_with("port1")
+
+
+def test_cleanup_keeps_warm_pool(cloud):
+    """Test that the warm pool is not deleted and keeps the shared resources in use."""
+    pool_server = mock_resource("pool1", name="pool-cloudsupport-test-node1", status="ERROR")
+    cloud.compute.servers.side_effect = lambda name=None: [
+        srv
+        for srv in [
+            mock_resource("srv1", name="cloudsupport-test-1", status="ERROR"),
+            pool_server,
+        ]
+        if name is None or srv.name.startswith("cloudsupport-test")
+    ]
+    with mock.patch.object(warm_pool, "con", return_value=cloud):
+        results = os_cleanup.cleanup_test_artifacts(
+            "^cloudsupport-test-", all_servers=True, name_prefix="cloudsupport-test"
+        )
+
+    assert results["reclaimed"]["servers"] == ["srv1"]
+    assert results["kept"] == "test servers left: pool-cloudsupport-test-node1"
+    cloud.network.delete_network.assert_not_called()
+
+    with mock.patch.object(warm_pool, "con", return_value=cloud):
+        results = os_cleanup.cleanup_test_artifacts(
+            "^cloudsupport-test-", all_servers=True, name_prefix="cloudsupport-test", pool=True
+        )
+
+    assert sorted(results["reclaimed"]["servers"]) == ["pool1", "srv1"]
+    assert "kept" not in results
+    cloud.network.delete_network.assert_called_once_with("net1")
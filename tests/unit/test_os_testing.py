@@ -0,0 +1,347 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for os-testing."""
+
+import asyncio
+import threading
+import time
+from unittest import mock
+from unittest.mock import MagicMock
+
+import os_testing
+import pytest
+from openstack.exceptions import HttpException, ResourceFailure, SDKException
+
+
+def mock_server(id_, name, compute_host="node"):
+    """Return mocked server object."""
+    server = MagicMock()  # name needs to be set with configure_mock
+    server.configure_mock(id=id_, name=name, compute_host=compute_host)
+    return server
+
+
+def test_run_blocking_limits_in_flight(monkeypatch):
+    """Test that the shared semaphore bounds concurrent calls."""
+    monkeypatch.setattr(os_testing, "MAX_IN_FLIGHT", 2)
+    monkeypatch.setattr(os_testing, "_executor", None)
+    in_flight = []
+    peak = []
+
+    def blocking(i):
+        in_flight.append(i)
+        peak.append(len(in_flight))
+        time.sleep(0.01)
+        in_flight.remove(i)
+        return i
+
+    async def run_all():
+        return await asyncio.gather(*[os_testing.run_blocking(blocking, i) for i in range(6)])
+
+    assert asyncio.run(run_all()) == list(range(6))
+    assert max(peak) <= 2
+
+
+def test_run_worker_outside_limiter(monkeypatch):
+    """Test a long SSH command holds no API slot and a failing helper is not retried."""
+    monkeypatch.setattr(os_testing, "MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(os_testing, "_executor", None)
+    monkeypatch.setattr(os_testing, "_worker_executor", None)
+    released = threading.Event()
+    helper = MagicMock(side_effect=HttpException(http_status=503))
+
+    async def run_all():
+        ssh = asyncio.ensure_future(os_testing.run_worker(released.wait, 5))
+        api = await os_testing.run_blocking(lambda: "api")
+        released.set()
+        try:
+            await os_testing.run_worker(helper)
+        except HttpException:
+            pass
+        return api, await ssh
+
+    assert asyncio.run(run_all()) == ("api", True)
+    helper.assert_called_once_with()
+
+
+def test_boot_instance_failure_detail(openstack, monkeypatch):
+    """Test a failed boot reports its fault as a string, fit for action results."""
+
+    async def fail(*args, **kwargs):
+        raise ResourceFailure("No valid host was found")
+
+    monkeypatch.setattr(os_testing, "async_wait_for_status", fail)
+    openstack.compute.create_server.return_value = MagicMock(id="uuid1")
+    result = asyncio.run(
+        os_testing._async_boot_instance(
+            "test", MagicMock(), MagicMock(), MagicMock(), "net", None, None, "cloud1"
+        )
+    )
+
+    assert result[:4] == ["error", "uuid1", "No valid host was found", None]
+
+
+def test_iter_create_instance_reports_failed_boots(openstack, monkeypatch):
+    """Test a boot failing before its server exists does not abort the other boots."""
+    ports = iter([MagicMock(id="port1"), SDKException("port quota exceeded")])
+
+    def create_port(**kwargs):
+        port = next(ports)
+        if isinstance(port, Exception):
+            raise port
+        return port
+
+    async def ensure_test_resources(*args, **kwargs):
+        return MagicMock(), MagicMock(), MagicMock()
+
+    async def wait_for_status(fetch, server_id):
+        return MagicMock(id=server_id, compute_host="node1")
+
+    monkeypatch.setattr(os_testing, "async_ensure_test_resources", ensure_test_resources)
+    monkeypatch.setattr(os_testing, "async_wait_for_status", wait_for_status)
+    openstack.network.create_port.side_effect = create_port
+    openstack.compute.create_server.return_value = MagicMock(id="uuid1")
+
+    results = list(
+        os_testing.iter_create_instance(
+            ["node1", "node2"], 1, 512, 4, "image", "test", "192.168.99.0/24"
+        )
+    )
+
+    assert sorted(result[:4] for result in results) == [
+        ["error", None, "port quota exceeded", None],
+        ["success", "uuid1", "ok", "node1"],
+    ]
+
+
+def test_delete_instance(openstack):
+    """Test deleting matching instances on given nodes."""
+    openstack.compute.servers.return_value = [
+        mock_server(1, "cloudsupport-test-1"),
+        mock_server(2, "other-vm"),
+        mock_server(3, "cloudsupport-test-3", compute_host="other-node"),
+    ]
+    results = os_testing.delete_instance(["node"], "^cloudsupport-test-.*")
+
+    assert results == [["success", 1]]
+    openstack.compute.delete_server.assert_called_once_with(1)
+
+
+def test_get_instances_none_found(openstack):
+    """Test warning when there are no test instances."""
+    openstack.compute.servers.return_value = [mock_server(1, "other-vm")]
+    assert os_testing.get_instances() == {"warning": "No instances found"}
+
+
+def test_stop_servers_keeps_order(openstack):
+    """Test results are reported in the order of the given servers."""
+    servers = [mock_server(i, "vm-{}".format(i)) for i in range(5)]
+
+    def stop_server(server_id):
+        if server_id == 3:
+            raise SDKException()
+
+    openstack.compute.stop_server.side_effect = stop_server
+    stopped, failed = os_testing.stop_servers(servers)
+
+    assert stopped == [0, 1, 2, 4]
+    assert failed == [3]
+
+
+def test_iter_stop_servers_yields_as_completed(openstack):
+    """Test stop outcomes are yielded one by one."""
+    servers = [mock_server(i, "vm-{}".format(i)) for i in range(3)]
+    openstack.compute.stop_server.side_effect = lambda server_id: time.sleep(0.01 * server_id)
+    outcomes = os_testing.iter_stop_servers(servers)
+
+    assert next(outcomes) == (0, True)
+    assert sorted(outcomes) == [(1, True), (2, True)]
+
+
+def test_probe_mtu():
+    """Test path MTU from the largest don't-fragment payload."""
+    node = MagicMock()
+    node.sudo.return_value = MagicMock(stdout="1422\n")
+    assert os_testing._probe_mtu(node, "ovnmeta-net", "192.168.99.5") == 1450
+    cmd = node.sudo.call_args.args[0]
+    assert cmd.startswith("bash -c ") and "ip netns exec ovnmeta-net ping -q -M do" in cmd
+    node.sudo.return_value = MagicMock(stdout="0\n")
+    assert os_testing._probe_mtu(node, "ovnmeta-net", "192.168.99.5") is None
+
+
+def test_mtu_summary():
+    """Test per-compute path MTU summary."""
+    results = {
+        "uuid1": {"host": "node1", "path-mtu": 1500, "net-mtu": 1500},
+        "uuid2": {"host": "node1", "path-mtu": 1450, "net-mtu": 1500},
+        "uuid3": {"host": "node2", "path-mtu": 1500, "net-mtu": 1500},
+        "uuid4": {"host": "node3", "path-mtu": None, "net-mtu": 1500},
+        "uuid5": {"host": "node4", "ping": ""},
+    }
+    summary = os_testing.mtu_summary(results)
+    assert summary["node1"] == {
+        "net-mtu": 1500,
+        "instances": {"uuid1": 1500, "uuid2": 1450},
+        "path-mtu": 1450,
+        "mismatch": True,
+    }
+    assert summary["node2"]["mismatch"] is False
+    assert summary["node3"]["path-mtu"] is None and summary["node3"]["mismatch"] is True
+    assert "node4" not in summary
+
+
+CONSOLE_LOG = """\
+[    0.000000] Linux version 5.15.0-91-generic (buildd@lcy02-amd64-045)
+[    1.520000] Run /init as init process
+[    2.750000] systemd[1]: Inserted module 'autofs4'
+[    4.100000] cloud-init[512]: Cloud-init v. 23.3.3 running 'init-local' at Mon, 08 Jan 2024 10:00:04 +0000. Up 4.10 seconds.
+[    9.600000] cloud-init[640]: Cloud-init v. 23.3.3 running 'init' at Mon, 08 Jan 2024 10:00:09 +0000. Up 9.60 seconds.
+[   12.000000] cloud-init[801]: Cloud-init v. 23.3.3 running 'modules:config' at Mon, 08 Jan 2024 10:00:12 +0000. Up 12.00 seconds.
+[   15.500000] cloud-init[900]: Cloud-init v. 23.3.3 running 'modules:final' at Mon, 08 Jan 2024 10:00:15 +0000. Up 15.50 seconds.
+[   16.000000] cloud-init[900]: Cloud-init v. 23.3.3 finished at Mon, 08 Jan 2024 10:00:16 +0000. Datasource DataSourceOpenStackLocal [net,ver=2].  Up 16.00 seconds
+"""
+
+
+def test_boot_phases():
+    """Test that the console log markers are turned into phase durations."""
+    markers = os_testing.parse_boot_markers(CONSOLE_LOG)
+    assert markers["userspace"] == 1.52
+
+    assert os_testing.boot_phases(markers) == {
+        "kernel": 1.52,
+        "early-userspace": 2.58,
+        "dhcp-metadata": 5.5,
+        "init-modules": 2.4,
+        "config-services": 3.5,
+        "final-modules": 0.5,
+        "total": 16.0,
+    }
+    # a phase is only reported when both its markers are known
+    del markers["init"]
+    assert "dhcp-metadata" not in os_testing.boot_phases(markers)
+    assert "init-modules" not in os_testing.boot_phases(markers)
+
+
+def test_boot_phase_report(openstack):
+    """Test the per-node medians and the incomplete boots."""
+    partial = CONSOLE_LOG.split("\n[   15")[0]
+    logs = {
+        "uuid1": CONSOLE_LOG,
+        "uuid2": CONSOLE_LOG.replace("Up 9.60", "Up 19.60"),
+        "uuid3": partial,
+    }
+    openstack.compute.get_server_console_output.side_effect = lambda server: {
+        "output": logs[server]
+    }
+    created = [
+        ["success", "uuid1", "ok", "node1", 20.0],
+        ["success", "uuid2", "ok", "node1", 30.0],
+        ["success", "uuid3", "ok", "node2", 20.0],
+        ["error", "uuid4", "fault", None, 5.0],
+    ]
+
+    report = os_testing.boot_phase_report(created, wait=0)
+
+    assert report["nodes"]["node1"]["instances"] == 2
+    assert report["nodes"]["node1"]["dhcp-metadata"] == 10.5
+    assert "final-modules" not in report["nodes"]["node2"]
+    assert list(report["incomplete"]) == ["uuid3"]
+
+
+def test_iter_evacuate_servers_retries_on_other_host(openstack, monkeypatch):
+    """Test a failed migration is retried on the next destination."""
+    monkeypatch.setattr(os_testing, "MIGRATION_POLL_INTERVAL", 0)
+    moved = {1: "node2", 2: "node3"}
+
+    def live_migrate(server_id, host, block_migration):
+        if server_id == 2 and host is None:
+            raise SDKException("no valid host")
+
+    def get_server(server_id):
+        return MagicMock(status="ACTIVE", task_state=None, compute_host=moved[server_id])
+
+    openstack.compute.live_migrate_server.side_effect = live_migrate
+    openstack.compute.get_server.side_effect = get_server
+    servers = [MagicMock(id=1), MagicMock(id=2)]
+
+    results = dict(
+        os_testing.iter_evacuate_servers(servers, "node1", ["node2", "node3"], max_concurrent=1)
+    )
+
+    assert results[1]["destination"] == "node2"
+    assert results[1]["attempts"] == 1
+    # the second server retries on its rotated destination list, node3 first
+    assert results[2]["destination"] == "node3"
+    assert results[2]["attempts"] == 2
+    assert results[2]["errors"] == ["scheduler: no valid host"]
+
+
+def test_iter_evacuate_servers_gives_up(openstack, monkeypatch):
+    """Test a server left on its source host is reported once the retries are spent."""
+    monkeypatch.setattr(os_testing, "MIGRATION_POLL_INTERVAL", 0)
+    openstack.compute.get_server.return_value = MagicMock(
+        status="ACTIVE", task_state=None, compute_host="node1"
+    )
+
+    results = dict(
+        os_testing.iter_evacuate_servers([MagicMock(id=1)], "node1", ["node2"], retries=2)
+    )
+
+    # one scheduler attempt and one retry, there is no other destination left
+    assert openstack.compute.live_migrate_server.call_count == 2
+    assert results[1]["error"] == "node2: migration did not move the server"
+    assert len(results[1]["errors"]) == 2
+
+
+@pytest.mark.parametrize(
+    "stdout, exp_cache", [("hit\n", "hit"), ("miss\n", "miss"), ("rbd\n", "unknown")]
+)
+def test_image_cached(stdout, exp_cache):
+    """Test the image cache state, unknown on nodes with rbd ephemeral storage."""
+    node = MagicMock()
+    node.sudo.return_value = MagicMock(stdout=stdout)
+    with mock.patch.object(os_testing, "node_connection", return_value=node):
+        assert os_testing._image_cached("node1", "image-id") == exp_cache
+
+    command = node.sudo.call_args.args[0]
+    assert os_testing.NOVA_CONF in command
+    assert os_testing.NOVA_IMAGE_CACHE in command
+
+
+def test_image_cached_unreachable():
+    """Test the image cache state is unknown when the node cannot be checked."""
+    with mock.patch.object(os_testing, "node_connection", side_effect=OSError("no route")):
+        assert os_testing._image_cached("node1", "image-id") == "unknown"
+
+
+def test_iter_prewarm_image(openstack, monkeypatch):
+    """Test every node is pre-warmed on itself and yielded as soon as it is done."""
+    openstack.compute.services.side_effect = lambda binary, host: [
+        MagicMock(availability_zone="az1")
+    ]
+    openstack.compute.create_server.side_effect = lambda **kwargs: MagicMock(
+        id=kwargs["availability_zone"].split(":")[1]
+    )
+
+    async def wait_for_status(fetch, server_id, wait):
+        if server_id == "node1":
+            await asyncio.sleep(0.05)
+            raise SDKException("boot timeout")
+
+    monkeypatch.setattr(os_testing, "async_wait_for_status", wait_for_status)
+    monkeypatch.setattr(os_testing, "ensure_host_aggregate", MagicMock())
+    monkeypatch.setattr(os_testing, "ensure_net", MagicMock(return_value=(True, MagicMock())))
+    monkeypatch.setattr(os_testing, "ensure_flavor", MagicMock())
+    monkeypatch.setattr(os_testing, "_image_cached", lambda node, image_id: "miss")
+
+    results = list(os_testing.iter_prewarm_image(["node1", "node2"], "image", 4, "10.0.0.0/24"))
+
+    assert [node for node, _ in results] == ["node2", "node1"]
+    assert results[0][1]["status"] == "success"
+    assert results[0][1]["cache"] == "miss"
+    assert results[1][1]["status"] == "error"
+    assert results[1][1]["detail"] == "boot timeout"
+    zones = [
+        call.kwargs["availability_zone"] for call in openstack.compute.create_server.mock_calls
+    ]
+    assert sorted(zones) == ["az1:node1", "az1:node2"]
+    assert openstack.compute.delete_server.call_count == 2
@@ -0,0 +1,50 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for prom-textfile."""
+
+import prom_textfile
+
+
+def test_render_run():
+    """Test the units, labels and escaping of the exported series."""
+    points = [
+        ("node1", "uuid1", "rtt", 0.5),
+        ("node1", "uuid1", "loss", 25.0),
+        ('node"2', "uuid2", "rtt", None),
+        ("node1", "uuid1", "ssh", 1.0),
+    ]
+    text = prom_textfile.render_run("test-connectivity", 1700000000, 12.5, "success", points)
+    lines = text.splitlines()
+
+    assert 'cloudsupport_action_duration_seconds{test="test-connectivity"} 12.5' in lines
+    assert 'cloudsupport_action_success{test="test-connectivity"} 1.0' in lines
+    assert (
+        'cloudsupport_ping_rtt_seconds{test="test-connectivity",host="node1",instance="uuid1"} '
+        "0.0005" in lines
+    )
+    assert (
+        'cloudsupport_ping_loss_ratio{test="test-connectivity",host="node1",instance="uuid1"} '
+        "0.25" in lines
+    )
+    assert "uuid2" not in text and "ssh" not in text
+    assert lines.count("# TYPE cloudsupport_ping_rtt_seconds gauge") == 1
+    assert prom_textfile.escape_label('node"2\n') == 'node\\"2\\n'
+
+
+def test_render_run_max_series():
+    """Test that the number of sample series is capped."""
+    points = [("node1", "uuid{}".format(i), "boot-time", 10.0) for i in range(5)]
+    text = prom_textfile.render_run("create-test-instances", 0, 1, "success", points, max_series=3)
+
+    assert text.count("cloudsupport_boot_seconds{") == 3
+    assert 'cloudsupport_dropped_series{test="create-test-instances"} 2.0' in text
+
+
+def test_write_textfile(tmp_path):
+    """Test that the metrics file is replaced as a whole."""
+    (tmp_path / "cloudsupport-stop-vms.prom").write_text("old")
+    path = prom_textfile.write_textfile(tmp_path, "stop-vms", "new\n")
+
+    assert path.read_text() == "new\n"
+    assert oct(path.stat().st_mode & 0o777) == "0o644"
+    assert [p.name for p in tmp_path.iterdir()] == ["cloudsupport-stop-vms.prom"]
@@ -0,0 +1,120 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for results-db."""
+import results_db
+
+NOW = 1_700_000_000
+
+
+def test_connectivity_store_query(tmp_path):
+    """Test storing and querying sweep samples."""
+    store = results_db.ConnectivityStore(results_db.connect(tmp_path / "results.db"))
+    store.add_samples({"node1": (0.0, 0.5), "node2": (100.0, None)}, ts=NOW - 600)
+    store.add_samples({"node1": (50.0, 1.5)}, ts=NOW - 300)
+    store.add_samples({"node1": (0.0, 9.0)}, ts=NOW - 7200)
+
+    assert store.query(1, now=NOW) == {
+        "node1": {"samples": 2, "avg-loss": 25.0, "max-loss": 50.0, "avg-rtt": 1.0},
+        "node2": {"samples": 1, "avg-loss": 100.0, "max-loss": 100.0, "avg-rtt": None},
+    }
+    assert list(store.query(1, host="node2", now=NOW)) == ["node2"]
+
+
+def test_connectivity_store_downsample(tmp_path):
+    """Test old samples are folded into hourly rows and expired."""
+    store = results_db.ConnectivityStore(results_db.connect(tmp_path / "results.db"))
+    hour = (NOW - results_db.RAW_RETENTION) // 3600 * 3600 - 3600
+    store.add_samples({"node1": (0.0, 1.0)}, ts=hour + 60)
+    store.add_samples({"node1": (100.0, 3.0)}, ts=hour + 120)
+    store.add_samples({"node1": (0.0, 1.0)}, ts=NOW - 40 * 86400)
+    store.downsample(retention_days=30, now=NOW)
+
+    raw = store.db.execute("SELECT COUNT(*) FROM sweep_samples").fetchone()[0]
+    hourly = store.db.execute("SELECT ts, loss, max_loss, rtt, samples FROM sweep_hourly")
+    assert raw == 0
+    assert hourly.fetchall() == [(hour, 50.0, 100.0, 2.0, 2)]
+    assert store.query(72, now=NOW)["node1"]["samples"] == 2
+
+
+def test_run_history_compare_rolling_median(tmp_path):
+    """Test regression detection against the rolling median of previous runs."""
+    history = results_db.RunHistory(results_db.connect(tmp_path / "results.db"))
+    for boot_time in (10.0, 12.0, 11.0):
+        history.record(
+            "create-test-instances",
+            NOW,
+            30.0,
+            "success",
+            samples=[("node1", "boot-time", boot_time), ("node2", "boot-time", 20.0)],
+        )
+    run_id = history.record(
+        "create-test-instances",
+        NOW,
+        30.0,
+        "success",
+        samples=[
+            ("node1", "boot-time", 15.0),
+            ("node1", "boot-time", 14.0),
+            ("node2", "boot-time", 21.0),
+            ("node3", "boot-time", 9.0),
+        ],
+    )
+
+    comparison = history.compare("boot-time", window=3, threshold=20)
+    assert comparison["run"] == run_id
+    assert comparison["regressed"] == ["node1"]
+    assert comparison["hosts"]["node1"] == {
+        "value": 14.5,
+        "baseline": 11.0,
+        "change-pct": 31.8,
+        "regressed": True,
+    }
+    assert comparison["hosts"]["node2"]["regressed"] is False
+    assert comparison["hosts"]["node3"]["baseline"] is None
+
+
+def test_run_history_compare_baseline_and_trend(tmp_path):
+    """Test comparison against a given baseline run and metric trend."""
+    history = results_db.RunHistory(results_db.connect(tmp_path / "results.db"))
+    baseline = history.record(
+        "test-connectivity", NOW, 5.0, "success", samples=[("n1", "rtt", 1.0)]
+    )
+    history.record("test-connectivity", NOW + 60, 5.0, "success", samples=[("n1", "rtt", 3.0)])
+    run_id = history.record(
+        "test-connectivity", NOW + 120, 5.0, "success", samples=[("n1", "rtt", 1.1)]
+    )
+
+    assert history.compare("rtt", baseline=baseline)["regressed"] == []
+    assert [t["value"] for t in history.trend("rtt", "n1")] == [1.0, 3.0, 1.1]
+    assert [r["id"] for r in history.runs(limit=2)] == [run_id, run_id - 1]
+    assert history.compare("boot-time") == {"hosts": {}, "regressed": []}
+
+
+def test_run_history_compare_zero_baseline(tmp_path):
+    """Test a zero baseline is compared on the absolute delta instead of missing."""
+    history = results_db.RunHistory(results_db.connect(tmp_path / "results.db"))
+    baseline = history.record(
+        "test-connectivity",
+        NOW,
+        5.0,
+        "success",
+        samples=[("n1", "loss", 0.0), ("n2", "loss", 0.0)],
+    )
+    history.record(
+        "test-connectivity",
+        NOW + 60,
+        5.0,
+        "success",
+        samples=[("n1", "loss", 20.0), ("n2", "loss", 0.0)],
+    )
+
+    comparison = history.compare("loss", baseline=baseline)
+    assert comparison["regressed"] == ["n1"]
+    assert comparison["hosts"]["n1"] == {
+        "value": 20.0,
+        "baseline": 0,
+        "change": 20.0,
+        "change-pct": None,
+        "regressed": True,
+    }
+    assert comparison["hosts"]["n2"]["regressed"] is False
@@ -0,0 +1,158 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for the stale server nagios plugin."""
+
+import datetime
+import json
+import sys
+import time
+from unittest import mock
+
+import pytest
+import stale_server_check
+
+
+def updated_days_ago(days):
+    """Return an updated_at timestamp of days ago."""
+    updated = datetime.datetime.utcnow() - datetime.timedelta(days=days, hours=1)
+    return updated.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def run_check(status_file, *extra):
+    """Run the check and return its exit code."""
+    argv = ["check", "--cloud-name", "cloud1", "--name-prefix", "test-"]
+    argv += ["--status-file", str(status_file), *extra]
+    with mock.patch.object(sys, "argv", argv), pytest.raises(SystemExit) as exit_:
+        stale_server_check.nrpe_check()
+    return exit_.value.code
+
+
+def write_status(status_file, clouds):
+    """Write a status file with the servers of the clouds."""
+    status_file.write_text(json.dumps({"clouds": clouds}))
+
+
+def cloud_status(days, age=0):
+    """Return the collected status of a cloud with one server updated days ago."""
+    return {
+        "collected-at": time.time() - age,
+        "servers": [{"id": "uuid1", "name": "test-1", "updated_at": updated_days_ago(days)}],
+    }
+
+
+@pytest.mark.parametrize(
+    "days, age, exp_code, exp_output",
+    [
+        (1, 0, 0, "OK"),
+        (8, 0, 1, "WARNING: cloud1: 1 test servers older than 7 days"),
+        (15, 0, 2, "CRITICAL: cloud1: 1 test servers older than 14 days"),
+        (1, 3600, 1, "WARNING: cloud1: stale server data is 60 minutes old"),
+    ],
+)
+def test_nrpe_check(tmp_path, capsys, days, age, exp_code, exp_output):
+    """Test evaluating the collected servers and their age."""
+    status_file = tmp_path / "status.json"
+    write_status(status_file, {"cloud1": cloud_status(days, age)})
+    assert run_check(status_file) == exp_code
+    output = capsys.readouterr().out
+    assert exp_output in output
+    assert "| cloud1_servers=1 cloud1_stale_warn=" in output.splitlines()[0]
+
+
+@pytest.mark.parametrize(
+    "clouds, exp_code, exp_perfdata",
+    [("all", 2, ["region1_stale_crit=0", "region2_stale_crit=1"]), ("region1", 0, [])],
+)
+def test_nrpe_check_multi_cloud(tmp_path, capsys, clouds, exp_code, exp_perfdata):
+    """Test aggregating several clouds into one status."""
+    status_file = tmp_path / "status.json"
+    write_status(status_file, {"region1": cloud_status(1), "region2": cloud_status(15)})
+    argv = ["check", "--cloud-name", clouds, "--name-prefix", "test-"]
+    argv += ["--status-file", str(status_file)]
+    with mock.patch.object(sys, "argv", argv), mock.patch.object(
+        stale_server_check, "list_clouds", return_value=["region1", "region2"]
+    ), pytest.raises(SystemExit) as exit_:
+        stale_server_check.nrpe_check()
+    assert exit_.value.code == exp_code
+    first_line = capsys.readouterr().out.splitlines()[0]
+    for perfdata in exp_perfdata:
+        assert perfdata in first_line
+
+
+def test_nrpe_check_ignored(tmp_path):
+    """Test that ignored servers are skipped."""
+    status_file = tmp_path / "status.json"
+    write_status(status_file, {"cloud1": cloud_status(30)})
+    assert run_check(status_file, "--ignored-servers-uuids", "uuid1,uuid2") == 0
+
+
+def test_nrpe_check_no_data(tmp_path, capsys):
+    """Test the check before the first collection."""
+    assert run_check(tmp_path / "missing.json") == 3
+    assert "no stale server data collected yet" in capsys.readouterr().out
+    write_status(tmp_path / "status.json", {"other": cloud_status(1)})
+    assert run_check(tmp_path / "status.json") == 3
+
+
+def test_collect(tmp_path):
+    """Test that a failed collection keeps the servers and records the error."""
+    status_file = tmp_path / "status.json"
+    args = mock.MagicMock(status_file=str(status_file), cloud_name="all", name_prefix="test-")
+    servers = [{"id": "uuid1", "name": "test-1", "updated_at": updated_days_ago(1)}]
+    with mock.patch.object(
+        stale_server_check, "list_clouds", return_value=["region1", "region2"]
+    ), mock.patch.object(stale_server_check, "collect_servers", return_value=servers):
+        stale_server_check.collect(args)
+    status = json.loads(status_file.read_text())["clouds"]
+    assert status["region1"]["servers"] == servers
+    assert status["region2"]["servers"] == servers
+    collected_at = status["region1"]["collected-at"]
+
+    def collect_servers(_, cloud):
+        if cloud == "region1":
+            raise Exception("timeout")
+        return []
+
+    args.cloud_name = "region1,region2"
+    with mock.patch.object(
+        stale_server_check, "collect_servers", side_effect=collect_servers
+    ), pytest.raises(SystemExit):
+        stale_server_check.collect(args)
+    status = json.loads(status_file.read_text())["clouds"]
+    assert status["region1"]["servers"] == servers
+    assert status["region1"]["collected-at"] == collected_at
+    assert status["region1"]["last-error"] == "timeout"
+    assert status["region2"]["servers"] == []
+    assert "last-error" not in status["region2"]
+
+
+def test_collect_removed_cloud(tmp_path, capsys):
+    """Test that a cloud removed from clouds.yaml is dropped and no longer checked."""
+    status_file = tmp_path / "status.json"
+    args = mock.MagicMock(status_file=str(status_file), cloud_name="all", name_prefix="test-")
+    servers = [{"id": "uuid1", "name": "test-1", "updated_at": updated_days_ago(15)}]
+    with mock.patch.object(
+        stale_server_check, "list_clouds", return_value=["region1", "region2"]
+    ), mock.patch.object(stale_server_check, "collect_servers", return_value=servers):
+        stale_server_check.collect(args)
+    with mock.patch.object(
+        stale_server_check, "list_clouds", return_value=["region1"]
+    ), mock.patch.object(stale_server_check, "collect_servers", return_value=[]):
+        stale_server_check.collect(args)
+        argv = ["check", "--cloud-name", "all", "--name-prefix", "test-"]
+        argv += ["--status-file", str(status_file)]
+        with mock.patch.object(sys, "argv", argv), pytest.raises(SystemExit) as exit_:
+            stale_server_check.nrpe_check()
+
+    assert list(json.loads(status_file.read_text())["clouds"]) == ["region1"]
+    assert exit_.value.code == 0
+    assert "region2" not in capsys.readouterr().out
+
+
+def test_collect_no_clouds(tmp_path):
+    """Test collecting with no cloud in clouds.yaml writes an empty status."""
+    status_file = tmp_path / "status.json"
+    args = mock.MagicMock(status_file=str(status_file), cloud_name="all", name_prefix="test-")
+    with mock.patch.object(stale_server_check, "list_clouds", return_value=[]):
+        stale_server_check.collect(args)
+    assert json.loads(status_file.read_text()) == {"clouds": {}}
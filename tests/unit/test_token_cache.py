@@ -0,0 +1,89 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for token-cache."""
+import datetime
+import json
+from unittest import mock
+
+import pytest
+import token_cache
+from keystoneauth1.identity import v3
+
+
+@pytest.fixture
+def clouds_yaml(tmp_path):
+    """Return a clouds.yaml file."""
+    path = tmp_path / "clouds.yaml"
+    path.write_text("clouds: {cloud1: {auth: {username: admin}}}")
+    return path
+
+
+def auth_state(expires_in):
+    """Return the auth state of a token expiring in seconds."""
+    expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=expires_in)
+    body = {"token": {"expires_at": expires.strftime("%Y-%m-%dT%H:%M:%S.000000Z"), "catalog": []}}
+    return json.dumps({"auth_token": "cached-token", "body": body})
+
+
+def test_cache_path(clouds_yaml, tmp_path):
+    """Test that the cache file changes with clouds.yaml."""
+    path = token_cache.cache_path("cloud1", clouds_yaml, tmp_path)
+    assert path.name.startswith("cloud1-")
+    assert token_cache.cache_path("cloud2", clouds_yaml, tmp_path) != path
+    clouds_yaml.write_text("clouds: {cloud1: {auth: {username: other}}}")
+    assert token_cache.cache_path("cloud1", clouds_yaml, tmp_path) != path
+
+
+@pytest.mark.parametrize("expires_in, exp_restored", [(3600, True), (60, False)])
+def test_restore(tmp_path, expires_in, exp_restored):
+    """Test that tokens close to expiry are not reused."""
+    path = tmp_path / "cache.json"
+    path.write_text(auth_state(expires_in))
+    auth = v3.Token("http://keystone/v3", "token")
+    assert token_cache.restore(auth, path) is exp_restored
+    assert (auth.auth_ref is not None) is exp_restored
+
+
+def test_restore_missing(tmp_path):
+    """Test restoring from a missing cache file."""
+    assert token_cache.restore(v3.Token("http://keystone/v3", "token"), tmp_path / "x") is False
+
+
+def test_save(tmp_path):
+    """Test that the cache is written atomically with restricted permissions."""
+    auth = v3.Token("http://keystone/v3", "token")
+    auth.set_auth_state(auth_state(3600))
+    path = tmp_path / "cache" / "cloud1.json"
+    with mock.patch("token_cache.grp.getgrnam", side_effect=KeyError), mock.patch(
+        "token_cache.os.chown"
+    ):
+        token_cache.save(auth, path)
+    assert json.loads(path.read_text())["auth_token"] == "cached-token"
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert list(path.parent.iterdir()) == [path]
+
+
+@pytest.mark.parametrize("cached, exp_auth", [(True, False), (False, True)])
+def test_connect(clouds_yaml, tmp_path, cached, exp_auth):
+    """Test that connect only authenticates without a valid cached token."""
+    path = token_cache.cache_path("cloud1", clouds_yaml, tmp_path)
+    if cached:
+        path.write_text(auth_state(3600))
+    conn = mock.MagicMock()
+    conn.session.auth = v3.Token("http://keystone/v3", "token")
+    with mock.patch("token_cache.openstack.connect", return_value=conn) as connect, mock.patch(
+        "token_cache.save"
+    ) as save, mock.patch.object(v3.Token, "get_access") as get_access:
+        assert token_cache.connect("cloud1", clouds_yaml, tmp_path, cacert="ca") is conn
+
+    connect.assert_called_once_with(cloud="cloud1", cacert="ca")
+    assert get_access.called is exp_auth
+    assert save.called is exp_auth
+
+
+def test_invalidate(tmp_path):
+    """Test dropping all cached tokens."""
+    (tmp_path / "cloud1-abc.json").write_text("{}")
+    token_cache.invalidate(tmp_path)
+    assert list(tmp_path.iterdir()) == []
+    token_cache.invalidate(tmp_path / "missing")
@@ -0,0 +1,101 @@
+# Copyright 2025 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Unittests for warm-pool."""
+
+import json
+from datetime import datetime, timedelta
+from unittest import mock
+from unittest.mock import MagicMock
+
+import pytest
+import warm_pool
+
+
+def mock_server(id_, node, status="ACTIVE", compute_host=None, age_hours=1):
+    """Return mocked pool server object."""
+    created = datetime.utcnow() - timedelta(hours=age_hours)
+    server = MagicMock()  # name needs to be set with configure_mock
+    server.configure_mock(
+        id=id_,
+        name="pool-cloudsupport-test-{}".format(node),
+        status=status,
+        compute_host=compute_host or node,
+        created_at=created.strftime("%Y-%m-%dT%H:%M:%SZ"),
+    )
+    return server
+
+
+@pytest.fixture
+def cloud(tmp_path):
+    """Mock openstack connection and the pool status file."""
+    conn = MagicMock()
+    conn.compute.find_aggregate.return_value = MagicMock(hosts=["node1", "node2", "node3"])
+    with mock.patch.object(warm_pool, "con", return_value=conn), mock.patch.object(
+        warm_pool, "ensure_net", return_value=(True, MagicMock(id="net1"))
+    ), mock.patch.object(warm_pool, "ensure_sg_rules"), mock.patch.object(
+        warm_pool, "STATUS_FILE", tmp_path / "warm_pool.json"
+    ):
+        yield conn
+
+
+def test_replenish(cloud):
+    """Test that failed, old and stray pool instances are replaced."""
+    cloud.compute.servers.return_value = [
+        mock_server("srv1", "node1"),
+        mock_server("srv2", "node2", status="ERROR"),
+        mock_server("srv3", "node3", age_hours=30),
+        mock_server("srv4", "node4"),
+    ]
+    cloud.compute.create_server.side_effect = lambda name, **kwargs: MagicMock(id=name)
+    cloud.compute.get_server.side_effect = lambda server_id: MagicMock(
+        id=server_id, status="ERROR" if server_id.endswith("node3") else "ACTIVE"
+    )
+
+    status = warm_pool.replenish(
+        "pool-agg", "image", 4, "192.168.99.0/24", "cloudsupport-test", max_age=24 * 3600
+    )
+
+    assert status["nodes"]["node1"] == {"instance": "srv1", "action": "kept", "status": "ACTIVE"}
+    assert status["nodes"]["node2"]["action"] == "booted"
+    assert status["nodes"]["node3"]["action"] == "error"
+    assert sorted(status["deleted"]) == ["srv2", "srv3", "srv4"]
+    kwargs = cloud.compute.create_server.call_args.kwargs
+    assert kwargs["availability_zone"].endswith(":node3")
+    assert json.loads(warm_pool.STATUS_FILE.read_text())["aggregate"] == "pool-agg"
+
+
+def test_replenish_empty_aggregate(cloud):
+    """Test that an aggregate without hosts deletes the whole pool."""
+    cloud.compute.find_aggregate.return_value = MagicMock(hosts=None)
+    test_server = MagicMock()
+    test_server.configure_mock(id="srv9", name="cloudsupport-test-1")
+    cloud.compute.servers.return_value = [mock_server("srv1", "node1"), test_server]
+
+    status = warm_pool.replenish("pool-agg", "image", 4, "192.168.99.0/24", "cloudsupport-test")
+
+    assert status["nodes"] == {}
+    assert status["deleted"] == ["srv1"]
+
+
+def test_pool_status(cloud):
+    """Test the health and age of the pool, and the outcome of the last replenishment."""
+    cloud.compute.servers.return_value = [
+        mock_server("srv1", "node1", age_hours=2),
+        mock_server("srv2", "node2", compute_host="node9"),
+    ]
+    warm_pool.STATUS_FILE.write_text(
+        json.dumps(
+            {
+                "updated": 1700000000,
+                "nodes": {"node3": {"action": "error", "error": "boom"}},
+            }
+        )
+    )
+
+    status = warm_pool.pool_status("cloudsupport-test")
+
+    assert status["healthy"] == 1
+    assert 7190 < status["nodes"]["node1"]["age-seconds"] < 7210
+    assert status["nodes"]["node2"]["healthy"] is False
+    assert status["last-replenish"] == {"updated": 1700000000, "errors": {"node3": "boom"}}
+    assert status["missing"] == ["node3"]